@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+r"""
+Bethe lattice Green function kernels
+====================================
+
+Throughput of the compiled :func:`dmft.common.semi_circle_hiltrans` and
+:func:`dmft.common.greenF` against the numpy expressions they replace,
+on a real-axis grid with a random self-energy, with and without an
+`out` buffer and on a batch of self-energies.
+
+    python benchmarks/bench_bethe_kernels.py -points 65536 -repeat 200
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+import argparse
+import timeit
+import numpy as np
+import dmft.common as gf
+
+
+def numpy_hiltrans(zeta, D=1):
+    """Semi-circle Hilbert transform with numpy temporaries"""
+    sqr = np.sqrt(zeta**2 - D**2)
+    sqr = np.sign(sqr.imag) * sqr
+    return 2 * (zeta - sqr) / D**2
+
+
+def numpy_greenF(w_n, sigma=0, mu=0, D=1):
+    """Bethe lattice Green function with numpy temporaries"""
+    zeta = 1.j * w_n + mu - sigma
+    sq = np.sqrt((zeta)**2 - D**2)
+    sig = np.sign(sq.imag * w_n)
+    return 2. / (zeta + sig * sq)
+
+
+def timing(func, repeat):
+    """Mean time of a call in ms"""
+    return timeit.timeit(func, number=repeat) / repeat * 1e3
+
+
+def main(points, batch, repeat):
+    rng = np.random.RandomState(0)
+    w = np.linspace(-6, 6, points)
+    sigma = rng.randn(points) - 1j * np.abs(rng.randn(points))
+    zeta = w + 5e-3j - sigma
+    out = np.empty(points, dtype=complex)
+    sigmas = rng.randn(batch, points) - 1j * np.abs(rng.randn(batch, points))
+    zetas = w + 5e-3j - sigmas
+    w_n = np.linspace(.01, 60, points)
+
+    assert np.allclose(gf.semi_circle_hiltrans(zeta), numpy_hiltrans(zeta))
+    assert np.allclose(gf.greenF(w_n, sigma), numpy_greenF(w_n, sigma))
+
+    cases = [
+        ('semi_circle_hiltrans', lambda: numpy_hiltrans(zeta),
+         lambda: gf.semi_circle_hiltrans(zeta)),
+        ('semi_circle_hiltrans out=', lambda: numpy_hiltrans(zeta),
+         lambda: gf.semi_circle_hiltrans(zeta, out=out)),
+        ('semi_circle_hiltrans batch', lambda: numpy_hiltrans(zetas),
+         lambda: gf.semi_circle_hiltrans(zetas)),
+        ('greenF', lambda: numpy_greenF(w_n, sigma),
+         lambda: gf.greenF(w_n, sigma)),
+        ('greenF out=', lambda: numpy_greenF(w_n, sigma),
+         lambda: gf.greenF(w_n, sigma, out=out)),
+    ]
+    print('{} points, batch of {}, mean of {} calls'.format(points, batch,
+                                                            repeat))
+    print('{:28} {:>10} {:>10} {:>8}'.format('kernel', 'numpy ms',
+                                              'ufunc ms', 'speedup'))
+    for name, reference, compiled in cases:
+        compiled()  # compile before timing
+        t_ref, t_new = timing(reference, repeat), timing(compiled, repeat)
+        print('{:28} {:10.3f} {:10.3f} {:8.2f}'.format(name, t_ref, t_new,
+                                                       t_ref / t_new))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bethe lattice Green function kernels benchmark')
+    parser.add_argument('-points', type=int, default=2**16,
+                        help='Points of the frequency grid')
+    parser.add_argument('-batch', type=int, default=8,
+                        help='Self-energies of the batch case')
+    parser.add_argument('-repeat', type=int, default=200,
+                        help='Calls averaged per timing')
+    args = parser.parse_args()
+    main(args.points, args.batch, args.repeat)
@@ -40,9 +40,11 @@ def processing(BETA, U, tp, ax):
     giw_s = 0.5j * (giw_s + giw_a).imag + 0.5 * (giw_s - giw_a).real
 
     x = int(.9 * BETA)
-    der1 = (giw_s.real * w_n**2)[x:int(1.2 * BETA)].mean()
-    der2 = ((giw_s.imag + 1 / w_n) * w_n**3)[x:int(1.2 * BETA)].mean()
-    tails = -1j / w_n + der1 / w_n**2 + der2 * 1j / w_n**3
+    window = slice(x, int(1.2 * BETA))
+    tw_n = w_n[window]
+    mom2, mom3 = gf.tail_moments(tw_n, giw_s[window] - 1 / (1j * tw_n),
+                                 (2, 3))
+    tails = 1 / (1j * w_n) + mom2 / (1j * w_n)**2 + mom3 / (1j * w_n)**3
     giw_s[x:] = tails[x:]
 
     sidab = 1j * w_n - tp - .25 * giw_s - 1 / giw_s
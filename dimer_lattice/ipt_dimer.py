@@ -14,18 +14,18 @@ disk. Keep that in mind when dealing with files
 # Author: Óscar Nájera
 
 from __future__ import division, absolute_import, print_function
-from math import ceil, log
+import argparse
 import itertools
 import json
 import os
 import numpy as np
 from joblib import Parallel, delayed
-import dmft.dimer as dimer
-import dmft.common as gf
-import dmft.ipt_imag as ipt
+from dmft.store import SolutionStore
+from dmft.sweep import sweep, sweep_path
 
 
-def loop_tp_u(tprange, u_range, beta, filestr, seed='mott gap'):
+def loop_tp_u(tprange, u_range, beta, filestr, seed='mott gap',
+              store_dir=None):
 
     save_dir = filestr.format(beta)
     if np.allclose(tprange, tprange[0]) and 'tp' not in save_dir:
@@ -43,29 +43,30 @@ def loop_tp_u(tprange, u_range, beta, filestr, seed='mott gap'):
 
 ###############################################################################
 
-    tau, w_n = gf.tau_wn_setup(
-        dict(BETA=beta, N_MATSUBARA=max(2**ceil(log(6 * beta) / log(2)), 256)))
-    giw_d, giw_o = dimer.gf_met(w_n, 0., tprange[0], 0.5, 0.)
-    if seed == 'mott gap':
-        giw_d, giw_o = 1 / (1j * w_n - 4j / w_n), np.zeros_like(w_n) + 0j
-
-    giw_s = []
-    for tp, u_int in zip(tprange, u_range):
-        giw_d, giw_o, loops = dimer.ipt_dmft_loop(
-            beta, u_int, tp, giw_d, giw_o, tau, w_n, 1 / 5 / beta)
-        giw_s.append((giw_d.imag, giw_o.real))
+    seed = 'insulator' if seed == 'mott gap' else 'metal'
+    if store_dir is None:
+        store_dir = os.path.join(os.path.dirname(save_dir), 'solutions')
+    sols, _ = sweep(sweep_path(u_range, tprange, beta), seed, order=0,
+                    conv=1 / 5 / beta, store=SolutionStore(store_dir))
+    giw_s = [(giw_d.imag, giw_o.real) for giw_d, giw_o, _ in sols]
     np.save(save_dir + '/giw', np.array(giw_s))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='IPT dimer phase diagram')
+    parser.add_argument('--data-dir', default='disk',
+                        help='Directory of the results and the solution '
+                        'store')
+    DATA = parser.parse_args().data_dir
+    STORE = os.path.join(DATA, 'solutions')
 
     tpr = np.arange(0, 1.1, 0.02)
     ur = np.arange(0, 4.5, 0.1)
     BETARANGE = [1000., 100., 30.]
-    jobs = [(job.T[0], job.T[1], BETA, 'disk/phase_Dimer_ipt_met_B{:.5}', 'metal')
+    jobs = [(job.T[0], job.T[1], BETA, DATA + '/phase_Dimer_ipt_met_B{:.5}', 'metal', STORE)
             for BETA in BETARANGE
             for job in np.array(list(itertools.product(tpr, ur))).reshape(len(tpr), len(ur), 2)]
-    jobs += [(job.T[0], job.T[1][::-1], BETA, 'disk/phase_Dimer_ipt_ins_B{:.5}')
+    jobs += [(job.T[0], job.T[1][::-1], BETA, DATA + '/phase_Dimer_ipt_ins_B{:.5}', 'mott gap', STORE)
              for BETA in BETARANGE
              for job in np.array(list(itertools.product(tpr, ur))).reshape(len(tpr), len(ur), 2)]
 
@@ -73,10 +74,10 @@ if __name__ == "__main__":
     tpr = [0, .15, .3, .5]
     ur = np.arange(0, 4.5, 0.1)
     BETARANGE = 1 / np.arange(1 / 500., .14, 1 / 400)
-    jobs = [(job.T[0], job.T[1], BETA, 'disk/phase_Dimer_ipt_met_tp{}/B{{:.5}}'.format(job[0][0]), 'metal')
+    jobs = [(job.T[0], job.T[1], BETA, DATA + '/phase_Dimer_ipt_met_tp{}/B{{:.5}}'.format(job[0][0]), 'metal', STORE)
             for BETA in BETARANGE
             for job in np.array(list(itertools.product(tpr, ur))).reshape(len(tpr), len(ur), 2)]
-    jobs += [(job.T[0], job.T[1][::-1], BETA, 'disk/phase_Dimer_ipt_ins_tp{}/B{{:.5}}'.format(job[0][0]))
+    jobs += [(job.T[0], job.T[1][::-1], BETA, DATA + '/phase_Dimer_ipt_ins_tp{}/B{{:.5}}'.format(job[0][0]), 'mott gap', STORE)
              for BETA in BETARANGE
              for job in np.array(list(itertools.product(tpr, ur))).reshape(len(tpr), len(ur), 2)]
 
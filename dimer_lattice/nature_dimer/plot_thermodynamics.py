@@ -64,7 +64,7 @@ ax[1].plot([tpr[tpi]] * 4, U_int, 'ro', ms=10)
 
 
 def loop_beta(u_int, tp, betarange, seed):
-    avgH = []
+    sols = []
     for beta in betarange:
         tau, w_n = gf.tau_wn_setup(
             dict(BETA=beta, N_MATSUBARA=max(2**ceil(log(8 * beta) / log(2)), 256)))
@@ -74,15 +74,24 @@ def loop_beta(u_int, tp, betarange, seed):
 
         giw_d, giw_o, _ = dimer.ipt_dmft_loop(
             beta, u_int, tp, giw_d, giw_o, tau, w_n, 1e-6)
+        sols.append((giw_d, giw_o))
 
-        ekin = dimer.ekin(giw_d[:int(8 * beta)], giw_o[:int(8 * beta)],
-                          w_n[:int(8 * beta)], tp, beta)
+    return sols
 
-        epot = dimer.epot(giw_d[:int(8 * beta)], w_n[:int(8 * beta)],
-                          beta, u_int ** 2 / 4 + tp**2 + 0.25, ekin, u_int)
-        avgH.append(ekin + epot)
 
-    return np.array(avgH)
+def internal_energy(sols, u_int, tp, betarange):
+    """Energies of all solutions in a single vectorized call, summing
+    the first 8 beta frequencies of each one"""
+    giw_d, lengths = gf.stack_padded([g_d for g_d, _ in sols])
+    giw_o, _ = gf.stack_padded([g_o for _, g_o in sols])
+    w_n = gf.matsubara_freq(betarange[:, None], lengths.max())
+    n_freq = (8 * betarange).astype(int)
+    u_int = np.asarray(u_int)
+
+    ekin = dimer.ekin_batch(giw_d, giw_o, w_n, tp, betarange, n_freq=n_freq)
+    epot = dimer.epot_batch(giw_d, w_n, betarange, u_int**2 / 4 + tp**2 + 0.25,
+                            ekin, u_int, n_freq)
+    return ekin + epot
 
 fac = np.arctan(25 * np.sqrt(3) / 0.4)
 temp = np.tan(np.linspace(5e-3, fac, 195)) * 0.4 / np.sqrt(3)
@@ -90,8 +99,11 @@ BETARANGE = 1 / temp
 
 
 start = ['M', 'M', 'I', 'I']
-avgH = [loop_beta(u_int, tpr[tpi], BETARANGE, seed)
-        for u_int, seed in zip(U_int, start)]
+sols = sum([loop_beta(u_int, tpr[tpi], BETARANGE, seed)
+            for u_int, seed in zip(U_int, start)], [])
+avgH = internal_energy(sols, np.repeat(U_int, len(BETARANGE)), tpr[tpi],
+                       np.tile(BETARANGE, len(U_int)))
+avgH = avgH.reshape(len(U_int), len(BETARANGE))
 
 ###############################################################################
 # Internal Energy
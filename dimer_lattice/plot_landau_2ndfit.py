@@ -17,35 +17,30 @@ import matplotlib.pyplot as plt
 import dmft.dimer as dimer
 import dmft.common as gf
 import dmft.ipt_imag as ipt
+from dmft.sweep import sweep, sweep_path
 
 
 def loop_u_tp(u_range, tprange, beta, seed='mott gap'):
     tau, w_n = gf.tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
-    giw_d, giw_o = dimer.gf_met(w_n, 0., 0., 0.5, 0.)
-    if seed == 'ins':
-        giw_d, giw_o = 1 / (1j * w_n + 4j / w_n), np.zeros_like(w_n) + 0j
-
-    giw_s = []
-    sigma_iw = []
-    ekin, epot = [], []
-    iterations = []
-    for u_int, tp in zip(u_range, tprange):
-        giw_d, giw_o, loops = dimer.ipt_dmft_loop(
-            beta, u_int, tp, giw_d, giw_o, tau, w_n)
-        giw_s.append((giw_d, giw_o))
-        iterations.append(loops)
-        g0iw_d, g0iw_o = dimer.self_consistency(
-            1j * w_n, 1j * giw_d.imag, giw_o.real, 0., tp, 0.25)
-        siw_d, siw_o = ipt.dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau, w_n)
-        sigma_iw.append((siw_d.copy(), siw_o.copy()))
-
-        ekin.append(dimer.ekin(giw_d, giw_o, w_n, tp, beta))
-
-        epot.append(dimer.epot(giw_d, w_n, beta, u_int **
-                               2 / 4 + tp**2, ekin[-1], u_int))
-    print(np.array(iterations))
+    sols, iterations = sweep(sweep_path(u_range, tprange, beta),
+                             'insulator' if seed == 'ins' else 'metal',
+                             order=0, conv=1e-12,
+                             grid=lambda beta: (tau, w_n))
+    giw_d = np.array([g_d for g_d, _, _ in sols])
+    giw_o = np.array([g_o for _, g_o, _ in sols])
+    giw_s = np.stack((giw_d, giw_o), 1)
+
+    g0iw_d, g0iw_o = dimer.self_consistency(
+        1j * w_n, 1j * giw_d.imag, giw_o.real, 0., tprange[:, None], 0.25)
+    sigma_iw = np.stack(ipt.dimer_sigma(u_range, tprange, g0iw_d, g0iw_o,
+                                        tau, w_n), 1)
+
+    ekin = dimer.ekin_batch(giw_d, giw_o, w_n, tprange, beta)
+    epot = dimer.epot_batch(giw_d, w_n, beta, u_range**2 / 4 + tprange**2,
+                            ekin, u_range)
+    print(iterations)
     # last division in energies because I want per spin epot
-    return np.array(giw_s), np.array(sigma_iw), np.array(ekin) / 4, np.array(epot) / 4, w_n
+    return giw_s, sigma_iw, ekin / 4, epot / 4, w_n
 
 
 # calculating multiple regions
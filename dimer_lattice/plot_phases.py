@@ -171,13 +171,12 @@ def estimate_zero_w_sigma_U_vs_tp(tpr, u_range, beta, phase):
             phase, beta, tp)
         gfs = np.load(filestr)
 
-        for i, u_int in enumerate(u_range):
-            giw_d, giw_o = 1j * gfs[i][0], gfs[i][1]
-            g0iw_d, g0iw_o = dimer.self_consistency(
-                1j * w_n, giw_d, giw_o, 0., tp, 0.25)
-            siw_d, siw_o = ipt.dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau, w_n)
-            sd_zew.append(np.polyfit(w_n[:2], siw_d[:2].imag, 1))
-            so_zew.append(np.polyfit(w_n[:2], siw_o[:2].real, 1))
+        giw_d, giw_o = 1j * gfs[:, 0], gfs[:, 1]
+        g0iw_d, g0iw_o = dimer.self_consistency(
+            1j * w_n, giw_d, giw_o, 0., tp, 0.25)
+        siw_d, siw_o = ipt.dimer_sigma(u_range, tp, g0iw_d, g0iw_o, tau, w_n)
+        sd_zew.extend(np.polyfit(w_n[:2], siw_d[:, :2].imag.T, 1).T)
+        so_zew.extend(np.polyfit(w_n[:2], siw_o[:, :2].real.T, 1).T)
 
     sd_zew = np.array(sd_zew).reshape(len(tpr), len(u_range), -1)
     so_zew = np.array(so_zew).reshape(len(tpr), len(u_range), -1)
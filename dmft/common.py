@@ -9,9 +9,13 @@ Fourier Transforms from Matsubara frequencies to Imaginary time.
 
 from __future__ import absolute_import, division, print_function
 
+import math
+from joblib import Parallel, delayed, effective_n_jobs
+from numba import njit, vectorize
 import numpy as np
-from numpy.fft import fft, ifft
-from scipy.linalg import lstsq
+import scipy.fft as sfft
+from scipy.interpolate import CubicSpline
+from scipy.special import comb, euler, factorial
 
 
 def matsubara_freq(beta=16., size=256, fer=1):
@@ -60,13 +64,203 @@ def tau_wn_setup(parms):
     return tau, w_n
 
 
-def greenF(w_n, sigma=0, mu=0, D=1):
+def sparse_matsubara(beta, n_dense, n_total, n_log=64):
+    r"""Non uniform grid of positive fermionic Matsubara frequencies
+
+    Keeps the first `n_dense` frequencies and samples the rest, up to
+    index `n_total - 1`, logarithmically. Each point carries the weight of
+    the dense frequencies it represents, from a linear interpolation in
+    the frequency index, such that
+
+    .. math:: \sum_{n=0}^{n_{total}-1} f(i\omega_n) \approx
+        \sum_k W_k f(i\omega_{n_k})
+
+    The weights sum to `n_total`, so analytic tail corrections written
+    for the dense grid hold unchanged.
+
+    Parameters
+    ----------
+    beta : float
+            Inverse temperature of the system
+    n_dense : int
+            Amount of first frequencies kept
+    n_total : int
+            Size of the represented dense grid
+    n_log : int
+            Logarithmic samples above `n_dense`
+
+    Returns
+    -------
+    tuple (index int ndarray, w_n real ndarray, weights real ndarray)
+
+    See also
+    --------
+    sparse_matsubara_interp
+    """
+    tail = np.geomspace(n_dense, n_total - 1, n_log) if n_total > n_dense \
+        else []
+    index = np.unique(np.concatenate((np.arange(min(n_dense, n_total)),
+                                      np.rint(tail)))).astype(int)
+    gaps = np.diff(index) - 1
+    weights = np.ones(len(index))
+    weights[:-1] += gaps / 2
+    weights[1:] += gaps / 2
+
+    return index, np.pi * (1 + 2 * index) / beta, weights
+
+
+def sparse_matsubara_interp(g_iw, w_n, w_n_dense):
+    r"""Interpolate functions from a sparse onto a dense Matsubara grid
+
+    A cubic spline of :math:`i\omega_nG(i\omega_n)`, smooth and bounded
+    at high frequencies, is done in the variable :math:`1/\omega_n`.
+    Frequencies present on both grids keep their values.
+
+    Parameters
+    ----------
+    g_iw : complex ndarray
+        Functions on the last axis, sampled on `w_n`
+    w_n : real 1D ndarray
+        Sparse Matsubara frequencies, increasing
+    w_n_dense : real 1D ndarray
+        Target Matsubara frequencies
+    """
+    spline = CubicSpline(1 / w_n[::-1], (1j * w_n * g_iw)[..., ::-1],
+                         axis=-1)
+    return spline(1 / w_n_dense) / (1j * w_n_dense)
+
+
+def tail_extend(g_iw, w_n, w_n_fine, powers=(1, 2, 3), window=None):
+    r"""Extend functions to higher Matsubara frequencies with their tail
+
+    The moments of the high frequency expansion are fitted by
+    :func:`tail_moments` on the last frequencies of `w_n`, they give the
+    values on the frequencies of `w_n_fine` beyond `w_n`
+
+    .. math:: G(i\omega_n) \approx \sum_p \frac{M_p}{(i\omega_n)^p}
+
+    Parameters
+    ----------
+    g_iw : complex ndarray
+        Functions on the last axis, sampled on `w_n`
+    w_n : real 1D ndarray
+        Positive Matsubara frequencies
+    w_n_fine : real 1D ndarray
+        Positive Matsubara frequencies of the same temperature, at least
+        as many as `w_n`
+    powers : sequence of int
+        Powers of the expansion
+    window : int
+        Last frequencies used in the fit, by default a quarter of them
+
+    Returns
+    -------
+    complex ndarray with the shape of `g_iw` but len(w_n_fine) on the
+    last axis
+    """
+    n_freq = len(w_n)
+    window = window or max(n_freq // 4, 2 * len(powers))
+    moments = tail_moments(w_n[-window:], g_iw[..., -window:], powers)
+    iw_n = 1j * np.asarray(w_n_fine[n_freq:])
+    out = np.empty(g_iw.shape[:-1] + (len(w_n_fine),), dtype=complex)
+    out[..., :n_freq] = g_iw
+    out[..., n_freq:] = sum(moments[..., i, None] / iw_n**p
+                            for i, p in enumerate(powers))
+    return out
+
+
+def stack_padded(arrays, fill=0.):
+    """Stack arrays of different lengths on the last axis, padding the
+    short ones with `fill`
+
+    Parameters
+    ----------
+    arrays : sequence of ndarray
+        Of equal leading shape
+
+    Returns
+    -------
+    tuple (stacked ndarray, lengths int ndarray)
+    """
+    lengths = np.array([np.shape(arr)[-1] for arr in arrays])
+    first = np.asarray(arrays[0])
+    out = np.full((len(arrays),) + first.shape[:-1] + (lengths.max(),),
+                  fill, dtype=np.result_type(*arrays))
+    for row, arr in zip(out, arrays):
+        row[..., :np.shape(arr)[-1]] = arr
+    return out, lengths
+
+
+def matsubara_sum(summand, n_freq=None, weights=1.):
+    """Sum over the last axis of stacked Matsubara arrays
+
+    Rows only count their first `n_freq` frequencies, the rest is padding
+    and ignored even if it holds non finite values.
+
+    Parameters
+    ----------
+    summand : ndarray
+        Functions on the last axis
+    n_freq : int ndarray, optional
+        Frequencies used by each row, all by default
+    weights : real ndarray
+        Quadrature weights of a sparse grid, see :func:`sparse_matsubara`
+
+    Returns
+    -------
+    ndarray of the leading shape of `summand`
+    """
+    summand = summand * weights
+    if n_freq is not None:
+        mask = np.arange(summand.shape[-1]) < np.asarray(n_freq)[..., None]
+        summand = np.where(mask, summand, 0)
+    return summand.sum(-1)
+
+
+@njit
+def _csqrt(z):
+    """Principal square root, cheaper than the generic complex one"""
+    re_z, im_z = z.real, z.imag
+    if re_z == 0. and im_z == 0.:
+        return complex(0., im_z)
+    t = math.sqrt((math.sqrt(re_z * re_z + im_z * im_z) + abs(re_z)) / 2)
+    if re_z >= 0:
+        return complex(t, im_z / (2 * t))
+    return complex(abs(im_z) / (2 * t), math.copysign(t, im_z))
+
+
+@njit(error_model='numpy')
+def _two_over(den):
+    norm = den.real * den.real + den.imag * den.imag
+    return complex(2 * den.real / norm, -2 * den.imag / norm)
+
+
+@vectorize
+def _bethe_greenF(w_n, sigma, mu, D):
+    zeta = 1j * w_n + mu - sigma
+    sq = _csqrt(zeta * zeta - D * D)
+    sig = np.sign((sq.imag * w_n).real)
+    return _two_over(zeta + sig * sq)
+
+
+@vectorize
+def _semi_circle_hiltrans(zeta, D):
+    sqr = _csqrt(zeta * zeta - D * D)
+    sqr = np.sign(sqr.imag) * sqr
+    return 2 * (zeta - sqr) / (D * D)
+
+
+def greenF(w_n, sigma=0, mu=0, D=1, out=None):
     r"""Calculate the Bethe lattice Green function, defined as part of the
     hilbert transform.
 
     .. math:: G(i\omega_n) = \frac{2}{i\omega_n + \mu - \Sigma +
         \sqrt{(i\omega_n + \mu - \Sigma)^2 - D^2}}
 
+    It is evaluated by a compiled ufunc, without intermediate arrays.
+    All arguments broadcast, e.g. a stack of self-energies or bandwidths
+    in one call.
+
     Parameters
     ----------
     w_n : real float array
@@ -77,6 +271,8 @@ def greenF(w_n, sigma=0, mu=0, D=1):
             chemical potential
     D : real
         Half-bandwidth of the bethe lattice non-interacting density of states
+    out : complex ndarray, optional
+        Buffer where to write the result
 
     Returns
     -------
@@ -84,22 +280,23 @@ def greenF(w_n, sigma=0, mu=0, D=1):
             Interacting Greens function in matsubara frequencies, all odd
             entries are zeros
     """
-    zeta = 1.j * w_n + mu - sigma
-    sq = np.sqrt((zeta)**2 - D**2)
-    sig = np.sign(sq.imag * w_n)
-    return 2. / (zeta + sig * sq)
+    return _bethe_greenF(w_n, np.asarray(sigma, dtype=np.complex128),
+                         np.asarray(mu, dtype=float),
+                         np.asarray(D, dtype=float), out=out)
 
 
-def semi_circle_hiltrans(zeta, D=1):
+def semi_circle_hiltrans(zeta, D=1, out=None):
     """Calculate the Hilbert transform with a semicircular DOS
 
+    Compiled ufunc, arguments broadcast and `out` can be given as
+    in :func:`greenF`
+
     See also
     --------
     greenF
     """
-    sqr = np.sqrt(zeta**2 - D**2)
-    sqr = np.sign(sqr.imag) * sqr
-    return 2 * (zeta - sqr) / D**2
+    return _semi_circle_hiltrans(np.asarray(zeta, dtype=np.complex128),
+                                 np.asarray(D, dtype=float), out=out)
 
 
 def semi_circle(energy, hopping):
@@ -108,7 +305,8 @@ def semi_circle(energy, hopping):
     return np.sqrt(4 * hopping**2 - energy**2) / (2 * np.pi * hopping**2)
 
 
-def gt_fouriertrans(g_tau, tau, w_n, tail_coef=(1., 0., 0.)):
+def gt_fouriertrans(g_tau, tau, w_n, tail_coef=(1., 0., 0.), out=None,
+                    spline=False):
     r"""Performs a forward fourier transform for the interacting Green function
     in which only the interval :math:`[0,\beta)` is required and output given
     into positive fermionic matsubara frequencies up to the given cutoff.
@@ -127,6 +325,12 @@ def gt_fouriertrans(g_tau, tau, w_n, tail_coef=(1., 0., 0.)):
             fermionic matsubara frequencies. Only use the positive ones
     tail_coef : list of floats size 3
         The first moments of the tails
+    out : complex ndarray, optional
+        Buffer where to write the result
+    spline : bool
+        Integrate a cubic spline of the data instead of the rectangle
+        rule, see :meth:`MatsubaraFourier.gt_fouriertrans`. The time array
+        can then be much coarser than the frequency array.
 
     Returns
     -------
@@ -136,13 +340,12 @@ def gt_fouriertrans(g_tau, tau, w_n, tail_coef=(1., 0., 0.)):
     See also
     --------
     freq_tail_fourier
-    gt_fouriertrans"""
-
-    beta = tau[1] + tau[-1]
-    freq_tail, time_tail = freq_tail_fourier(tail_coef, beta, tau, w_n)
+    gw_invfouriertrans
+    MatsubaraFourier"""
 
-    gtau = g_tau - time_tail
-    return beta * ifft(gtau * np.exp(1j * np.pi * tau / beta))[..., :len(w_n)] + freq_tail
+    plan = fourier_plan(tau[1] + tau[-1], len(tau), len(w_n), len(tail_coef),
+                        array_precision(g_tau))
+    return plan.gt_fouriertrans(g_tau, tail_coef, out, spline=spline)
 
 
 def fermi_dist(energy, beta):
@@ -187,7 +390,8 @@ def freq_tail_fourier(tail_coef, beta, tau, w_n):
     return freq_tail, time_tail
 
 
-def gw_invfouriertrans(g_iwn, tau, w_n, tail_coef=(1., 0., 0.)):
+def gw_invfouriertrans(g_iwn, tau, w_n, tail_coef=(1., 0., 0.), out=None,
+                       hermitian=False):
     r"""Performs an inverse fourier transform of the green Function in which
     only the imaginary positive matsubara frequencies
     :math:`\omega_n= \pi(2n+1)/\beta` with :math:`n \in \mathbb{N}` are used.
@@ -216,69 +420,446 @@ def gw_invfouriertrans(g_iwn, tau, w_n, tail_coef=(1., 0., 0.)):
             fermionic matsubara frequencies. Only use the positive ones
     tail_coef : list of floats size 3
         The first moments of the tails
-
+    out : real ndarray, optional
+        Buffer where to write the result
+    hermitian : bool
+        Use the real valued transform, see
+        :meth:`MatsubaraFourier.gw_invfouriertrans`
 
     Returns
     -------
-    complex ndarray
-            Interacting Greens function in matsubara frequencies
+    real ndarray
+            Imaginary time Green function
 
     See also
     --------
     gt_fouriertrans
     freq_tail_fourier
+    MatsubaraFourier
+    """
+
+    plan = fourier_plan(tau[1] + tau[-1], len(tau), len(w_n), len(tail_coef),
+                        array_precision(g_iwn))
+    return plan.gw_invfouriertrans(g_iwn, tail_coef, out, hermitian=hermitian)
+
+
+def euler_tail(order, beta, tau):
+    r"""Imaginary time transform of the tail terms :math:`(i\omega_n)^{-p}`
+    for :math:`p=1 \dots order`
+
+    It generalizes the table in :func:`freq_tail_fourier` to any order
+    using the Euler polynomials :math:`E_{p-1}`
+
+    .. math:: \frac{1}{\beta}\sum_{\omega_n}
+        \frac{e^{-i\omega_n \tau}}{(i\omega_n)^p} =
+        \frac{(-1)^p\beta^{p-1}}{2(p-1)!}E_{p-1}(\tau/\beta)
+
+    Returns
+    -------
+    real ndarray of shape (order, len(tau))
     """
+    x = np.asarray(tau) / beta - 0.5
+    euler_num = euler(max(order - 1, 0))
+    basis = []
+    for p in range(1, order + 1):
+        deg = p - 1
+        e_poly = sum(comb(deg, k) * euler_num[k] / 2**k * x**(deg - k)
+                     for k in range(deg + 1))
+        basis.append((-1)**p * beta**deg / factorial(deg) / 2 * e_poly)
+    return np.array(basis)
+
 
-    beta = tau[1] + tau[-1]
-    freq_tail, time_tail = freq_tail_fourier(tail_coef, beta, tau, w_n)
+def pole_tail(order, beta, tau, w_n):
+    r"""Bounded tail terms with the asymptotics of :math:`(i\omega_n)^{-p}`
+    for :math:`p=1 \dots order \leq 3`, and their imaginary time transforms
 
-    giwn = g_iwn - freq_tail
+    Built from the poles :math:`g_\pm = 1/(i\omega_n \mp 1)`
 
-    g_tau = fft(giwn, len(tau)) * np.exp(-1j * np.pi * tau / beta)
+    .. math:: \frac{1}{i\omega_n},\quad
+        \frac{g_+ - g_-}{2} = \frac{1}{(i\omega_n)^2 - 1},\quad
+        \frac{g_+ + g_-}{2} - \frac{1}{i\omega_n} =
+        \frac{1}{i\omega_n((i\omega_n)^2 - 1)}
 
-    return (g_tau * 2 / beta).real + time_tail
+    with :math:`g_\pm(\tau)=-e^{\mp\tau}/(1 + e^{\mp\beta})`. Unlike the
+    powers they stay of order one at low frequencies, where subtracting
+    them does not cancel the Green function away.
+
+    Returns
+    -------
+    tuple of the complex frequency and real time terms, arrays of shape
+    (order, len(w_n)) and (order, len(tau))
+    """
+    if order > 3:
+        raise ValueError('Pole tails are available up to third order')
+    iw_n = 1j * np.asarray(w_n)
+    tau = np.asarray(tau)
+    g_p = -np.exp(-tau) / (1 + np.exp(-beta))
+    g_m = -np.exp(tau - beta) / (1 + np.exp(-beta))
+    freq = [1 / iw_n, 1 / (iw_n**2 - 1), 1 / (iw_n * (iw_n**2 - 1))]
+    time = [-0.5 + 0 * tau, (g_p - g_m) / 2, (g_p + g_m) / 2 + 0.5]
+    return np.array(freq[:order]), np.array(time[:order])
+
+
+class MatsubaraFourier(object):
+    r"""Fourier transform between imaginary time and Matsubara frequencies
+    for a fixed grid
+
+    All the quantities that only depend on the grid, the phase factors
+    :math:`e^{\pm i\pi\tau/\beta}` and the analytical tail basis up to
+    `tail_order`, are computed once at construction. The transforms act on
+    the last axis, any leading shape is treated as a batch and goes in a
+    single FFT call. Tail coefficients must broadcast against the batch
+    shape with a trailing axis of size 1, e.g. shape (2, 2, 1) for a
+    2x2 block Green function.
+
+    Use :func:`fourier_plan` to get cached instances.
+
+    Parameters
+    ----------
+    beta : float
+        Inverse temperature
+    n_tau : int
+        Imaginary time points in :math:`[0, \beta)`
+    n_matsubara : int
+        Positive fermionic Matsubara frequencies
+    tail_order : int
+        Highest power of the analytically transformed tail
+    workers : int or None
+        Threads for the FFT, see :func:`scipy.fft.fft`
+    precision : 'double' or 'single'
+        Floating point type of the FFTs and the output. Single precision
+        plans use the bounded tails of :func:`pole_tail`, the powers of
+        :math:`1/i\omega_n` become so large at low frequencies that the
+        Green function is lost when subtracting them. The tails are
+        handled and the spline quadrature done in double precision.
+
+    See also
+    --------
+    gt_fouriertrans
+    gw_invfouriertrans
+    """
+
+    def __init__(self, beta, n_tau, n_matsubara, tail_order=3, workers=None,
+                 precision='double'):
+        self.beta = beta
+        self.tail_order = tail_order
+        self.workers = workers
+        self.precision = precision
+        self.real, self.complex = PRECISIONS[precision]
+        self.tau = np.arange(n_tau) * (beta / n_tau)
+        self.w_n = matsubara_freq(beta, n_matsubara)
+
+        self.phase_fw = np.exp(1j * np.pi * self.tau / beta).astype(
+            self.complex)
+        self.phase_bw = (np.exp(-1j * np.pi * self.tau / beta) *
+                         2 / beta).astype(self.complex)
+
+        iw_n = 1j * self.w_n
+        if precision == 'single':
+            self.freq_basis, self.time_basis = pole_tail(
+                tail_order, beta, self.tau, self.w_n)
+        else:
+            self.freq_basis = np.array([iw_n**-p
+                                        for p in range(1, tail_order + 1)])
+            self.time_basis = euler_tail(tail_order, beta, self.tau)
+
+    def _tail(self, tail_coef, basis):
+        if len(tail_coef) > self.tail_order:
+            raise ValueError('Plan supports tails up to order {}'.format(
+                self.tail_order))
+        tail = 0.
+        for coef, base in zip(tail_coef, basis):
+            if np.any(coef):
+                tail = tail + coef * base
+        return tail
+
+    def freq_tail(self, tail_coef):
+        """Matsubara frequency tail for the given moments"""
+        return self._tail(tail_coef, self.freq_basis)
+
+    def time_tail(self, tail_coef):
+        """Imaginary time transform of the tail for the given moments"""
+        return self._tail(tail_coef, self.time_basis)
+
+    def gt_fouriertrans(self, g_tau, tail_coef=(1., 0., 0.), out=None,
+                        workers=None, spline=False):
+        r"""Transform :math:`G(\tau)\rightarrow G(i\omega_n)`
+
+        With `spline` the tail subtracted function :math:`R(\tau)`,
+        closed at :math:`\beta` by its jump condition
+        :math:`R(\beta^-)=-R(0)`, is interpolated by a cubic spline
+        :math:`S` and integrated exactly, Filon style. Integrating by parts
+        up to the piecewise constant third derivative
+
+        .. math:: \int_0^\beta S(\tau)e^{i\omega_n\tau}d\tau =
+            \sum_{k=0}^2 (-1)^{k+1}\frac{S^{(k)}(0)+S^{(k)}(\beta)}
+            {(i\omega_n)^{k+1}}
+            - \frac{e^{i\omega_n h} - 1}{h(i\omega_n)^4}
+            \sum_j (S''_{j+1} - S''_j)e^{i\omega_n\tau_j}
+
+        where the last sum is an FFT. The error decays as :math:`h^4`
+        instead of the :math:`h^2` of the rectangle rule, so much coarser
+        time grids can be used. Frequencies beyond the time grid
+        resolution are also returned.
+
+        See also
+        --------
+        dmft.common.gt_fouriertrans
+        """
+        workers = self.workers if workers is None else workers
+        if spline:
+            return self._spline_fourier(g_tau - self.time_tail(tail_coef),
+                                        tail_coef, out, workers)
+
+        gtau = g_tau - self.time_tail(tail_coef)
+        gtau = gtau.astype(self.real if np.isrealobj(gtau) else self.complex,
+                           copy=False)
+        gtau = gtau * self.phase_fw
+        giw = sfft.ifft(gtau, overwrite_x=True, workers=workers)
+        giw = giw[..., :len(self.w_n)]
+        if out is None:
+            out = np.empty(giw.shape, dtype=giw.dtype)
+        np.multiply(giw, self.beta, out=out)
+        out += self.freq_tail(tail_coef)
+        return out
+
+    def _spline_fourier(self, r_tau, tail_coef, out, workers):
+        n_tau = len(self.tau)
+        if not hasattr(self, '_spline_weight'):
+            iw_n = 1j * self.w_n
+            step = self.beta / n_tau
+            self._spline_weight = -n_tau * (np.exp(iw_n * step) - 1) / \
+                step / iw_n**4
+            self._spline_powers = np.array([iw_n**-2, iw_n**-3])
+            self._spline_index = np.arange(len(self.w_n)) % n_tau
+
+        r_tau = np.concatenate((r_tau, -r_tau[..., :1]), -1)
+        spline = CubicSpline(np.append(self.tau, self.beta), r_tau, axis=-1)
+        ends = np.array([0, self.beta])
+        d_1 = spline(ends, 1).sum(-1)[..., None]
+        d_2 = spline(ends, 2).sum(-1)[..., None]
+
+        jumps = np.diff(spline(spline.x, 2), axis=-1) * self.phase_fw
+        giw = sfft.ifft(jumps, overwrite_x=True, workers=workers)
+        giw = giw[..., self._spline_index]
+        if out is None:
+            out = np.empty(giw.shape, dtype=giw.dtype)
+        np.multiply(giw, self._spline_weight, out=out)
+        out += d_1 * self._spline_powers[0] - d_2 * self._spline_powers[1]
+        out += self.freq_tail(tail_coef)
+        return out
+
+    def gw_invfouriertrans(self, g_iwn, tail_coef=(1., 0., 0.), out=None,
+                           workers=None, hermitian=False):
+        r"""Transform :math:`G(i\omega_n)\rightarrow G(\tau)`
+
+        With `hermitian` the symmetry :math:`G(-i\omega_n)=G(i\omega_n)^*`
+        and the real output are used to split the sum into a DCT-II of the
+        real part and a DST-II of the imaginary part, both real transforms
+        of half the time grid
+
+        .. math:: G(\tau_k) = \frac{2}{\beta}\sum_{n\geq 0}
+            \Re e G(i\omega_n) \cos(\omega_n\tau_k) +
+            \Im m G(i\omega_n) \sin(\omega_n\tau_k)
+
+        It requires an even number of time points, at least twice the
+        amount of frequencies, otherwise the complex transform is used.
+
+        See also
+        --------
+        dmft.common.gw_invfouriertrans
+        """
+        workers = self.workers if workers is None else workers
+        giwn = (g_iwn - self.freq_tail(tail_coef)).astype(self.complex,
+                                                           copy=False)
+        n_tau = len(self.tau)
+        if hermitian and n_tau % 2 == 0 and giwn.shape[-1] <= n_tau // 2:
+            return self._hermitian_invfourier(giwn, tail_coef, out, workers)
+
+        if giwn.shape[-1] > n_tau:
+            # Frequencies beyond the time grid resolution alias
+            pad = -giwn.shape[-1] % n_tau
+            giwn = np.concatenate(
+                (giwn, np.zeros(giwn.shape[:-1] + (pad,), giwn.dtype)), -1)
+            giwn = giwn.reshape(giwn.shape[:-1] + (-1, n_tau)).sum(-2)
+        g_tau = sfft.fft(giwn, n_tau, overwrite_x=True,
+                         workers=workers)
+        g_tau *= self.phase_bw
+        if out is None:
+            out = np.empty(g_tau.shape, dtype=g_tau.real.dtype)
+        out[...] = g_tau.real
+        out += self.time_tail(tail_coef)
+        return out
+
+    def _hermitian_invfourier(self, giwn, tail_coef, out, workers):
+        n_tau = len(self.tau)
+        half = n_tau // 2
+        cos_t = sfft.dct(giwn.real, 2, half, workers=workers)
+        sin_t = sfft.dst(giwn.imag, 2, half, workers=workers)
+
+        if out is None:
+            out = np.empty(cos_t.shape[:-1] + (n_tau,), dtype=cos_t.dtype)
+        out[..., 0] = cos_t[..., 0]
+        np.add(cos_t[..., 1:], sin_t[..., :-1], out=out[..., 1:half])
+        out[..., half] = sin_t[..., -1]
+        np.subtract(sin_t[..., -2::-1], cos_t[..., :0:-1],
+                    out=out[..., half + 1:])
+        out /= self.beta
+        out += self.time_tail(tail_coef)
+        return out
+
+
+_FOURIER_PLANS = {}
+
+PRECISIONS = {'double': (np.float64, np.complex128),
+              'single': (np.float32, np.complex64)}
+"""Real and complex types of each floating point precision"""
+
+
+def array_precision(arr):
+    """'single' for float32 and complex64 arrays, 'double' otherwise"""
+    if np.asarray(arr).dtype in PRECISIONS['single']:
+        return 'single'
+    return 'double'
+
+
+def fourier_plan(beta, n_tau, n_matsubara, tail_order=3, precision='double'):
+    """Returns a cached :class:`MatsubaraFourier` for the given grid
+
+    Parameters
+    ----------
+    beta : float
+        Inverse temperature
+    n_tau : int
+        Imaginary time points in :math:`[0, \\beta)`
+    n_matsubara : int
+        Positive fermionic Matsubara frequencies
+    tail_order : int
+        Highest power of the analytically transformed tail
+    precision : 'double' or 'single'
+        Floating point type of the plan, see :data:`PRECISIONS`
+    """
+    key = (float(beta), int(n_tau), int(n_matsubara), int(tail_order),
+           precision)
+    try:
+        return _FOURIER_PLANS[key]
+    except KeyError:
+        if len(_FOURIER_PLANS) >= 64:
+            _FOURIER_PLANS.pop(next(iter(_FOURIER_PLANS)))
+        plan = _FOURIER_PLANS[key] = MatsubaraFourier(*key[:4],
+                                                      precision=precision)
+        return plan
 
 
 def tail(w_n, coef, powers):
     return np.sum([c / w_n**p for c, p in zip(coef, powers)], 0)
 
 
-def lin_tail_fit(w_n, inp_gf, x, span=30, negative_freq=False):
+def tail_basis(w_n, powers):
+    r"""Real valued design matrix of the high frequency expansion
+
+    Column :math:`p` holds the real part of :math:`(i\omega_n)^{-p}` for
+    even powers and the imaginary part for odd powers.
+
+    Returns
+    -------
+    real ndarray of shape (len(w_n), len(powers))
+    """
+    w_n = np.asarray(w_n, dtype=float)
+    columns = []
+    for p in powers:
+        phase = (-1j)**p
+        columns.append((phase.imag if p % 2 else phase.real) / w_n**p)
+    return np.array(columns).T
+
+
+def tail_moments(w_n, inp_gf, powers=(1, 2, 3), sigma=None):
+    r"""Least squares estimate of the high frequency moments :math:`M_p` of
+    many Green functions at once
+
+    .. math:: G(i\omega_n) \approx \sum_p \frac{M_p}{(i\omega_n)^p}
+
+    Even powers are fitted to the real part and odd powers to the imaginary
+    part. The pseudo-inverse of each design matrix is computed once for the
+    frequency window and applied to the whole batch. The moments are given
+    in the convention of the `tail_coef` of :func:`gt_fouriertrans`.
+
+    Parameters
+    ----------
+    w_n : real 1D ndarray
+        Matsubara frequencies of the fitting window
+    inp_gf : complex ndarray of shape (..., len(w_n))
+        Green functions restricted to the window
+    powers : sequence of int
+        Powers of the expansion to fit
+    sigma : real ndarray, optional
+        Error bars of `inp_gf`, broadcastable to its shape. Points get a
+        weight of `1/sigma` in the fit
+
+    Returns
+    -------
+    real ndarray of shape (..., len(powers))
+    """
+    inp_gf = np.asarray(inp_gf)
+    powers = list(powers)
+    moments = np.zeros(inp_gf.shape[:-1] + (len(powers),))
+
+    for parity, data in ((0, inp_gf.real), (1, inp_gf.imag)):
+        cols = [i for i, p in enumerate(powers) if p % 2 == parity]
+        if not cols:
+            continue
+        design = tail_basis(w_n, [powers[i] for i in cols])
+        if sigma is None:
+            moments[..., cols] = data.dot(np.linalg.pinv(design).T)
+            continue
+        weight = 1 / np.asarray(sigma, dtype=float)
+        if weight.ndim <= 1:
+            pinv = np.linalg.pinv(design * weight[..., None])
+            moments[..., cols] = (data * weight).dot(pinv.T)
+        else:
+            weight = np.broadcast_to(weight, data.shape)
+            pinv = np.linalg.pinv(design * weight[..., None])
+            moments[..., cols] = np.einsum('...pn,...n->...p', pinv,
+                                           data * weight)
+    return moments
+
+
+def lin_tail_fit(w_n, inp_gf, x, span=30, negative_freq=False, sigma=None):
     """Perform a Least squares fit to the tail of Green function
 
-    the fit is done in inp_gf[-x:-x + span]
+    the fit is done in inp_gf[..., -x:-x + span]. Leading axes of inp_gf
+    are fitted independently in one go
 
     Parameters:
         w_n (real 1D ndarray) : Matsubara frequencies
-        inp_gf (complex 1D ndarray) : Green function to fit
+        inp_gf (complex ndarray) : Green function to fit
         x (int) : counting from last element from where to do the fit
         span (int) : amount of frequencies to do the fit over
         negative_freq (bool) : Array has negative Matsubara frequencies
+        sigma (real ndarray) : Error bars of inp_gf, weight the fit
     Returns:
-        complex 1D ndarray : Tail patched Green function (copy of origal)
-        real 1D ndarray : The First 3 moments
-"""
-    def tail_coef(w_n, data, powers):
-        A = np.array([1 / w_n**p for p in powers]).T
-        return lstsq(A, data)[0]
+        complex ndarray : Tail patched Green function (copy of origal)
+        real ndarray : The First 3 moments
 
-    tw_n = w_n[-x:-x + span].copy()
-    datar = inp_gf[-x:-x + span].real.copy()
-    datai = inp_gf[-x:-x + span].imag.copy()
-
-    re_c = tail_coef(tw_n, datar, [2])
-    re_tail = tail(w_n, re_c, [2])
-    im_c = tail_coef(tw_n, datai, [1, 3])
-    im_tail = tail(w_n, im_c, [1, 3])
+    See also:
+        tail_moments
+"""
+    window = slice(-x, -x + span)
+    if sigma is not None:
+        sigma = np.asarray(sigma)
+        sigma = sigma[..., window] if sigma.ndim else sigma
+    moments = tail_moments(w_n[window], inp_gf[..., window], (1, 2, 3),
+                           sigma)
 
-    f_tail = re_tail + 1j * im_tail
+    f_tail = moments[..., :1] / (1j * w_n) + \
+        moments[..., 1:2] / (1j * w_n)**2 + moments[..., 2:] / (1j * w_n)**3
 
     patgf = inp_gf.copy()
-    patgf[-x:] = f_tail[-x:]
+    patgf[..., -x:] = f_tail[..., -x:]
     if negative_freq:
-        patgf[:x] = f_tail[:x]
+        patgf[..., :x] = f_tail[..., :x]
 
-    return patgf, np.array([im_c[0], re_c[0], im_c[1]])
+    return patgf, moments * np.array([-1, -1, 1])
 
 
 def fit_gf(w_n, giw, p=2):
@@ -303,28 +884,52 @@ def fit_gf(w_n, giw, p=2):
 
 # Pade Analytical Continuation
 # Algorithm from Vidberg & Serene J. Low Temperature Phys. 29, 3-4, 179 (1977)
-def pade_coefficients(g_iw, w_n):
+def _pade_dtype(precision):
+    if precision == 'double':
+        return np.complex128
+    if precision == 'long':
+        return np.clongdouble
+    raise ValueError("precision must be 'double', 'long' or an int")
+
+
+def pade_coefficients(g_iw, w_n, precision='double'):
     """Find the Pade coefficients for the desired green Function
 
+    The recursion is done in place, storage is linear in the amount of
+    frequencies. Leading axes of `g_iw` are independent functions.
+
     Parameters
     ----------
     g_iw : complex ndarray
-        single axis
+        Functions on the last axis
     w_n : real ndarray
         Matsubara frequencies
+    precision : 'double', 'long' or int
+        Floating point type of the recursion, 'long' uses the platform
+        extended precision. An int requests that many decimal digits with
+        mpmath, an optional dependency, and returns a list of mpmath
+        numbers per function.
     """
-    G = np.zeros((len(g_iw), len(g_iw)), dtype=np.complex)
-    G[0] = g_iw
-    for i in range(1, len(g_iw)):
-        G[i, i:] = 1j * (G[i - 1, i - 1] / G[i - 1, i:] -
-                         1.) / (w_n[i - 1] - w_n[i:])
+    if not isinstance(precision, str):
+        return _pade_mp(g_iw, w_n, None, precision)[0]
 
-    return np.diag(G)
+    dtype = _pade_dtype(precision)
+    coef = np.array(g_iw, dtype=dtype)
+    iw_n = 1j * np.asarray(w_n, dtype=coef.real.dtype)
+    for i in range(1, coef.shape[-1]):
+        coef[..., i:] = (coef[..., i - 1:i] / coef[..., i:] - 1.) / \
+            (iw_n[i:] - iw_n[i - 1])
+
+    return coef
 
 
 def pade_rec(pc, w, w_n):
     """Pade recursion formula for continued Fractions
 
+    The numerator and denominator are rescaled at each step to avoid
+    overflow at large orders. Leading axes of `pc` are independent
+    functions, the output has shape pc.shape[:-1] + w.shape
+
     Parameters
     ----------
     pc : complex ndarray
@@ -334,26 +939,63 @@ def pade_rec(pc, w, w_n):
     w_n : real ndarray
         Matsubara frequencies
     """
+    pc = np.asarray(pc)[..., None]
+    w = np.asarray(w)
+    iw_n = 1j * np.asarray(w_n, dtype=pc.real.dtype)
     an_1 = 0.
-    an = pc[0]
-    bn = 1.
+    an = pc[..., 0, :] * np.ones_like(w)
+    bn = np.ones_like(an)
     bn_1 = 1.
-    iw_n = 1j * w_n
-    for i in range(len(pc) - 2):
-        anp = an + (w - iw_n[i]) * pc[i + 1] * an_1
-        bnp = bn + (w - iw_n[i]) * pc[i + 1] * bn_1
-        an_1, an = an, anp
-        bn_1, bn = bn, bnp
-    return an / bn
-
-
-def pade_continuation(gfunc, w_n, w, w_set=None):
+    for i in range(pc.shape[-2] - 2):
+        anp = an + (w - iw_n[i]) * pc[..., i + 1, :] * an_1
+        bnp = bn + (w - iw_n[i]) * pc[..., i + 1, :] * bn_1
+        scale = np.abs(bnp)
+        scale[scale == 0] = 1.
+        an_1, an = an / scale, anp / scale
+        bn_1, bn = bn / scale, bnp / scale
+    return (an / bn).astype(np.complex128)
+
+
+def _pade_mp(g_iw, w_n, w, dps):
+    """Pade coefficients and continuation with mpmath arbitrary precision"""
+    import mpmath
+
+    g_iw = np.asarray(g_iw)
+    with mpmath.workdps(dps):
+        iw_n = [mpmath.mpc(0, x) for x in w_n]
+        coefs = []
+        for g_1d in g_iw.reshape(-1, g_iw.shape[-1]):
+            coef = [mpmath.mpc(x.real, x.imag) for x in g_1d]
+            for i in range(1, len(coef)):
+                for j in range(i, len(coef)):
+                    coef[j] = (coef[i - 1] / coef[j] - 1) / \
+                        (iw_n[j] - iw_n[i - 1])
+            coefs.append(coef)
+
+        if w is None:
+            return coefs, None
+
+        w = np.asarray(w)
+        out = np.empty((len(coefs), ) + w.shape, dtype=np.complex128)
+        for row, coef in zip(out, coefs):
+            for k, z in enumerate(w.flat):
+                an_1, an, bn_1, bn = 0, coef[0], 1, 1
+                for i in range(len(coef) - 2):
+                    an_1, an = an, an + (z - iw_n[i]) * coef[i + 1] * an_1
+                    bn_1, bn = bn, bn + (z - iw_n[i]) * coef[i + 1] * bn_1
+                row.flat[k] = complex(an / bn)
+
+    return coefs, out.reshape(g_iw.shape[:-1] + w.shape)
+
+
+def pade_continuation(gfunc, w_n, w, w_set=None, precision='double'):
     """Continate the green Function by Padé
 
     Parameters
     ----------
-    gfunc: complex 1D ndarray
-        Green function to be continued
+    gfunc: complex ndarray
+        Green function to be continued, on the last axis. Leading axes
+        are continued independently in one go
     w_n: real 1D ndarray
         Matsubara frequencies
     w: real 1D ndarray
@@ -361,6 +1003,9 @@ def pade_continuation(gfunc, w_n, w, w_set=None):
     w_set: int or int 1D ndarray
         Amount of frequency point to sample
         index of points to sample for continuation
+    precision : 'double', 'long' or int
+        See :func:`pade_coefficients`. The recursion becomes unstable
+        in double precision when many frequencies are used
 
     See also
     --------
@@ -373,7 +1018,99 @@ def pade_continuation(gfunc, w_n, w, w_set=None):
     elif isinstance(w_set, int):
         w_set = np.arange(w_set)
 
-    pc = pade_coefficients(gfunc[w_set], w_n[w_set])
+    gfunc = np.asarray(gfunc)
+    if not isinstance(precision, str):
+        return _pade_mp(gfunc[..., w_set], w_n[w_set], w, precision)[1]
+
+    pc = pade_coefficients(gfunc[..., w_set], w_n[w_set], precision)
     g_real = pade_rec(pc, w, w_n[w_set])
 
     return g_real
+
+
+def _pade_chunk(gfunc, w_n, w, w_sets, precision):
+    return np.array([pade_continuation(gfunc, w_n, w, w_set, precision)
+                     for w_set in w_sets])
+
+
+def pade_ensemble(gfunc, w_n, w, n_samples=64, n_range=None, drop=0.1,
+                  outlier=3., n_jobs=-1, seed=None, precision='double'):
+    r"""Average of many Padé continuations over random frequency subsets
+
+    Each sample uses the first :math:`N` frequencies, with :math:`N` drawn
+    uniformly from `n_range`, and randomly removes a fraction `drop` of
+    them. Samples are evaluated in a pool of processes. Continuations
+    that are not causal, :math:`\Im m G(\omega) > 0` anywhere, are
+    discarded. Among the rest, the ones whose mean distance to the median
+    continuation exceeds `outlier` times the median distance are also
+    discarded.
+
+    Parameters
+    ----------
+    gfunc : complex 1D ndarray
+        Green function or self-energy to be continued
+    w_n : real 1D ndarray
+        Matsubara frequencies
+    w : 1D ndarray
+        real frequency array, may include the broadening
+    n_samples : int
+        Amount of continuations
+    n_range : tuple of 2 ints
+        Range of the frequency cutoffs, by default from a quarter to all
+        the frequencies
+    drop : float in [0, 1)
+        Fraction of frequencies removed in each sample, the first one is
+        always kept
+    outlier : float
+        Rejection threshold relative to the median distance
+    n_jobs : int
+        Processes as in :class:`joblib.Parallel`
+    seed : int
+        Seed of the random subsets
+    precision : 'double', 'long' or int
+        See :func:`pade_coefficients`
+
+    Returns
+    -------
+    g_mean : complex 1D ndarray
+        Mean of the accepted continuations, NaN if none is accepted
+    g_std : real 1D ndarray
+        Standard deviation of the accepted continuations
+    accepted : int
+        Amount of accepted continuations
+
+    See also
+    --------
+    pade_continuation
+    """
+    rng = np.random.RandomState(seed)
+    if n_range is None:
+        n_range = (max(len(w_n) // 4, 2), len(w_n))
+    w_sets = []
+    for cutoff in rng.randint(n_range[0], n_range[1] + 1, n_samples):
+        keep = rng.rand(cutoff) >= drop
+        keep[0] = True
+        w_sets.append(np.arange(cutoff)[keep])
+
+    chunks = np.array_split(np.arange(n_samples),
+                            min(effective_n_jobs(n_jobs), n_samples))
+    samples = Parallel(n_jobs=n_jobs)(
+        delayed(_pade_chunk)(gfunc, w_n, w, [w_sets[i] for i in chunk],
+                             precision)
+        for chunk in chunks if len(chunk))
+    samples = np.concatenate(samples)
+
+    finite = np.isfinite(samples).all(1)
+    causal = finite & (samples.imag <= 1e-8 * np.abs(samples.imag).max(1)
+                       [:, None]).all(1)
+    samples = samples[causal]
+    if len(samples):
+        median = np.median(samples.real, 0) + 1j * np.median(samples.imag, 0)
+        distance = np.abs(samples - median).mean(1)
+        samples = samples[distance <= outlier * np.median(distance)]
+
+    if not len(samples):
+        nan = np.full(np.shape(w), np.nan)
+        return nan + 1j * nan, nan, 0
+
+    return samples.mean(0), samples.std(0), len(samples)
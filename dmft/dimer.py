@@ -10,10 +10,14 @@ from __future__ import division, print_function, absolute_import
 
 import numpy as np
 import h5py
+import scipy.fft as sfft
+from scipy.optimize import root
 from slaveparticles.quantum import fermion
 
 import dmft.common as gf
 import dmft.ipt_imag as ipt
+import dmft.mixing as mixing
+import dmft.monitor as monitor
 from dmft.utils import optical_conductivity as opt_sig
 
 # Molecule
@@ -179,7 +183,9 @@ def get_sigmaiw(giw_d, giw_o, w_n, tp):
     return siw_d, siw_o
 
 
-def ipt_dmft_loop(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12, t=.5):
+def ipt_dmft_loop(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12, t=.5,
+                  mixer=None, max_loops=3000, observer=None,
+                  precision='double'):
     """Self-consistently solve dimer DMFT problem with ipt solver
 
     Parameters
@@ -193,6 +199,14 @@ def ipt_dmft_loop(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12, t=.5):
     w_n : 1D ndarray real - matsubara frequency points
     conv : float - convergence criteria
     t : float - renormalized lattice hopping
+    mixer : None, str or mixer - acceleration acting on Im G_11 and Re G_12,
+        see :func:`dmft.mixing.get_mixer`. By default no mixing
+    max_loops : int - iteration cap
+    observer : callable or list of callables - receives a record of every
+        iteration, see :mod:`dmft.monitor`
+    precision : 'double' or 'single' - floating point type of the
+        iteration. Single precision is meant for screening, with `conv`
+        above its resolution of about 1e-6
 
     Returns
     -------
@@ -203,8 +217,13 @@ def ipt_dmft_loop(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12, t=.5):
 
     converged = False
     loops = 0
-    iw_n = 1j * w_n
+    real, cplx = gf.PRECISIONS[precision]
+    giw_d = np.asarray(giw_d, cplx)
+    giw_o = np.asarray(giw_o, cplx)
+    iw_n = 1j * w_n.astype(real)
     t_sqr = t * t
+    mixer = mixing.get_mixer(mixer)
+    timer = monitor.StageTimer() if observer is not None else None
 
     while not converged:
         # Half-filling, particle-hole cleaning
@@ -214,24 +233,532 @@ def ipt_dmft_loop(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12, t=.5):
         giw_d_old = giw_d.copy()
         giw_o_old = giw_o.copy()
 
-        g0iw_d, g0iw_o = self_consistency(iw_n, giw_d, giw_o, 0., tp, t_sqr)
+        with monitor.stage(timer, 'self_consistency'):
+            g0iw_d, g0iw_o = self_consistency(iw_n, giw_d, giw_o, 0., tp,
+                                              t_sqr)
 
-        siw_d, siw_o = ipt.dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau, w_n)
-        giw_d, giw_o = dimer_dyson(g0iw_d, g0iw_o, siw_d, siw_o)
+        with monitor.stage(timer, 'solver'):
+            siw_d, siw_o = ipt.dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau,
+                                           w_n, timer=timer)
+        with monitor.stage(timer, 'dyson'):
+            giw_d, giw_o = dimer_dyson(g0iw_d, g0iw_o, siw_d, siw_o)
 
         converged = np.allclose(giw_d_old, giw_d, conv)
         converged *= np.allclose(giw_o_old, giw_o, conv)
 
         loops += 1
-        if loops > 3000:
+        if observer is not None:
+            monitor.notify(
+                observer, loop=loops, converged=bool(converged),
+                residual=max(np.abs(giw_d - giw_d_old).max(),
+                             np.abs(giw_o - giw_o_old).max()),
+                times=timer.reset(), beta=BETA, u_int=u_int, tp=tp)
+        if loops > max_loops:
             converged = True
             print('B', BETA, 'tp', tp, 'U', u_int, 'D', 2 * t)
-            print('Failed to converge in less than 3000 iterations')
+            print('Failed to converge in less than {} iterations'.format(
+                max_loops))
+
+        if not converged:
+            x_new = mixer(mixing.pack(giw_d_old.imag, giw_o_old.real),
+                          mixing.pack(giw_d.imag, giw_o.real))
+            g_d, g_o = mixing.unpack(x_new.astype(real), giw_d, giw_o)
+            giw_d, giw_o = 1j * g_d, g_o + 0j
 
     return giw_d, giw_o, loops
 
 
-def ekin(giw_d, giw_o, w_n, tp, beta, t_sqr=0.25):
+def ipt_dmft_loop_batch(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12,
+                        t=.5, max_loops=3000, observer=None):
+    """Self-consistently solve many dimer DMFT problems at once
+
+    Same iteration as :func:`ipt_dmft_loop` on a batch of parameter
+    points sharing the temperature and frequency grid. Every operation
+    and Fourier transform acts on all pending rows at once and each row
+    leaves the iteration as soon as it converges.
+
+    Parameters
+    ----------
+    BETA : float - inverse temperature
+    u_int : float or 1D ndarray - onsite interaction of each point
+    tp : float or 1D ndarray - dimer hybridization of each point
+    giw_d : 2D ndarray complex - initial G_11, points x frequencies. A
+        1D array is used as the seed of all points
+    giw_o : 2D ndarray complex - initial G_12, as giw_d
+    tau : 1D ndarray real - imaginary time array
+    w_n : 1D ndarray real - matsubara frequency points
+    conv : float - convergence criteria
+    t : float - renormalized lattice hopping
+    max_loops : int - iteration cap
+    observer : callable or list of callables - receives a record of every
+        iteration, see :mod:`dmft.monitor`. The residual is the largest
+        one of the pending points and `pending` counts them
+
+    Returns
+    -------
+    giw_d : 2D ndarray complex - diagonal Green functions G_11
+    giw_o : 2D ndarray complex - off-diagonal Green functions G_12
+    loops : 1D ndarray int - iterations for converge of each point
+    """
+
+    u_int, tp = np.broadcast_arrays(np.atleast_1d(u_int), np.atleast_1d(tp))
+    shape = (len(u_int), len(w_n))
+    giw_d = np.array(np.broadcast_to(giw_d, shape), dtype=complex)
+    giw_o = np.array(np.broadcast_to(giw_o, shape), dtype=complex)
+    loops = np.zeros(len(u_int), dtype=int)
+    iw_n = 1j * w_n
+    t_sqr = t * t
+    timer = monitor.StageTimer() if observer is not None else None
+
+    pending = np.arange(len(u_int))
+    while pending.size:
+        # Half-filling, particle-hole cleaning
+        g_d, g_o = 1j * giw_d[pending].imag, giw_o[pending].real + 0j
+
+        with monitor.stage(timer, 'self_consistency'):
+            g0iw_d, g0iw_o = self_consistency(iw_n, g_d, g_o, 0.,
+                                              tp[pending, None], t_sqr)
+        with monitor.stage(timer, 'solver'):
+            siw_d, siw_o = ipt.dimer_sigma(u_int[pending], tp[pending],
+                                           g0iw_d, g0iw_o, tau, w_n,
+                                           timer=timer)
+        with monitor.stage(timer, 'dyson'):
+            giw_d[pending], giw_o[pending] = dimer_dyson(g0iw_d, g0iw_o,
+                                                         siw_d, siw_o)
+
+        converged = np.all(np.abs(g_d - giw_d[pending]) <=
+                           1e-8 + conv * np.abs(giw_d[pending]), -1)
+        converged &= np.all(np.abs(g_o - giw_o[pending]) <=
+                            1e-8 + conv * np.abs(giw_o[pending]), -1)
+
+        loops[pending] += 1
+        if observer is not None:
+            monitor.notify(
+                observer, loop=loops[pending].max(),
+                converged=bool(converged.all()), pending=len(pending),
+                residual=max(np.abs(giw_d[pending] - g_d).max(),
+                             np.abs(giw_o[pending] - g_o).max()),
+                times=timer.reset(), beta=BETA)
+        failed = loops[pending] > max_loops
+        for point in pending[failed]:
+            print('B', BETA, 'tp', tp[point], 'U', u_int[point], 'D', 2 * t)
+            print('Failed to converge in less than {} iterations'.format(
+                max_loops))
+        pending = pending[~(converged | failed)]
+
+    return giw_d, giw_o, loops
+
+
+def ipt_dmft_newton(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12,
+                    t=.5, max_loops=3000, observer=None, warmup=8, rate=0.7,
+                    krylov_options=None, **loop_kw):
+    r"""Solve the dimer DMFT problem as a root problem with Newton-Krylov
+
+    The IPT iteration is a map :math:`x \rightarrow F(x)` on
+    :math:`x = (\Im m G_{11}, \Re e G_{12})` and its fixed point the root
+    of :math:`R(x) = F(x) - x`. Close to the end of a coexistence region,
+    e.g. at :math:`U_{c2}`, the Jacobian of :math:`F` has an eigenvalue
+    close to 1, the errors shrink by that factor per iteration and the
+    plain loop needs thousands of iterations. Newton's method does not
+    suffer from it. The Jacobian is never built, a Krylov solver only
+    needs its product with vectors which are finite differences of
+    :math:`R`, see :func:`scipy.optimize.newton_krylov`.
+
+    The first `warmup` iterations are plain ones and estimate the
+    contraction rate of the map. Below `rate` the point is far from
+    criticality and the loop continues with :func:`ipt_dmft_loop`,
+    otherwise Newton-Krylov finds the root. Its result is finished by
+    :func:`ipt_dmft_loop`, which verifies the convergence criteria. Near
+    a coexistence region Newton's method can also land on the unstable
+    solution, from where the loop moves on to a stable one.
+
+    Parameters
+    ----------
+    BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv, t, max_loops, observer
+        As in :func:`ipt_dmft_loop`. `max_loops` caps the map evaluations.
+        The observer also receives a record per map evaluation of the
+        warmup and the Newton steps, with their `stage`
+    warmup : int - plain iterations used to estimate the contraction rate
+    rate : float - contraction rate above which Newton-Krylov is used
+    krylov_options : dict - options of the krylov method of
+        :func:`scipy.optimize.root`, like `maxiter` or `jac_options`
+    loop_kw : - further keywords of :func:`ipt_dmft_loop`, like `mixer`
+        or `precision`, used by the finishing loop. The warmup iterations
+        also apply the `mixer`, the warmup and Newton steps always run in
+        double precision
+
+    Returns
+    -------
+    giw_d : 1D ndarray complex - diagonal Green function G_11
+    giw_o : 1D ndarray complex - off-diagonal Green function G_12
+    loops : int - evaluations of the IPT map
+    """
+
+    iw_n = 1j * w_n
+    t_sqr = t * t
+    timer = monitor.StageTimer() if observer is not None else None
+    evals = [0]
+
+    def ipt_map(x_in, stage):
+        g_d, g_o = mixing.unpack(x_in, w_n, w_n)
+        with monitor.stage(timer, 'self_consistency'):
+            g0iw_d, g0iw_o = self_consistency(iw_n, 1j * g_d, g_o + 0j, 0.,
+                                              tp, t_sqr)
+        with monitor.stage(timer, 'solver'):
+            siw_d, siw_o = ipt.dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau,
+                                           w_n, timer=timer)
+        with monitor.stage(timer, 'dyson'):
+            g_d, g_o = dimer_dyson(g0iw_d, g0iw_o, siw_d, siw_o)
+        x_out = mixing.pack(g_d.imag, g_o.real)
+        evals[0] += 1
+        if observer is not None:
+            monitor.notify(observer, loop=evals[0], converged=False,
+                           residual=np.abs(x_out - x_in).max(),
+                           times=timer.reset(), stage=stage, beta=BETA,
+                           u_int=u_int, tp=tp)
+        return x_out
+
+    mixer = mixing.get_mixer(loop_kw.get('mixer'))
+    x_in = mixing.pack(giw_d.imag, giw_o.real)
+    residuals = []
+    for _ in range(warmup):
+        x_out = ipt_map(x_in, 'warmup')
+        residuals.append(np.abs(x_out - x_in).max())
+        converged = np.allclose(x_in, x_out, conv)
+        x_in = x_out if converged else mixer(x_in, x_out)
+        if converged or not np.isfinite(residuals[-1]):
+            break
+
+    if len(residuals) > 1 and residuals[-1] > 0:
+        contraction = (residuals[-1] / residuals[0])**(
+            1 / (len(residuals) - 1))
+        if contraction > rate and not converged:
+            options = dict(maxiter=20, fatol=1e-8,
+                           jac_options=dict(method='gmres', inner_maxiter=5))
+            options.update(krylov_options or {})
+            newton = root(lambda x: ipt_map(x, 'newton') - x, x_in,
+                          method='krylov', options=options)
+            if np.all(np.isfinite(newton.x)):
+                x_in = newton.x
+
+    g_d, g_o = mixing.unpack(x_in, w_n, w_n)
+    giw_d, giw_o, loops = ipt_dmft_loop(
+        BETA, u_int, tp, 1j * g_d, g_o + 0j, tau, w_n, conv, t,
+        max_loops=max(max_loops - evals[0], 0), observer=observer,
+        **loop_kw)
+    return giw_d, giw_o, loops + evals[0]
+
+
+def ipt_dmft_multigrid(BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12,
+                       t=.5, n_coarse=64, factor=4, coarse_conv=1e-4,
+                       solver=ipt_dmft_loop, **solver_kw):
+    """Solve the dimer DMFT problem first on grids of fewer frequencies
+
+    Coarse to fine iteration over grids of the same temperature with
+    `n_coarse`, `factor` times as many, ... frequencies up to the grid of
+    `w_n`. The coarse grids are solved to `coarse_conv`, their cutoff
+    error is larger anyway, and each solution, extended by its fitted
+    tail with :func:`dmft.common.tail_extend`, seeds the next grid. The
+    low frequencies converge on the cheap grids, the fine grid only needs
+    the iterations to adjust to the higher cutoff.
+
+    Parameters
+    ----------
+    BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv, t :
+        As in :func:`ipt_dmft_loop`, the seed is restricted to each grid
+    n_coarse : int - frequencies of the coarsest grid
+    factor : int - growth of the frequencies between grids
+    coarse_conv : float - convergence criteria of the coarse grids
+    solver : callable - DMFT loop used on every grid, with the signature
+        of :func:`ipt_dmft_loop`
+    solver_kw : - extra keyword arguments for the solver
+
+    Returns
+    -------
+    giw_d : 1D ndarray complex - diagonal Green function G_11
+    giw_o : 1D ndarray complex - off-diagonal Green function G_12
+    loops : int - iterations on all grids
+    """
+
+    n_freq = n_coarse
+    g_d, g_o = giw_d[:n_freq], giw_o[:n_freq]
+    w_l = w_n[:n_freq]
+    loops = 0
+    while n_freq < len(w_n):
+        tau_l, w_l = gf.tau_wn_setup(dict(BETA=BETA, N_MATSUBARA=n_freq))
+        g_d, g_o = gf.tail_extend(np.array([g_d, g_o]), w_l[:len(g_d)], w_l)
+        g_d, g_o, n_loops = solver(BETA, u_int, tp, g_d, g_o, tau_l, w_l,
+                                   max(conv, coarse_conv), t, **solver_kw)
+        loops += n_loops
+        n_freq *= factor
+
+    g_d, g_o = gf.tail_extend(np.array([g_d, g_o]), w_l[:len(g_d)], w_n)
+    g_d, g_o, n_loops = solver(BETA, u_int, tp, g_d, g_o, tau, w_n, conv, t,
+                               **solver_kw)
+    return g_d, g_o, loops + n_loops
+
+
+def ipt_dmft_auto_grid(BETA, u_int, tp, seed=None, tol=1e-4, conv=1e-9, t=.5,
+                       n_coarse=64, n_max=2**16, solver=ipt_dmft_loop,
+                       **solver_kw):
+    r"""Solve the dimer DMFT problem choosing the amount of Matsubara
+    frequencies
+
+    Instead of fixing `N_MATSUBARA` in proportion to :math:`\beta`, the
+    frequencies are doubled from `n_coarse`, each grid seeded by the
+    tail extended solution of the previous one as in
+    :func:`ipt_dmft_multigrid`, until the solution on the frequencies
+    of the previous grid changes less than `tol`. The cutoff is then high
+    enough for the analytical tails to account for the rest. The change
+    falls about 8 times per doubling, the default `tol` matches the usual
+    ``6 * BETA`` frequencies for metals and needs fewer for insulators.
+
+    Parameters
+    ----------
+    BETA, u_int, tp, conv, t : As in :func:`ipt_dmft_loop`
+    seed : callable - ``seed(w_n)`` returns the initial (giw_d, giw_o), by
+        default the non-interacting dimer
+    tol : float - largest change of the Green functions between the two
+        last grids
+    n_coarse : int - frequencies of the coarsest grid
+    n_max : int - largest grid
+    solver : callable - DMFT loop used on every grid
+    solver_kw : - extra keyword arguments for the solver
+
+    Returns
+    -------
+    giw_d : 1D ndarray complex - diagonal Green function G_11
+    giw_o : 1D ndarray complex - off-diagonal Green function G_12
+    tau : 1D ndarray real - imaginary time array of the chosen grid
+    w_n : 1D ndarray real - matsubara frequencies of the chosen grid
+    loops : int - iterations on all grids
+    """
+
+    n_freq = n_coarse
+    tau, w_n = gf.tau_wn_setup(dict(BETA=BETA, N_MATSUBARA=n_freq))
+    if seed is None:
+        g_d, g_o = gf_met(w_n, 0., tp, t, 0.)
+    else:
+        g_d, g_o = seed(w_n)
+    g_d, g_o, loops = solver(BETA, u_int, tp, g_d, g_o, tau, w_n, conv, t,
+                             **solver_kw)
+
+    while n_freq < n_max:
+        n_freq *= 2
+        w_old = w_n
+        tau, w_n = gf.tau_wn_setup(dict(BETA=BETA, N_MATSUBARA=n_freq))
+        old_d, old_o = g_d, g_o
+        g_d, g_o = gf.tail_extend(np.array([g_d, g_o]), w_old, w_n)
+        g_d, g_o, n_loops = solver(BETA, u_int, tp, g_d, g_o, tau, w_n,
+                                   conv, t, **solver_kw)
+        loops += n_loops
+        change = max(np.abs(g_d[:len(w_old)] - old_d).max(),
+                     np.abs(g_o[:len(w_old)] - old_o).max())
+        if change < tol:
+            break
+
+    return g_d, g_o, tau, w_n, loops
+
+
+class IPTWorkspace(object):
+    """Preallocated buffers to iterate the dimer IPT loop in place
+
+    Owns every array of an iteration of :func:`ipt_dmft_loop` for a
+    fixed grid: the Green functions and their previous values, the Weiss
+    fields, the self-energies, the imaginary time functions and the
+    scratch space of the Fourier transforms and of the matrix
+    operations. After construction an iteration only allocates the
+    outputs of the FFT library calls, also on grids that need the complex
+    transform instead of the real ones. One workspace serves all points
+    sharing the grid, its :meth:`solve` can replace
+    :func:`ipt_dmft_loop`, e.g. as solver of :func:`dmft.sweep.sweep`.
+
+    Parameters
+    ----------
+    tau : 1D ndarray real - imaginary time array
+    w_n : 1D ndarray real - matsubara frequency points
+    workers : int or None - threads for the FFTs
+
+    Examples
+    --------
+    >>> tau, w_n = gf.tau_wn_setup(dict(BETA=50., N_MATSUBARA=256))
+    >>> work = IPTWorkspace(tau, w_n)
+    >>> giw_d, giw_o = gf_met(w_n, 0., 0.3, 0.5, 0.)
+    >>> giw_d, giw_o, loops = work.solve(50., 2., 0.3, giw_d, giw_o, tau, w_n)
+    """
+
+    def __init__(self, tau, w_n, workers=None):
+        n_freq, n_tau = len(w_n), len(tau)
+        self.plan = gf.fourier_plan(tau[1] + tau[-1], n_tau, n_freq)
+        self.workers = workers
+        self.iw_n = 1j * w_n
+        self.hermitian = n_tau % 2 == 0 and n_freq <= n_tau // 2
+
+        self.giw_d, self.giw_o, self.old_d, self.old_o, self.g0iw_d, \
+            self.g0iw_o, self.siw_d, self.siw_o, self._c1, self._c2, \
+            self._c3, self._c4 = np.empty((12, n_freq), dtype=complex)
+        self._r1, self._r2 = np.empty((2, n_freq))
+        self._flags = np.empty(n_freq, dtype=bool)
+        self.g0t_d, self.g0t_o, self.st_d, self.st_o, self._t1, \
+            self._t2 = np.empty((6, n_tau))
+        self._ct = np.empty(n_tau, dtype=complex)
+        # Tails of the Weiss fields, set by each solve
+        self._tails = np.empty((4, n_freq), dtype=complex)
+        self._tails_t = np.empty((2, n_tau))
+
+    def _tail(self, coefs, basis, out, scratch):
+        out[:] = 0.
+        for coef, base in zip(coefs, basis):
+            if coef:
+                np.multiply(base, coef, out=scratch)
+                out += scratch
+
+    def _inverse(self, giw, tail_w, tail_t, out):
+        """Real G(tau) of a Green function with the given tail arrays"""
+        if not self.hermitian:
+            # Complex transform of gw_invfouriertrans, frequencies beyond
+            # the time grid resolution alias onto it
+            n_tau = len(out)
+            np.subtract(giw, tail_w, out=self._c4)
+            self._ct[:] = 0.
+            for start in range(0, len(giw), n_tau):
+                chunk = self._c4[start:start + n_tau]
+                self._ct[:len(chunk)] += chunk
+            g_tau = sfft.fft(self._ct, overwrite_x=True, workers=self.workers)
+            np.multiply(g_tau, self.plan.phase_bw, out=g_tau)
+            np.add(g_tau.real, tail_t, out=out)
+            return
+        half = len(out) // 2
+        np.subtract(giw.real, tail_w.real, out=self._r1)
+        np.subtract(giw.imag, tail_w.imag, out=self._r2)
+        cos_t = sfft.dct(self._r1, 2, half, workers=self.workers)
+        sin_t = sfft.dst(self._r2, 2, half, workers=self.workers)
+        out[0] = cos_t[0]
+        np.add(cos_t[1:], sin_t[:-1], out=out[1:half])
+        out[half] = sin_t[-1]
+        np.subtract(sin_t[-2::-1], cos_t[:0:-1], out=out[half + 1:])
+        out /= self.plan.beta
+        out += tail_t
+
+    def _forward(self, g_tau, coefs, out):
+        """G(iw_n) of a real G(tau) with the given tail moments"""
+        self._tail(coefs, self.plan.time_basis, self._t1, self._t2)
+        np.subtract(g_tau, self._t1, out=self._t1)
+        np.multiply(self._t1, self.plan.phase_fw, out=self._ct)
+        giw = sfft.ifft(self._ct, overwrite_x=True, workers=self.workers)
+        np.multiply(giw[:len(out)], self.plan.beta, out=out)
+        self._tail(coefs, self.plan.freq_basis, self._c3, self._c4)
+        out += self._c3
+
+    def _set_tails(self, tp):
+        plan = self.plan
+        self._tail((1., 0., tp**2 + 0.25), plan.freq_basis, self._tails[0],
+                   self._tails[1])
+        self._tail((0., tp, 0.), plan.freq_basis, self._tails[2],
+                   self._tails[3])
+        self._tail((1., 0., tp**2 + 0.25), plan.time_basis, self._tails_t[0],
+                   self._t1)
+        self._tail((0., tp, 0.), plan.time_basis, self._tails_t[1], self._t1)
+
+    def iterate(self, u_int, tp, t_sqr=0.25):
+        """One in place iteration of :func:`ipt_dmft_loop` starting from
+        :attr:`giw_d` and :attr:`giw_o`, the previous values stay in
+        :attr:`old_d` and :attr:`old_o`"""
+        g_d, g_o, g0_d, g0_o = self.giw_d, self.giw_o, self.g0iw_d, \
+            self.g0iw_o
+        c1, c2, c3, c4 = self._c1, self._c2, self._c3, self._c4
+
+        # Half-filling, particle-hole cleaning
+        g_d.real = 0.
+        g_o.imag = 0.
+        self.old_d[:] = g_d
+        self.old_o[:] = g_o
+
+        # Self-consistency, see self_consistency
+        np.multiply(g_d, -t_sqr, out=g0_d)
+        g0_d += self.iw_n
+        np.multiply(g_o, -t_sqr, out=g0_o)
+        g0_o -= tp
+        np.multiply(g0_d, g0_d, out=c1)
+        np.multiply(g0_o, g0_o, out=c2)
+        c1 -= c2
+        g0_d /= c1
+        g0_o /= c1
+        np.negative(g0_o, out=g0_o)
+
+        # Self-energy, see ipt_imag.dimer_sigma
+        u_sqr = u_int * u_int
+        self._inverse(g0_d, self._tails[0], self._tails_t[0], self.g0t_d)
+        self._inverse(g0_o, self._tails[2], self._tails_t[1], self.g0t_o)
+        for g_tau, s_tau, sign in ((self.g0t_d, self.st_d, 1),
+                                   (self.g0t_o, self.st_o, -1)):
+            np.multiply(g_tau, g_tau, out=s_tau)
+            s_tau *= g_tau
+            s_tau *= sign * u_sqr
+        st_d, st_o, step = self.st_d, self.st_o, self.plan.tau[1]
+        dj2d = -2 * ((st_d[2] - 2 * st_d[1] + st_d[0]) / step**2)
+        dj1o = 2 * (st_o[1] - st_o[0]) / step
+        self._forward(st_d, (u_sqr / 4, 0., dj2d), self.siw_d)
+        self._forward(st_o, (0., dj1o, 0.), self.siw_o)
+
+        # Dyson equation, see dimer_dyson
+        np.multiply(g0_d, self.siw_d, out=c1)
+        np.multiply(g0_o, self.siw_o, out=c2)
+        c1 += c2
+        np.subtract(1., c1, out=c1)
+        np.multiply(g0_d, self.siw_o, out=c2)
+        np.multiply(g0_o, self.siw_d, out=c3)
+        c2 += c3
+        np.negative(c2, out=c2)
+        np.multiply(c1, c1, out=c3)
+        np.multiply(c2, c2, out=c4)
+        c3 -= c4
+        np.multiply(c1, g0_d, out=g_d)
+        np.multiply(c2, g0_o, out=c4)
+        g_d -= c4
+        g_d /= c3
+        np.multiply(c1, g0_o, out=g_o)
+        np.multiply(c2, g0_d, out=c4)
+        g_o -= c4
+        g_o /= c3
+
+    def _close(self, old, new, conv):
+        """np.allclose(old, new, conv) without temporaries"""
+        np.subtract(old, new, out=self._c4)
+        np.abs(self._c4, out=self._r1)
+        np.abs(new, out=self._r2)
+        self._r2 *= conv
+        self._r2 += 1e-8
+        return np.less_equal(self._r1, self._r2, out=self._flags).all()
+
+    def solve(self, BETA, u_int, tp, giw_d, giw_o, tau, w_n, conv=1e-12,
+              t=.5, max_loops=3000):
+        """Converge a point, arguments and returns as in
+        :func:`ipt_dmft_loop`"""
+        if len(w_n) != len(self.iw_n) or len(tau) != len(self.plan.tau):
+            raise ValueError('Grid does not match the workspace')
+        self.giw_d[:] = giw_d
+        self.giw_o[:] = giw_o
+        self._set_tails(tp)
+        t_sqr = t * t
+
+        loops = 0
+        converged = False
+        while not converged:
+            self.iterate(u_int, tp, t_sqr)
+            converged = self._close(self.old_d, self.giw_d, conv) and \
+                self._close(self.old_o, self.giw_o, conv)
+            loops += 1
+            if loops > max_loops:
+                converged = True
+                print('B', BETA, 'tp', tp, 'U', u_int, 'D', 2 * t)
+                print('Failed to converge in less than {} iterations'.format(
+                    max_loops))
+
+        return self.giw_d.copy(), self.giw_o.copy(), loops
+
+
+def ekin(giw_d, giw_o, w_n, tp, beta, t_sqr=0.25, weights=1.):
     r"""Calculates the total kinetic energy of the dimer Bethe lattice
 
     .. math:: \langle T \rangle = \frac{8}{\beta} \sum_{n>0}
@@ -254,6 +781,9 @@ def ekin(giw_d, giw_o, w_n, tp, beta, t_sqr=0.25):
     t_sqr : float
         :math:`t^2` squared hopping to lattice, represent they lattice
         hybridization as :math:`\Delta=t^2G`
+    weights : real 1D ndarray
+        Quadrature weights of a sparse frequency grid, see
+        :func:`dmft.common.sparse_matsubara`
 
     References
     ----------
@@ -265,11 +795,12 @@ def ekin(giw_d, giw_o, w_n, tp, beta, t_sqr=0.25):
 
     """
 
-    return (tp * giw_o.real + t_sqr * (-giw_d.imag**2 + giw_o.real**2) +
-            (t_sqr + tp**2) / w_n**2).sum() / beta * 8 - beta * (t_sqr + tp**2)
+    return ((tp * giw_o.real + t_sqr * (-giw_d.imag**2 + giw_o.real**2) +
+             (t_sqr + tp**2) / w_n**2) * weights).sum() / beta * 8 - \
+        beta * (t_sqr + tp**2)
 
 
-def epot(giw_d, w_n, beta, M_3, e_kin, muN):
+def epot(giw_d, w_n, beta, M_3, e_kin, muN, weights=1.):
     r"""Calculates the total potential energy of the dimer
 
     .. math:: \langle V \rangle = \frac{4}{\beta} \sum_{n>0}
@@ -290,6 +821,9 @@ def epot(giw_d, w_n, beta, M_3, e_kin, muN):
         Kinetic energy of the dimer :math:`\langle T \rangle`
     muN : float
         Chemical potential weighted by occupation :math:`\mu\langle N \rangle`
+    weights : real 1D ndarray
+        Quadrature weights of a sparse frequency grid, see
+        :func:`dmft.common.sparse_matsubara`
 
 
     References
@@ -301,7 +835,63 @@ def epot(giw_d, w_n, beta, M_3, e_kin, muN):
     ekin
 
     """
-    return (-w_n * (giw_d.imag + 1 / w_n - M_3 / w_n**3)).sum() * 4 / beta - M_3 * beta / 2 + muN / 2 - e_kin / 2
+    return (-w_n * (giw_d.imag + 1 / w_n - M_3 / w_n**3) * weights).sum() * 4 / beta - M_3 * beta / 2 + muN / 2 - e_kin / 2
+
+
+def ekin_batch(giw_d, giw_o, w_n, tp, beta, t_sqr=0.25, n_freq=None,
+               weights=1.):
+    r"""Kinetic energy of many dimer solutions at once, see :func:`ekin`
+
+    Parameters
+    ----------
+    giw_d : complex ndarray
+        Diagonal Green functions :math:`G_{11}`, stacked on the leading
+        axes, frequencies on the last one
+    giw_o : complex ndarray
+        Off diagonal Green functions :math:`G_{12}`, same shape
+    w_n : real ndarray
+        Positive Matsubara frequencies, broadcastable to `giw_d`. For
+        per row temperatures use ``gf.matsubara_freq(beta[..., None], n)``
+    tp : float or ndarray
+        Dimer hybridization strength of each row
+    beta : float or ndarray
+        Inverse temperature of each row
+    t_sqr : float or ndarray
+        :math:`t^2` squared hopping to lattice
+    n_freq : int ndarray, optional
+        Frequencies summed on each row, for arrays padded with
+        :func:`dmft.common.stack_padded`
+    weights : real ndarray
+        Quadrature weights of a sparse frequency grid
+
+    Returns
+    -------
+    real ndarray of the leading shape
+    """
+    tp, t_sqr = np.asarray(tp), np.asarray(t_sqr)
+    tail = t_sqr + tp**2
+    summand = tp[..., None] * giw_o.real + \
+        t_sqr[..., None] * (-giw_d.imag**2 + giw_o.real**2) + \
+        tail[..., None] / w_n**2
+    return gf.matsubara_sum(summand, n_freq, weights) / beta * 8 - \
+        beta * tail
+
+
+def epot_batch(giw_d, w_n, beta, M_3, e_kin, muN, n_freq=None, weights=1.):
+    r"""Potential energy of many dimer solutions at once, see :func:`epot`
+
+    `beta`, `M_3`, `e_kin` and `muN` are floats or arrays over the leading
+    axes of `giw_d`. `w_n`, `n_freq` and `weights` as in
+    :func:`ekin_batch`
+
+    Returns
+    -------
+    real ndarray of the leading shape
+    """
+    M_3 = np.asarray(M_3)
+    summand = -w_n * (giw_d.imag + 1 / w_n - M_3[..., None] / w_n**3)
+    return gf.matsubara_sum(summand, n_freq, weights) * 4 / beta - \
+        M_3 * beta / 2 + np.asarray(muN) / 2 - np.asarray(e_kin) / 2
 
 ###############################################################################
 # The Symmetric Anti-Symmetric Basis
@@ -322,12 +912,8 @@ The Symmetric sum (Anti-bonding) returned first, Asymmetric is returned second
 """
 
     gf_s = 1j * gf_aa.imag + gf_ab.real  # Anti-bond
-    pc = gf.pade_coefficients(gf_s[w_set], w_n[w_set])
-    gr_s = gf.pade_rec(pc, w, w_n[w_set])
-
     gf_a = 1j * gf_aa.imag - gf_ab.real  # bond
-    pc = gf.pade_coefficients(gf_a[w_set], w_n[w_set])
-    gr_a = gf.pade_rec(pc, w, w_n[w_set])
+    gr_s, gr_a = gf.pade_continuation(np.array([gf_s, gf_a]), w_n, w, w_set)
 
     return gr_s, gr_a
 
@@ -22,6 +22,7 @@ import numba
 import numpy as np
 
 from dmft.common import tau_wn_setup, gw_invfouriertrans, greenF
+import dmft.monitor as monitor
 import dmft.hffast as hffast
 
 
@@ -56,9 +57,13 @@ def ising_v(dtau, U, L, fields=1, polar=0.5):
     return vis * lam
 
 
-def imp_solver(g0_blocks, v, interaction, parms_user):
+def imp_solver(g0_blocks, v, interaction, parms_user, observer=None):
     r"""Impurity solver call. Calcutaltes the interacting Green function
     as given by the contribution of the auxiliary discretized spin field.
+
+    The `observer`, see :mod:`dmft.monitor`, receives at the end a record
+    with the acceptance ratio, the sign changes and the time spent in the
+    field updates and in the measurements.
     """
 
     comm = MPI.COMM_WORLD
@@ -102,6 +107,7 @@ def imp_solver(g0_blocks, v, interaction, parms_user):
     chi = np.zeros(ntau)
     hffast.set_seed(parms['SEED'])
 
+    timer = monitor.StageTimer()
     update = False
     for mcs in range(parms['sweeps'] + parms['therm']):
         if mcs % parms['therm'] == 0 and parms['global_flip']:
@@ -112,30 +118,32 @@ def imp_solver(g0_blocks, v, interaction, parms_user):
             g = [gnewclean(g_sp, lv, kroneker) for g_sp, lv in zip(GX, int_v)]
             update = False
 
-        for _ in range(parms['meas']):
-            for i, (up, dw) in enumerate(i_pairs):
-                acr, nrat = hffast.updateDHS(g[up], g[dw], v[i], ntau,
-                                             parms['double_flip_prob'],
-                                             ['Heat_bath'])
-                acc += acr
-                anrat += nrat
+        with timer.stage('updates'):
+            for _ in range(parms['meas']):
+                for i, (up, dw) in enumerate(i_pairs):
+                    acr, nrat = hffast.updateDHS(g[up], g[dw], v[i], ntau,
+                                                 parms['double_flip_prob'],
+                                                 ['Heat_bath'])
+                    acc += acr
+                    anrat += nrat
 
         if mcs > parms['therm']:
-            for i in range(interaction.shape[0]):
-                Gbin[i] += g[i]
-                Gst[i] += g[i]
-            if mcs % parms['therm'] == 0 and parms['binned_meas']:
-                Gbin = np.array(Gbin) / parms['therm']
-                np.save(parms['work_dir'] + '/gtau_bin_mcs{}_r{}'.format(mcs,
-                                                                         comm.rank),
+            with timer.stage('measure'):
+                for i in range(interaction.shape[0]):
+                    Gbin[i] += g[i]
+                    Gst[i] += g[i]
+                if mcs % parms['therm'] == 0 and parms['binned_meas']:
+                    Gbin = np.array(Gbin) / parms['therm']
+                    np.save(parms['work_dir'] + '/gtau_bin_mcs{}_r{}'.format(
+                        mcs, comm.rank),
                         np.squeeze([-1 * avg_g(gst, parms) for gst in Gbin]))
-                Gbin = [np.zeros_like(gx) for gx in GX]
+                    Gbin = [np.zeros_like(gx) for gx in GX]
 
-            orbital_occupation(g, occupation, ntau, flavors_ind)
-            double_occupation(g, double_occ, ntau, flavor_pairs)
-            if parms['save_logs']:
-                vlog.append(v > 0)
-                ar.append(acr)
+                orbital_occupation(g, occupation, ntau, flavors_ind)
+                double_occupation(g, double_occ, ntau, flavor_pairs)
+                if parms['save_logs']:
+                    vlog.append(v > 0)
+                    ar.append(acr)
 
     tGst = np.asarray(Gst)
     Gst = np.zeros_like(tGst)
@@ -148,6 +156,9 @@ def imp_solver(g0_blocks, v, interaction, parms_user):
 
     print('occ', occupation)
     print('docc', double_occ, 'acc ', acc, 'nsign', anrat, 'rank', comm.rank)
+    monitor.notify(observer, sweeps=parms['sweeps'], acceptance=acc,
+                   nsign=anrat, rank=comm.rank, times=timer.reset(),
+                   u_int=parms.get('U'), beta=parms.get('BETA'))
 
     comm.Allreduce(occupation.copy(), occupation)
     comm.Allreduce(double_occ.copy(), double_occ)
@@ -32,11 +32,14 @@ from numba import jit
 from scipy.integrate import quad, simps
 from scipy.optimize import fsolve
 import numpy as np
-from dmft.common import gt_fouriertrans, gw_invfouriertrans
+from dmft.mixing import get_mixer
+from dmft.monitor import StageTimer, notify, stage
+from dmft.common import gt_fouriertrans, gw_invfouriertrans, matsubara_sum, \
+    PRECISIONS
 import slaveparticles.quantum.dos as dos
 
 
-def single_band_ipt_solver(u_int, g_0_iwn, w_n, tau):
+def single_band_ipt_solver(u_int, g_0_iwn, w_n, tau, timer=None):
     r"""Given a Green function it returns a dressed one and the self-energy
 
     .. math:: \Sigma(\tau) \approx U^2 \mathcal{G}^0(\tau)^3
@@ -49,24 +52,35 @@ def single_band_ipt_solver(u_int, g_0_iwn, w_n, tau):
 
     Parameters
     ----------
-    u_int: float, local contact interaction
-    g_0_iwn: complex 1D ndarray
-        *bare* Green function, the Weiss field
+    u_int: float or 1D ndarray
+        local contact interaction, one for each row of `g_0_iwn`
+    g_0_iwn: complex ndarray
+        *bare* Green function, the Weiss field. Frequencies on the last
+        axis, a batch of independent problems on the first. The
+        calculation keeps its precision, single or double
     w_n: real 1D ndarray
         Matsubara frequencies
     tau: real 1D array
         Imaginary time points, not included edge point of :math:`\beta^-`
+    timer : :class:`dmft.monitor.StageTimer`, optional
+        Collects the time spent in the Fourier transforms
     """
 
-    g_0_tau = gw_invfouriertrans(g_0_iwn, tau, w_n, [1., 0., 0.25])
+    u_int = np.asarray(u_int, g_0_iwn.real.dtype)[..., None]
+    with stage(timer, 'transforms'):
+        g_0_tau = gw_invfouriertrans(g_0_iwn, tau, w_n, [1., 0., 0.25],
+                                     hermitian=True)
     sigma_tau = u_int**2 * g_0_tau**3
-    sigma_iwn = gt_fouriertrans(sigma_tau, tau, w_n, [u_int**2 / 4., 0., 0.])
+    with stage(timer, 'transforms'):
+        sigma_iwn = gt_fouriertrans(sigma_tau, tau, w_n,
+                                    [u_int**2 / 4., 0., 0.])
     g_iwn = g_0_iwn / (1 - sigma_iwn * g_0_iwn)
 
     return g_iwn, sigma_iwn
 
 
-def dmft_loop(u_int, t, g_iwn, w_n, tau, mix=1, conv=1e-3):
+def dmft_loop(u_int, t, g_iwn, w_n, tau, mix=1, conv=1e-3, mixer=None,
+              observer=None, precision='double'):
     r"""Performs the paramagnetic(spin degenerate) self-consistent loop in a
     bethe lattice given the input
 
@@ -84,6 +98,15 @@ def dmft_loop(u_int, t, g_iwn, w_n, tau, mix=1, conv=1e-3):
             fraction of new solution for next input as bath Green function
     w_n : real float array
             fermionic matsubara frequencies. Only use the positive ones
+    mixer : None, str or mixer
+            Acceleration of the loop acting on :math:`\Im m G`, see
+            :func:`dmft.mixing.get_mixer`. By default linear with `mix`
+    observer : callable or list of callables
+            Receives a record of every iteration, see :mod:`dmft.monitor`
+    precision : 'double' or 'single'
+            Floating point type of the iteration. Single precision halves
+            the memory traffic but only resolves relative changes above
+            :math:`10^{-6}`, keep `conv` above that
 
     Returns
     -------
@@ -94,28 +117,43 @@ def dmft_loop(u_int, t, g_iwn, w_n, tau, mix=1, conv=1e-3):
 
     converged = False
     loops = 0
-    iw_n = 1j * w_n
+    real, cplx = PRECISIONS[precision]
+    g_iwn = np.asarray(g_iwn, cplx)
+    iw_n = 1j * w_n.astype(real)
+    mixer = get_mixer(mixer, mix)
+    timer = StageTimer() if observer is not None else None
     while not converged:
         g_iwn_old = g_iwn.copy()
-        g_0_iwn = 1. / (iw_n - t**2 * g_iwn_old)
-        g_iwn, sigma_iwn = single_band_ipt_solver(u_int, g_0_iwn, w_n, tau)
+        with stage(timer, 'self_consistency'):
+            g_0_iwn = 1. / (iw_n - t**2 * g_iwn_old)
+        with stage(timer, 'solver'):
+            g_iwn, sigma_iwn = single_band_ipt_solver(u_int, g_0_iwn, w_n,
+                                                      tau, timer)
         # Clean for Half-fill
         g_iwn.real = 0.
         converged = np.allclose(g_iwn_old, g_iwn, conv)
         loops += 1
+        if observer is not None:
+            notify(observer, loop=loops, converged=converged,
+                   residual=np.abs(g_iwn - g_iwn_old).max(),
+                   times=timer.reset(), u_int=u_int, t=t)
         if loops > 500:
             converged = True
-        g_iwn = mix * g_iwn + (1 - mix) * g_iwn_old
+        g_iwn = 1j * mixer(g_iwn_old.imag, g_iwn.imag).astype(real)
     return g_iwn, sigma_iwn
 
 ###############################################################################
 # Energy calculations
 
 
-def ekin(g_iw, s_iw, beta, w_n, ek_mean, g_iwfree):
+def ekin(g_iw, s_iw, beta, w_n, ek_mean, g_iwfree, weights=1.):
     """Calculates the Kinetic Energy
+
+    weights are the quadrature weights of a sparse frequency grid, see
+    :func:`dmft.common.sparse_matsubara`
     """
-    return 2 * (1j * w_n * (g_iw - g_iwfree) - s_iw * g_iw).real.sum() / beta + ek_mean
+    return 2 * ((1j * w_n * (g_iw - g_iwfree) - s_iw * g_iw).real *
+                weights).sum() / beta + ek_mean
 
 
 def ekin_tau(g_iw, tau, w_n, u_int):
@@ -123,7 +161,7 @@ def ekin_tau(g_iw, tau, w_n, u_int):
     return -0.5 * simps(gt * gt, tau)
 
 
-def epot(g_iw, s_iw, u, beta, w_n):
+def epot(g_iw, s_iw, u, beta, w_n, weights=1.):
     r"""Calculates the Potential Energy
 
     Using the local Green Function and self energy the potential
@@ -140,11 +178,49 @@ def epot(g_iw, s_iw, u, beta, w_n):
     .. math:: = \frac{1}{\beta} \sum_{n>0} \Re e (\Sigma(i\omega_n)G(i\omega_n) - \frac{U^2}{4(i\omega_n)^2}) + \frac{U^2}{8\beta} \sum_{n} \frac{1}{(i\omega_n)^2}
     .. math:: = \frac{1}{\beta} \sum_{n>0} \Re e (\Sigma(i\omega_n)G(i\omega_n) - \frac{U^2}{4(i\omega_n)^2}) - \frac{U^2\beta}{32}
 
+    On a sparse frequency grid pass its quadrature `weights`, see
+    :func:`dmft.common.sparse_matsubara`
+
     """
     # the last u/8 is because sigma to zero order has the Hartree term
     # that is avoided in IPT Sigma=U/2. Then times G->1/2 after sum
     # and times 1/2 of the formula
-    return (s_iw * g_iw + u**2 / 4. / w_n**2).real.sum() / beta - beta * u**2 / 32. + u / 8
+    return ((s_iw * g_iw + u**2 / 4. / w_n**2).real * weights).sum() / beta - \
+        beta * u**2 / 32. + u / 8
+
+
+def ekin_batch(g_iw, s_iw, beta, w_n, ek_mean, g_iwfree, n_freq=None,
+               weights=1.):
+    """Kinetic energy of many solutions at once, see :func:`ekin`
+
+    Green functions and self-energies are stacked on the leading axes,
+    `beta` and `ek_mean` are floats or arrays over them. For per row
+    temperatures use ``matsubara_freq(beta[..., None], n)`` as `w_n`,
+    rows padded with :func:`dmft.common.stack_padded` only sum their
+    first `n_freq` frequencies.
+
+    Returns
+    -------
+    real ndarray of the leading shape
+    """
+    summand = (1j * w_n * (g_iw - g_iwfree) - s_iw * g_iw).real
+    return 2 * matsubara_sum(summand, n_freq, weights) / beta + ek_mean
+
+
+def epot_batch(g_iw, s_iw, u, beta, w_n, n_freq=None, weights=1.):
+    """Potential energy of many solutions at once, see :func:`epot`
+
+    `u` and `beta` are floats or arrays over the leading axes, the rest
+    as in :func:`ekin_batch`
+
+    Returns
+    -------
+    real ndarray of the leading shape
+    """
+    u = np.asarray(u)
+    summand = (s_iw * g_iw + (u**2)[..., None] / 4. / w_n**2).real
+    return matsubara_sum(summand, n_freq, weights) / beta - \
+        beta * u**2 / 32. + u / 8
 
 
 def n_half(mu, beta, D=1):
@@ -163,7 +239,8 @@ def _dimer_sigma(g0t_d, g0t_o, U):
     return g0t_d * g0t_d * g0t_d * U * U, -g0t_o * g0t_o * g0t_o * U * U
 
 
-def dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau, w_n):
+def dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau, w_n, spline=False,
+                timer=None):
     r"""Given a Green function it returns the self-energy
 
     .. math:: \Sigma(\tau) \approx - U^2 \mathcal{G}^0(\tau)\mathcal{G}^0(-\tau)\mathcal{G}^0(\tau)
@@ -181,29 +258,45 @@ def dimer_sigma(u_int, tp, g0iw_d, g0iw_o, tau, w_n):
 
     where :math:`M_3,M_2` are calculated from the derivatives of the :math:`\Sigma(\tau)`
 
+    All arguments but `tau` and `w_n` can carry a batch of independent
+    problems, the Green functions on rows and the parameters as 1D arrays.
+
     Parameters
     ----------
-    u_int : float, local contact interaction
-    tp : float, dimer hybridization strength
-    g0iw_d : complex 1D ndarray
+    u_int : float or 1D ndarray, local contact interaction
+    tp : float or 1D ndarray, dimer hybridization strength
+    g0iw_d : complex ndarray
         *bare* local Green function, the Weiss field
-    g0iw_o : complex 1D ndarray
+    g0iw_o : complex ndarray
         *bare* hybridizing Green function, the Weiss field
     tau: real 1D array
         Imaginary time points, not included edge point of :math:`\beta^-`
     w_n: real 1D ndarray
         Matsubara frequencies
+    spline : bool
+        Use the cubic spline quadrature for the transform of
+        :math:`\Sigma(\tau)`, tolerating a coarser time grid
+    timer : :class:`dmft.monitor.StageTimer`, optional
+        Collects the time spent in the Fourier transforms
     """
 
-    g0t_d = gw_invfouriertrans(g0iw_d, tau, w_n, [1., 0., tp**2 + 0.25])
-    g0t_o = gw_invfouriertrans(g0iw_o, tau, w_n, [0., tp, 0.])
+    u_int = np.asarray(u_int, g0iw_d.real.dtype)[..., None]
+    tp = np.asarray(tp, g0iw_d.real.dtype)[..., None]
+    with stage(timer, 'transforms'):
+        g0t_d = gw_invfouriertrans(g0iw_d, tau, w_n, [1., 0., tp**2 + 0.25],
+                                   hermitian=True)
+        g0t_o = gw_invfouriertrans(g0iw_o, tau, w_n, [0., tp, 0.],
+                                   hermitian=True)
 
     st_d, st_o = _dimer_sigma(g0t_d, g0t_o, u_int)
 
-    dj2d = -2 * ((st_d[2] - 2 * st_d[1] + st_d[0]) / tau[1]**2)
-    sw_d = gt_fouriertrans(
-        st_d, tau, w_n, [u_int**2 / 4, 0., dj2d])
-    dj1o = 2 * (st_o[1] - st_o[0]) / tau[1]
-    sw_o = gt_fouriertrans(st_o, tau, w_n, [0., dj1o, 0.])
+    dj2d = -2 * ((st_d[..., 2:3] - 2 * st_d[..., 1:2] + st_d[..., :1]) /
+                 tau[1]**2)
+    dj1o = 2 * (st_o[..., 1:2] - st_o[..., :1]) / tau[1]
+    with stage(timer, 'transforms'):
+        sw_d = gt_fouriertrans(
+            st_d, tau, w_n, [u_int**2 / 4, 0., dj2d], spline=spline)
+        sw_o = gt_fouriertrans(st_o, tau, w_n, [0., dj1o, 0.],
+                               spline=spline)
 
     return sw_d, sw_o
@@ -2,43 +2,512 @@
 r"""
 IPT in real frequencies
 -----------------------
+
+The second order self-energy is a double convolution of the particle and
+hole spectral functions :math:`A^\pm(\omega)=A(\omega)n_F(\mp\omega)`
+
+.. math:: \Im m \Sigma(\omega) = -\pi U^2 \left[A^+ * (A^- \star A^+)
+    + A^- * (A^+ \star A^-)\right](\omega)
+
+:class:`SpectralConvolution` transforms :math:`A^\pm` once and forms both
+terms as products in Fourier space, padded so that the bubbles are not
+truncated at the grid edges. :class:`GridConvolution` extends it to the
+non-equispaced grids of :func:`sinh_grid`, which together with the exact
+kernel of :class:`KramersKronig` let the DMFT loops resolve the low
+energy features with few frequencies.
 """
 # Author: Óscar Nájera
 
 from __future__ import division, absolute_import, print_function
-import scipy.signal as signal
+import scipy.fft as sfft
 import numpy as np
 import matplotlib.pyplot as plt
 import dmft.common as gf
+import dmft.monitor as monitor
 plt.matplotlib.rcParams.update({'axes.labelsize': 22,
                                 'axes.titlesize': 22, 'figure.autolayout': True})
 
 
-def sigma(Aw, nf, U):
-    Ap = Aw * nf
-    Am = Aw * nf[::-1]
-    App = signal.fftconvolve(Ap[::-1], Am, mode='same')
-    Amm = signal.fftconvolve(Am[::-1], Ap, mode='same')
-    Ampp = signal.fftconvolve(Am, App, mode='same')
-    Apmm = signal.fftconvolve(Ap, Amm, mode='same')
-    return -np.pi * U**2 * (Apmm + Ampp)
+class SpectralConvolution(object):
+    r"""Second order diagrams of spectral functions on a fixed grid
+
+    The frequency grid must be equispaced and symmetric. The spectral
+    functions :math:`A^\pm` are zero padded to fit the triple
+    convolution, real FFTs of the padded length are used and the
+    reflection :math:`A(-\omega)` becomes a conjugation times the phase
+    :math:`e^{-2\pi ik(N-1)/L}` computed once at construction. Functions
+    on the last axis, leading axes are a batch transformed in one call.
+
+    Use :func:`convolution_plan` to get cached instances.
+
+    Parameters
+    ----------
+    n_w : int
+        Points of the frequency grid
+    workers : int or None
+        Threads for the FFT, see :func:`scipy.fft.rfft`
+    """
+
+    def __init__(self, n_w, workers=None):
+        self.n_w = n_w
+        self.workers = workers
+        self.size = sfft.next_fast_len(3 * n_w - 2, real=True)
+        self.start = 2 * ((n_w - 1) // 2)
+        k = np.arange(self.size // 2 + 1)
+        self.reflect = np.exp(-2j * np.pi * k * (n_w - 1) / self.size)
+
+    def _rfft(self, arr, workers):
+        workers = self.workers if workers is None else workers
+        return sfft.rfft(arr, self.size, axis=-1, workers=workers)
+
+    def _irfft(self, arr, workers):
+        workers = self.workers if workers is None else workers
+        return sfft.irfft(arr, self.size, axis=-1, workers=workers)[
+            ..., self.start:self.start + self.n_w]
+
+    def sigma(self, a_w, nf, u_int, workers=None):
+        r"""Imaginary part of the second order self-energy
+
+        Parameters
+        ----------
+        a_w : real ndarray
+            Spectral functions on the last axis
+        nf : real ndarray
+            Fermi function on the grid, on the last axis
+        u_int : float or ndarray
+            Local interaction, broadcast against the batch with a
+            trailing axis of size 1
+        workers : int or None
+            Threads for the FFTs, by default the ones of the plan. The
+            functions of the batch, e.g. the channels of the dimer, are
+            transformed in parallel
+
+        Returns
+        -------
+        real ndarray
+            :math:`\Im m\Sigma(\omega)/d\omega^2`, same shape as `a_w`
+        """
+        a_w = np.asarray(a_w)
+        a_pm = self._rfft(np.stack((a_w * nf, a_w * nf[..., ::-1])),
+                          workers)
+        a_p, a_m = a_pm[0], a_pm[1]
+        bubble = a_p * a_m.conj()
+        return -np.pi * u_int**2 * self._irfft(
+            self.reflect * (bubble.conj() * a_m + bubble * a_p), workers)
+
+    def ph_hf_sigma(self, a_w, nf, u_int, workers=None):
+        """Imaginary part of the second order self-energy at particle-hole
+        symmetry, see :func:`ph_hf_sigma`"""
+        a_p = self._rfft(np.asarray(a_w) * nf, workers)
+        appp = self._irfft(a_p**3, workers)
+        return -np.pi * u_int**2 * (appp + appp[..., ::-1])
+
+
+_CONVOLUTION_PLANS = {}
+
+
+def convolution_plan(n_w):
+    """Returns a cached :class:`SpectralConvolution` for grids of `n_w`
+    points"""
+    try:
+        return _CONVOLUTION_PLANS[n_w]
+    except KeyError:
+        if len(_CONVOLUTION_PLANS) >= 16:
+            _CONVOLUTION_PLANS.pop(next(iter(_CONVOLUTION_PLANS)))
+        plan = _CONVOLUTION_PLANS[n_w] = SpectralConvolution(n_w)
+        return plan
+
+
+def sinh_grid(w_max, n_w, step=1e-3):
+    r"""Symmetric frequency grid dense around the Fermi level
+
+    .. math:: \omega_j = a\sinh(x_j) \quad x_j\in[-x_{max}, x_{max}]
+
+    with :math:`x_j` equispaced and :math:`a` chosen for the grid
+    spacing to be `step` at :math:`\omega=0`. The spacing grows
+    exponentially up to the edges, the low energy features are resolved
+    with a fraction of the points of an equispaced grid. The convolutions
+    of :class:`GridConvolution` on it grow about as
+    :math:`\sqrt{n_w/step}`.
+
+    Parameters
+    ----------
+    w_max : float
+        Largest frequency
+    n_w : int
+        Amount of points, odd to include :math:`\omega=0`
+    step : float
+        Spacing at the Fermi level, at most that of the equispaced grid
+    """
+    ratio = 2 * w_max / (n_w - 1) / step
+    if ratio <= 1:
+        raise ValueError('step must be smaller than the equispaced spacing')
+    # spacing at 0 is w_max * dx / sinh(x_max), solve sinh(x)/x = ratio
+    x_max = np.arcsinh(ratio)
+    for _ in range(100):
+        x_max = np.arcsinh(ratio * x_max)
+    return w_max * np.sinh(np.linspace(-x_max, x_max, n_w)) / np.sinh(x_max)
+
+
+def _linear_weights(x, y):
+    """Indices and weights to linearly interpolate from points `x` to
+    points `y`, zero outside of `x`"""
+    idx = np.clip(np.searchsorted(x, y) - 1, 0, len(x) - 2)
+    frac = (y - x[idx]) / (x[idx + 1] - x[idx])
+    inside = (frac >= -1e-12) & (frac <= 1 + 1e-12)
+    return idx, np.where(inside, 1 - frac, 0), np.where(inside, frac, 0)
+
+
+def _interpolate(arr, weights):
+    idx, left, right = weights
+    return arr[..., idx] * left + arr[..., idx + 1] * right
+
+
+class GridConvolution(object):
+    r"""Second order diagrams on any symmetric frequency grid
+
+    On equispaced grids this is :class:`SpectralConvolution` scaled by
+    the squared spacing. Non-equispaced grids, like the ones of
+    :func:`sinh_grid`, are only dense close to :math:`\omega=0` and the
+    convolutions are done on a two-level auxiliary grid: a fine one of
+    spacing `step` on a window around the Fermi level and a coarse one,
+    with half the spacing of `w` at the window edge, over the whole
+    range.
+
+    Every function is linearly interpolated to both levels and split
+    with a taper into an inner part, on the fine level, and a smooth
+    outer part, on the coarse level. In
+
+    .. math:: f*g = f_{out}*g_{out} + f_{out}*g_{in} + f_{in}*g_{out}
+        + f_{in}*g_{in}
+
+    only the last term is done on the fine level. The cross terms are
+    done on the coarse level, where the inner parts are projected on the
+    hat functions of the coarse grid, which keeps their integral against
+    any function linear between coarse points. The window is chosen to
+    minimize the FFT sizes, that grow about as
+    :math:`\sqrt{n_w/step}` instead of the :math:`1/step` of a single
+    auxiliary grid. The rest of the DMFT loop, Kramers-Kronig included,
+    works with the points of the original grid.
+
+    Parameters
+    ----------
+    w : real 1D ndarray
+        Increasing grid, symmetric around 0
+    step : float or None
+        Spacing of the fine level, by default the smallest spacing of `w`
+    taper : int
+        Coarse points over which the inner part falls to zero
+    workers : int or None
+        Threads for the FFT, see :func:`scipy.fft.rfft`
+    """
+
+    def __init__(self, w, step=None, taper=8, workers=None):
+        w = np.asarray(w, dtype=float)
+        d_w = np.diff(w)
+        self.workers = workers
+        self.uniform = np.allclose(d_w, d_w[0], rtol=1e-8, atol=0)
+        if self.uniform:
+            self.step = d_w[0]
+            self.plan = SpectralConvolution(len(w), workers)
+            return
+
+        self.step = step or d_w.min()
+        self._levels(w, taper)
+        x_c = np.arange(-self.n_coarse, self.n_coarse + 1) * self.coarse_step
+        x_f = np.arange(-self.n_fine, self.n_fine + 1) * self.step
+        edge = self.n_window * self.coarse_step
+        self._taper_c = np.clip((edge - np.abs(x_c)) /
+                                (taper * self.coarse_step), 0, 1)
+        self._taper_f = np.clip((edge - np.abs(x_f)) /
+                                (taper * self.coarse_step), 0, 1)
+        self._to_coarse = _linear_weights(w, x_c)
+        self._to_fine = _linear_weights(w, x_f)
+        self._inner = np.abs(w) < x_f[-1]
+        self._from_fine = _linear_weights(x_f, w[self._inner])
+        self._from_coarse = _linear_weights(x_c, w[~self._inner])
+        self._ramp = np.arange(self.ratio) / self.ratio
+        self._wrap = (np.arange(-self.n_coarse, self.n_coarse + 1) +
+                      2 * self.n_coarse) % self.fft_coarse
+        k = np.arange(self.fft_coarse // 2 + 1)
+        self._reflect_c = np.exp(-4j * np.pi * k * self.n_coarse /
+                                 self.fft_coarse)
+        k = np.arange(self.fft_fine // 2 + 1)
+        self._reflect_f = np.exp(-4j * np.pi * k * self.n_fine /
+                                 self.fft_fine)
+
+    def _levels(self, w, taper):
+        """Window and coarse spacing of the smallest FFTs
+
+        Candidate coarse spacings are the multiples of `step` fitting in
+        half the spacing of `w` at each positive point, taken as the
+        inner edge of the taper."""
+        w_max = w[-1]
+        best = None
+        for j in np.flatnonzero(w >= 0)[:-1]:
+            ratio = int((w[j + 1] - w[j]) / self.step / 2 * (1 + 1e-9))
+            if ratio < 1:
+                continue
+            coarse_step = ratio * self.step
+            window = int(np.ceil(w[j] / coarse_step - 1e-9)) + taper
+            n_half = int(np.ceil(w_max / coarse_step - 1e-9))
+            n_coarse = max(2 * n_half, 2 * window)
+            fft_c = sfft.next_fast_len(n_coarse + 3 * n_half + 1, real=True)
+            fft_f = sfft.next_fast_len(4 * window * ratio + 1, real=True)
+            cost = fft_c * np.log(fft_c) + fft_f * np.log(fft_f)
+            if best is None or cost < best[0]:
+                best = cost, ratio, window, n_coarse, fft_c, fft_f
+        _, self.ratio, self.n_window, self.n_coarse, self.fft_coarse, \
+            self.fft_fine = best
+        self.coarse_step = self.ratio * self.step
+        self.n_fine = self.n_window * self.ratio
+
+    def _project(self, inner):
+        """Weights of the inner part on the coarse hat functions"""
+        ratio, n_win, n_c = self.ratio, self.n_window, self.n_coarse
+        cells = inner[..., :-1].reshape(inner.shape[:-1] + (2 * n_win, ratio))
+        out = np.zeros(inner.shape[:-1] + (2 * n_c + 1,))
+        out[..., n_c - n_win:n_c + n_win] = np.dot(cells, 1 - self._ramp)
+        out[..., n_c - n_win + 1:n_c + n_win + 1] += np.dot(cells, self._ramp)
+        out[..., n_c + n_win] += inner[..., -1]
+        return out / ratio
+
+    def _refine(self, coarse):
+        """Coarse level function linearly interpolated to the fine
+        level"""
+        n_win, n_c = self.n_window, self.n_coarse
+        fine = np.empty(coarse.shape[:-1] + (2 * self.n_fine + 1,))
+        fine[..., :-1] = (
+            coarse[..., n_c - n_win:n_c + n_win, None] * (1 - self._ramp) +
+            coarse[..., n_c - n_win + 1:n_c + n_win + 1, None] * self._ramp
+        ).reshape(fine[..., :-1].shape)
+        fine[..., -1] = coarse[..., n_c + n_win]
+        return fine
+
+    def _spectra(self, coarse, fine, workers):
+        """Spectra of the outer part, of the projected inner part and of
+        the inner part of functions given on both levels"""
+        inner = self._taper_f * fine
+        outer, projected = sfft.rfft(
+            np.stack(((1 - self._taper_c) * coarse, self._project(inner))),
+            self.fft_coarse, axis=-1, workers=workers)
+        return outer, projected, sfft.rfft(inner, self.fft_fine, axis=-1,
+                                           workers=workers)
+
+    def _reflect(self, spectra):
+        r"""Spectra of the functions at :math:`-\omega`"""
+        outer, projected, inner = spectra
+        return (outer.conj() * self._reflect_c,
+                projected.conj() * self._reflect_c,
+                inner.conj() * self._reflect_f)
+
+    @staticmethod
+    def _product(f, g):
+        """Spectra of the convolution on both levels, the cross terms go
+        to the coarse level"""
+        return f[0] * (g[0] + g[1]) + f[1] * g[0], f[2] * g[2]
+
+    def _values(self, coarse, inner, workers):
+        """Values on both levels of the convolutions with spectra from
+        :meth:`_product`"""
+        n_c, n_f = self.n_coarse, self.n_fine
+        coarse = sfft.irfft(coarse, self.fft_coarse, axis=-1,
+                            workers=workers)[..., self._wrap] * \
+            self.coarse_step
+        inner = sfft.irfft(inner, self.fft_fine, axis=-1,
+                           workers=workers)[..., :4 * n_f + 1] * self.step
+        fine = self._refine(coarse) + inner[..., n_f:3 * n_f + 1]
+        n_win = 2 * self.n_window
+        coarse[..., n_c - n_win:n_c + n_win + 1] += inner[..., ::self.ratio]
+        return coarse, fine
+
+    def _on_levels(self, arr):
+        arr = np.asarray(arr)
+        return (_interpolate(arr, self._to_coarse),
+                _interpolate(arr, self._to_fine))
+
+    def _on_grid(self, coarse, fine):
+        out = np.empty(coarse.shape[:-1] + self._inner.shape)
+        out[..., self._inner] = _interpolate(fine, self._from_fine)
+        out[..., ~self._inner] = _interpolate(coarse, self._from_coarse)
+        return out
+
+    def sigma(self, a_w, nf, u_int, workers=None):
+        r"""Imaginary part of the second order self-energy, see
+        :meth:`SpectralConvolution.sigma`"""
+        workers = self.workers if workers is None else workers
+        if self.uniform:
+            return self.plan.sigma(a_w, nf, u_int, workers) * self.step**2
+        a_w = np.asarray(a_w)
+        a_pm = self._spectra(*self._on_levels(
+            np.stack((a_w * nf, a_w * nf[..., ::-1]))), workers=workers)
+        a_p = [spec[0] for spec in a_pm]
+        a_m = [spec[1] for spec in a_pm]
+        bubble = self._spectra(*self._values(
+            *self._product(self._reflect(a_m), a_p), workers=workers),
+            workers=workers)
+        term_p = self._product(a_p, bubble)
+        term_m = self._product(a_m, self._reflect(bubble))
+        isi = self._values(term_p[0] + term_m[0], term_p[1] + term_m[1],
+                           workers)
+        return -np.pi * u_int**2 * self._on_grid(*isi)
+
+    def ph_hf_sigma(self, a_w, nf, u_int, workers=None):
+        r"""Imaginary part of the second order self-energy at particle-hole
+        symmetry, see :func:`ph_hf_sigma`"""
+        workers = self.workers if workers is None else workers
+        if self.uniform:
+            return self.plan.ph_hf_sigma(a_w, nf, u_int,
+                                         workers) * self.step**2
+        a_p = self._spectra(*self._on_levels(np.asarray(a_w) * nf),
+                            workers=workers)
+        bubble = self._spectra(*self._values(*self._product(a_p, a_p),
+                                             workers=workers),
+                               workers=workers)
+        appp = self._on_grid(*self._values(*self._product(bubble, a_p),
+                                           workers=workers))
+        return -np.pi * u_int**2 * (appp + appp[..., ::-1])
+
+
+_GRID_PLANS = {}
+
+
+def grid_convolution(w):
+    """Returns a cached :class:`GridConvolution` for the grid `w`"""
+    w = np.asarray(w, dtype=float)
+    key = w.tobytes()
+    try:
+        return _GRID_PLANS[key]
+    except KeyError:
+        if len(_GRID_PLANS) >= 16:
+            _GRID_PLANS.pop(next(iter(_GRID_PLANS)))
+        plan = _GRID_PLANS[key] = GridConvolution(w)
+        return plan
+
+
+class KramersKronig(object):
+    r"""Real part of a causal function from its imaginary part on a fixed
+    grid
+
+    .. math:: \Re e\Sigma(\omega) = \frac{1}{\pi}\mathcal{P}\int
+        \frac{\Im m\Sigma(\omega')}{\omega'-\omega}d\omega'
+
+    On equispaced grids the discrete Hilbert transform of
+    :func:`scipy.signal.hilbert` is used, zero padded to `pad` times the
+    grid. The filter of the padded real FFT is computed once. The exact
+    kernel integrates the principal value of the piecewise linear
+    interpolation of the imaginary part, it works on any grid but stores
+    a dense matrix of the squared grid size.
+
+    Functions on the last axis, leading axes are a batch transformed in
+    one call. Use :func:`kramers_kronig_plan` to get cached instances.
 
+    Parameters
+    ----------
+    w : real 1D ndarray
+        Increasing frequency grid
+    exact : bool or None
+        Use the exact kernel. By default only on non-equispaced grids
+    pad : int
+        Zero padding factor of the FFT
+    workers : int or None
+        Threads for the FFT, see :func:`scipy.fft.rfft`
+    """
 
-def ph_hf_sigma(Aw, nf, U):
+    def __init__(self, w, exact=None, pad=4, workers=None):
+        self.w = np.asarray(w, dtype=float)
+        self.n_w = len(self.w)
+        self.workers = workers
+        if exact is None:
+            d_w = np.diff(self.w)
+            exact = not np.allclose(d_w, d_w[0], rtol=1e-8, atol=0)
+        self.exact = exact
+        if exact:
+            self.kernel = self.exact_kernel(self.w)
+        else:
+            self.size = pad * self.n_w
+            self.kernel = np.full(self.size // 2 + 1, 1j)
+            self.kernel[0] = 0
+            if self.size % 2 == 0:
+                self.kernel[-1] = 0
+
+    @staticmethod
+    def exact_kernel(w):
+        r"""Matrix :math:`K` with :math:`\Re e\Sigma=K\Im m\Sigma` for the
+        piecewise linear imaginary part, zero outside the grid"""
+        h_w = np.diff(w)
+        dist = w.reshape(-1, 1) - w
+        with np.errstate(divide='ignore'):
+            log = np.log(np.abs(dist))
+        log[dist == 0] = 0
+        seg = log[:, :-1] - log[:, 1:]
+        frac = dist[:, :-1] / h_w
+        kernel = np.zeros_like(dist)
+        kernel[:, :-1] += seg * (1 - frac) + 1
+        kernel[:, 1:] += seg * frac - 1
+        return -kernel / np.pi
+
+    def __call__(self, imag, out=None, workers=None):
+        """Real part of the functions with imaginary part `imag`
+
+        Parameters
+        ----------
+        imag : real ndarray
+            Imaginary parts on the last axis
+        out : real ndarray
+            Buffer of the same shape to write the result
+        workers : int or None
+            Threads for the FFTs, by default the ones of the operator.
+            The exact kernel uses the threads of the BLAS library
+        """
+        if self.exact:
+            return np.dot(imag, self.kernel.T, out=out)
+        workers = self.workers if workers is None else workers
+        spec = sfft.rfft(imag, self.size, axis=-1, workers=workers)
+        np.multiply(spec, self.kernel, out=spec)
+        real = sfft.irfft(spec, self.size, axis=-1, overwrite_x=True,
+                          workers=workers)[..., :self.n_w]
+        if out is None:
+            return real
+        out[...] = real
+        return out
+
+
+_KK_PLANS = {}
+
+
+def kramers_kronig_plan(w):
+    """Returns a cached :class:`KramersKronig` for the grid `w`"""
+    w = np.asarray(w, dtype=float)
+    key = w.tobytes()
+    try:
+        return _KK_PLANS[key]
+    except KeyError:
+        if len(_KK_PLANS) >= 16:
+            _KK_PLANS.pop(next(iter(_KK_PLANS)))
+        plan = _KK_PLANS[key] = KramersKronig(w)
+        return plan
+
+
+def sigma(Aw, nf, U, workers=None):
+    """Imaginary part of the second order diagram, divided by the squared
+    frequency step
+
+    Spectral functions are on the last axis, see
+    :meth:`SpectralConvolution.sigma`"""
+    return convolution_plan(np.shape(Aw)[-1]).sigma(Aw, nf, U, workers)
+
+
+def ph_hf_sigma(Aw, nf, U, workers=None):
     """Imaginary part of the second order diagram
 
     because of particle-hole symmetry at half-fill in the Single band
     one can work with A^+ only"""
-
-    Ap = Aw * nf
-    # convolution A^+ * A^+
-    App = signal.fftconvolve(Ap, Ap, mode='same')
-    # convolution A^-(-w) * App
-    Appp = signal.fftconvolve(Ap, App, mode='same')
-    return -np.pi * U**2 * (Appp + Appp[::-1])
+    return convolution_plan(np.shape(Aw)[-1]).ph_hf_sigma(Aw, nf, U,
+                                                          workers)
 
 
-def ss_dmft_loop(gloc, w, u_int, beta, conv):
+def ss_dmft_loop(gloc, w, u_int, beta, conv, observer=None, workers=None):
     """DMFT Loop for the single band Hubbard Model at Half-Filling
 
 
@@ -47,13 +516,18 @@ def ss_dmft_loop(gloc, w, u_int, beta, conv):
     gloc : complex 1D ndarray
         local Green's function to use as seed
     w : real 1D ndarray
-        real frequency points
+        real frequency points, symmetric and equispaced or not, see
+        :class:`GridConvolution`
     u_int : float
         On site interaction, Hubbard U
     beta : float
         Inverse temperature
     conv : float
         convergence criteria
+    observer : callable or list of callables
+        Receives a record of every iteration, see :mod:`dmft.monitor`
+    workers : int or None
+        Threads for the FFTs, -1 for all cores
 
     Returns
     -------
@@ -64,68 +538,92 @@ def ss_dmft_loop(gloc, w, u_int, beta, conv):
 
 """
 
-    dw = w[1] - w[0]
-    eta = 2j * dw
+    eta = 2j * np.diff(w).min()
     nf = gf.fermi_dist(w, beta)
+    convolution = grid_convolution(w)
+    kramers_kronig = kramers_kronig_plan(w)
+    timer = monitor.StageTimer() if observer is not None else None
 
     converged = False
+    loops = 0
     while not converged:
 
         gloc_old = gloc.copy()
         # Self-consistency
-        g0 = 1 / (w + eta - .25 * gloc)
+        with monitor.stage(timer, 'self_consistency'):
+            g0 = 1 / (w + eta - .25 * gloc)
         # Spectral-function of Weiss field
         A0 = -g0.imag / np.pi
 
-        # Second order diagram
-        isi = ph_hf_sigma(A0, nf, u_int) * dw * dw
-        isi = 0.5 * (isi + isi[::-1])
+        with monitor.stage(timer, 'solver'):
+            # Second order diagram
+            with monitor.stage(timer, 'transforms'):
+                isi = convolution.ph_hf_sigma(A0, nf, u_int, workers)
+            isi = 0.5 * (isi + isi[::-1])
 
-        # Kramers-Kronig relation, uses Fourier Transform to speed convolution
-        hsi = -signal.hilbert(isi, len(isi) * 4)[:len(isi)].imag
-        sigma = hsi + 1j * isi
+            # Kramers-Kronig relation
+            with monitor.stage(timer, 'transforms'):
+                hsi = kramers_kronig(isi, workers=workers)
+            sigma = hsi + 1j * isi
 
         # Semi-circle Hilbert Transform
-        gloc = gf.semi_circle_hiltrans(w - sigma)
+        with monitor.stage(timer, 'hilbert'):
+            gloc = gf.semi_circle_hiltrans(w - sigma)
         converged = np.allclose(gloc, gloc_old, atol=conv)
+        loops += 1
+        if observer is not None:
+            monitor.notify(observer, loop=loops, converged=converged,
+                           residual=np.abs(gloc - gloc_old).max(),
+                           times=timer.reset(), u_int=u_int, beta=beta)
 
     return gloc, sigma
 
 
-def dimer_solver(w, dw, tp, U, nfp, gss, gsa, t=0.5, eta=3e-3j):
+def dimer_solver(w, dw, tp, U, nfp, gss, gsa, t=0.5, eta=3e-3j, timer=None,
+                 workers=None):
     # Self consistency in diagonal basis
-    g0ss = 1 / (w + eta - tp - t * t * gss)
-    g0sa = 1 / (w + eta + tp - t * t * gsa)
+    with monitor.stage(timer, 'self_consistency'):
+        g0ss = 1 / (w + eta - tp - t * t * gss)
+        g0sa = 1 / (w + eta + tp - t * t * gsa)
 
     # Rotate to local basis
     A0d = -0.5 * (g0ss + g0sa).imag / np.pi
     A0o = -0.5 * (g0ss - g0sa).imag / np.pi
     # Cleaning for PH and half-fill
-    A0d = 0.5 * (A0d + A0d[::-1])
-    A0o = 0.5 * (A0o - A0o[::-1])  # * tp
-
-    # Second order diagram
-    isd = sigma(A0d, nfp, U) * dw * dw
-    iso = sigma(A0o, nfp, U) * dw * dw
-
-    # Rotate to diagonal basis
-    iss = isd + iso
-    isa = isd - iso
+    A0d = 0.5 * (A0d + A0d[..., ::-1])
+    A0o = 0.5 * (A0o - A0o[..., ::-1])  # * tp
 
-    # Kramers-Kronig relation, uses Fourier Transform to speed convolution
-    rss = -signal.hilbert(iss, len(iss) * 4)[:len(iss)].imag
-    rsa = -signal.hilbert(isa, len(isa) * 4)[:len(isa)].imag
+    with monitor.stage(timer, 'solver'):
+        # Second order diagram
+        with monitor.stage(timer, 'transforms'):
+            if dw is None:
+                isd, iso = grid_convolution(w).sigma(np.stack((A0d, A0o)),
+                                                     nfp, U, workers)
+            else:
+                isd, iso = sigma(np.stack((A0d, A0o)), nfp, U,
+                                 workers) * dw * dw
+
+        # Rotate to diagonal basis
+        iss = isd + iso
+        isa = isd - iso
+
+        # Kramers-Kronig relation
+        with monitor.stage(timer, 'transforms'):
+            rss, rsa = kramers_kronig_plan(w)(np.stack((iss, isa)),
+                                              workers=workers)
 
     # Semi-circle Hilbert Transform
-    ss = rss - 1j * np.abs(iss)
-    gss = gf.semi_circle_hiltrans(w - tp - ss, 2 * t)
-    sa = rsa - 1j * np.abs(isa)
-    gsa = gf.semi_circle_hiltrans(w + tp - sa, 2 * t)
+    with monitor.stage(timer, 'hilbert'):
+        ss = rss - 1j * np.abs(iss)
+        gss = gf.semi_circle_hiltrans(w - tp - ss, 2 * t)
+        sa = rsa - 1j * np.abs(isa)
+        gsa = gf.semi_circle_hiltrans(w + tp - sa, 2 * t)
 
     return (gss, gsa), (ss, sa)
 
 
-def dimer_dmft(U, tp, nfp, w, dw, gss, gsa, conv=1e-7, t=0.5):
+def dimer_dmft(U, tp, nfp, w, dw, gss, gsa, conv=1e-7, t=0.5, observer=None,
+               eta=3e-3j, workers=None):
     """Solve DMFT equations in real frequencies for the dimer
 
     Parameters
@@ -137,9 +635,10 @@ def dimer_dmft(U, tp, nfp, w, dw, gss, gsa, conv=1e-7, t=0.5):
     npf : 1D real ndarray
         Thermal Fermi function
     w : 1D real ndarray
-        frequency grid. Has to be equispaced and symmetric
-    dw : float
-        frequency separation
+        frequency grid. Has to be symmetric
+    dw : float or None
+        frequency separation. None for non-equispaced grids, as the ones
+        of :func:`sinh_grid`, see :class:`GridConvolution`
     gss : 1D complex ndarray
         Starting guess for the symmetric Green function
     gsa : 1D complex ndarray
@@ -148,6 +647,15 @@ def dimer_dmft(U, tp, nfp, w, dw, gss, gsa, conv=1e-7, t=0.5):
         convergence criteria
     t : float
         hopping
+    observer : callable or list of callables
+        Receives a record of every iteration, see :mod:`dmft.monitor`
+    eta : complex
+        Broadening of the Weiss field, can be reduced on grids fine
+        around the Fermi level
+    workers : int or None
+        Threads for the FFTs, -1 for all cores. The channels are stacked
+        in every transform and run in parallel, see
+        :class:`SpectralConvolution`
 
     Returns
     -------
@@ -158,15 +666,111 @@ def dimer_dmft(U, tp, nfp, w, dw, gss, gsa, conv=1e-7, t=0.5):
 
     converged = False
     loops = 0
+    timer = monitor.StageTimer() if observer is not None else None
     while not converged:
         gss_old = gss.copy()
         gsa_old = gsa.copy()
-        (gss, gsa), (ss, sa) = dimer_solver(w, dw, tp, U, nfp, gss, gsa, t)
+        (gss, gsa), (ss, sa) = dimer_solver(w, dw, tp, U, nfp, gss, gsa, t,
+                                            eta, timer, workers)
         converged = np.allclose(gss_old, gss, atol=conv)
         converged *= np.allclose(gsa_old, gsa, atol=conv)
         loops += 1
+        if observer is not None:
+            monitor.notify(observer, loop=loops, converged=bool(converged),
+                           residual=max(np.abs(gss - gss_old).max(),
+                                        np.abs(gsa - gsa_old).max()),
+                           times=timer.reset(), u_int=U, tp=tp)
         if loops > 3000:
             converged = True
             print('Failed to converge in less than 3000 iterations')
 
     return (gss, gsa), (ss, sa)
+
+
+def dimer_dmft_batch(U, tp, nfp, w, dw, gss, gsa, conv=1e-7, t=0.5,
+                     max_loops=3000, observer=None, eta=3e-3j, workers=None):
+    """Solve the real frequency dimer DMFT equations at many temperatures
+
+    Same iteration as :func:`dimer_dmft` on a batch of Fermi functions
+    sharing the frequency grid. The convolutions and Kramers-Kronig
+    transforms of all pending rows go in single FFT calls and each row
+    leaves the iteration as soon as it converges. Rows are independent,
+    they are not seeded by the solution of the previous temperature, give
+    each its own seed to follow a branch through a coexistence region.
+
+    Parameters
+    ----------
+    U : float
+        Couloumb interaction
+    tp : float
+        Dimerization
+    nfp : 2D real ndarray
+        Fermi functions, temperatures x frequencies
+    w : 1D real ndarray
+        frequency grid, see :func:`dimer_dmft`
+    dw : float or None
+        frequency separation, None for non-equispaced grids
+    gss : complex ndarray
+        Starting guess for the symmetric Green functions, temperatures x
+        frequencies. A 1D array is used as the seed of all temperatures
+    gsa : complex ndarray
+        Starting guess for the asymmetric Green functions, as gss
+    conv : float
+        convergence criteria
+    t : float
+        hopping
+    max_loops : int
+        iteration cap
+    observer : callable or list of callables
+        Receives a record of every iteration, see :mod:`dmft.monitor`.
+        The residual is the largest one of the pending temperatures and
+        `pending` counts them
+    eta : complex
+        Broadening of the Weiss field
+    workers : int or None
+        Threads for the FFTs, -1 for all cores. The channels are stacked
+        in every transform and run in parallel, see
+        :class:`SpectralConvolution`
+
+    Returns
+    -------
+    (gss, gsa) : tuple of 2D complex ndarray, Green Functions
+    (ss, sa) : tuple of 2D complex ndarray, Self-Energy
+    loops : 1D int ndarray, iterations to converge each temperature
+    """
+
+    nfp = np.atleast_2d(nfp)
+    shape = nfp.shape
+    gss = np.array(np.broadcast_to(gss, shape), dtype=complex)
+    gsa = np.array(np.broadcast_to(gsa, shape), dtype=complex)
+    ss = np.zeros(shape, dtype=complex)
+    sa = np.zeros(shape, dtype=complex)
+    loops = np.zeros(shape[0], dtype=int)
+    timer = monitor.StageTimer() if observer is not None else None
+
+    pending = np.arange(shape[0])
+    while pending.size:
+        gss_old, gsa_old = gss[pending], gsa[pending]
+        (gss[pending], gsa[pending]), (ss[pending], sa[pending]) = \
+            dimer_solver(w, dw, tp, U, nfp[pending], gss_old, gsa_old, t,
+                         eta, timer, workers)
+        converged = np.all(np.abs(gss[pending] - gss_old) <=
+                           conv + 1e-5 * np.abs(gss_old), -1)
+        converged &= np.all(np.abs(gsa[pending] - gsa_old) <=
+                            conv + 1e-5 * np.abs(gsa_old), -1)
+
+        loops[pending] += 1
+        if observer is not None:
+            monitor.notify(observer, loop=loops[pending].max(),
+                           converged=bool(converged.all()),
+                           pending=len(pending),
+                           residual=max(np.abs(gss[pending] - gss_old).max(),
+                                        np.abs(gsa[pending] - gsa_old).max()),
+                           times=timer.reset(), u_int=U, tp=tp)
+        failed = loops[pending] > max_loops
+        if failed.any():
+            print('Failed to converge in less than {} iterations'.format(
+                max_loops))
+        pending = pending[~(converged | failed)]
+
+    return (gss, gsa), (ss, sa), loops
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+r"""
+Legendre representation
+=======================
+
+Compact representation of the imaginary time Green functions on the
+basis of Legendre polynomials [boehnke]_
+
+.. math:: G(\tau) = \sum_{l\geq 0} \frac{\sqrt{2l+1}}{\beta}
+    P_l(x(\tau))G_l \quad x(\tau) = \frac{2\tau}{\beta} - 1
+
+.. math:: G_l = \sqrt{2l+1}\int_0^\beta d\tau P_l(x(\tau)) G(\tau)
+
+The coefficients decay faster than any power of :math:`l` once :math:`l`
+exceeds the bandwidth times :math:`\beta`, so a few tens of them replace
+the thousands of frequencies of a low temperature grid. The Matsubara
+representation follows from the matrix
+
+.. math:: G(i\omega_n) = \sum_l T_{nl} G_l \quad
+    T_{nl} = (-1)^n i^{l+1} \sqrt{2l+1} j_l\left(\frac{(2n+1)\pi}{2}\right)
+
+which does not depend on :math:`\beta`.
+
+References
+----------
+.. [boehnke] Boehnke, L. et al. Phys. Rev. B 84, 075145 (2011)
+   http://dx.doi.org/10.1103/PhysRevB.84.075145
+
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.special import eval_legendre, spherical_jn
+
+_TRANSFORMS = {}
+
+
+def matsubara_index(w_n, beta):
+    """Index n of the fermionic Matsubara frequencies"""
+    return np.rint((np.asarray(w_n) * beta / np.pi - 1) / 2).astype(int)
+
+
+def legendre_matsubara(n_l, n_max):
+    r"""Cached transformation matrix :math:`T_{nl}` to the first `n_max`
+    positive fermionic Matsubara frequencies
+
+    Returns
+    -------
+    complex ndarray of shape (n_max, n_l)
+    """
+    key = (n_l, n_max)
+    if key not in _TRANSFORMS:
+        if len(_TRANSFORMS) >= 16:
+            _TRANSFORMS.pop(next(iter(_TRANSFORMS)))
+        n = np.arange(n_max).reshape(-1, 1)
+        l = np.arange(n_l)
+        _TRANSFORMS[key] = (-1.)**n * 1j**(l + 1) * np.sqrt(2 * l + 1) * \
+            spherical_jn(l, np.pi * (2 * n + 1) / 2)
+    return _TRANSFORMS[key]
+
+
+def legendre_tau(n_l, tau, beta):
+    r"""Matrix :math:`\sqrt{2l+1}P_l(x(\tau))/\beta`
+
+    Returns
+    -------
+    real ndarray of shape (len(tau), n_l)
+    """
+    l = np.arange(n_l)
+    x = 2 * np.asarray(tau).reshape(-1, 1) / beta - 1
+    return np.sqrt(2 * l + 1) * eval_legendre(l, x) / beta
+
+
+class LegendreGf(object):
+    r"""Green function stored by its Legendre coefficients
+
+    Parameters
+    ----------
+    coef : real ndarray
+        Coefficients :math:`G_l` on the last axis, leading axes are
+        independent functions
+    beta : float
+        Inverse temperature
+
+    Examples
+    --------
+    >>> import dmft.common as gf
+    >>> w_n = gf.matsubara_freq(50., 512)
+    >>> g_l = LegendreGf.from_iw(gf.greenF(w_n), w_n, 50., 60)
+    >>> np.allclose(g_l.iw(w_n), gf.greenF(w_n), atol=1e-6)
+    True
+    """
+
+    def __init__(self, coef, beta):
+        self.coef = np.asarray(coef, dtype=float)
+        self.beta = beta
+
+    @property
+    def n_l(self):
+        """Amount of Legendre coefficients"""
+        return self.coef.shape[-1]
+
+    @classmethod
+    def from_tau(cls, g_tau, tau, beta, n_l, first_moment=1., n_quad=None):
+        r"""Project :math:`G(\tau)` sampled in :math:`[0, \beta)`
+
+        The samples are interpolated by a cubic spline, closed at
+        :math:`\beta^-` with the jump :math:`G(0)+G(\beta^-)=-M_1`, and
+        integrated by Gauss-Legendre quadrature.
+
+        Parameters
+        ----------
+        g_tau : real ndarray
+            Functions on the last axis
+        tau : real 1D ndarray
+            Imaginary time points, without :math:`\beta`
+        beta : float
+            Inverse temperature
+        n_l : int
+            Amount of coefficients to keep
+        first_moment : float or ndarray
+            :math:`M_1`, 1 for diagonal functions 0 for off-diagonal ones
+        n_quad : int
+            Quadrature points, by default 4 * n_l and at least 200
+        """
+        g_tau = np.asarray(g_tau)
+        edge = -np.asarray(first_moment) - g_tau[..., :1]
+        spline = CubicSpline(np.append(tau, beta),
+                             np.concatenate((g_tau, edge), -1), axis=-1)
+
+        x, weight = np.polynomial.legendre.leggauss(n_quad or
+                                                    max(4 * n_l, 200))
+        l = np.arange(n_l)
+        proj = np.sqrt(2 * l + 1) * eval_legendre(l, x.reshape(-1, 1)) * \
+            (weight * beta / 2).reshape(-1, 1)
+        return cls(spline((x + 1) * beta / 2).dot(proj), beta)
+
+    @classmethod
+    def from_iw(cls, g_iw, w_n, beta, n_l):
+        """Least squares fit of the coefficients to :math:`G(i\\omega_n)`
+
+        Parameters
+        ----------
+        g_iw : complex ndarray
+            Functions on the last axis, positive frequencies
+        w_n : real 1D ndarray
+            Matsubara frequencies
+        beta : float
+            Inverse temperature
+        n_l : int
+            Amount of coefficients to keep
+        """
+        n = matsubara_index(w_n, beta)
+        trans = legendre_matsubara(n_l, n.max() + 1)[n]
+        pinv = np.linalg.pinv(np.concatenate((trans.real, trans.imag)))
+        g_iw = np.asarray(g_iw)
+        return cls(np.concatenate((g_iw.real, g_iw.imag), -1).dot(pinv.T),
+                   beta)
+
+    def tau(self, tau):
+        r"""Evaluate :math:`G(\tau)`"""
+        return self.coef.dot(legendre_tau(self.n_l, tau, self.beta).T)
+
+    def iw(self, w_n):
+        r"""Evaluate :math:`G(i\omega_n)` on positive Matsubara frequencies"""
+        n = matsubara_index(w_n, self.beta)
+        return self.coef.dot(legendre_matsubara(self.n_l, n.max() + 1)[n].T)
+
+    def save(self, fname):
+        """Store the coefficients in a npz file"""
+        np.savez(fname, coef=self.coef, beta=self.beta)
+
+    @classmethod
+    def load(cls, fname):
+        """Read a Green function saved with :meth:`save`"""
+        with np.load(fname) as data:
+            return cls(data['coef'], float(data['beta']))
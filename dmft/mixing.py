@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+r"""
+Self-consistency acceleration
+=============================
+
+A DMFT loop iterates :math:`x_{in}\rightarrow x_{out}=F(x_{in})` until the
+residual :math:`f=x_{out}-x_{in}` vanishes. Instead of feeding back
+:math:`x_{out}` these mixers propose the next input from the history of
+previous iterations.
+
+:class:`LinearMixer`
+    Damping :math:`x_{in} + \alpha f`
+:class:`AndersonMixer`
+    Anderson/DIIS extrapolation [anderson]_ on the last few iterations
+:class:`BroydenMixer`
+    Modified Broyden method [johnson]_, a regularized Anderson update
+
+The mixers work on real 1D vectors, use :func:`pack` and :func:`unpack`
+to move between them and the independent components of the Green
+functions, like :math:`\Im m G_{AA}` and :math:`\Re e G_{AB}` of the
+dimer at half-filling.
+
+Anderson and Broyden guard against divergence: when the residual grows
+beyond `divergence` times the smallest one seen the history is dropped
+and a damped step with `fallback` is taken.
+
+References
+----------
+.. [anderson] Anderson, D. G. J. ACM 12, 547 (1965)
+   http://dx.doi.org/10.1145/321296.321305
+.. [johnson] Johnson, D. D. Phys. Rev. B 38, 12807 (1988)
+   http://dx.doi.org/10.1103/PhysRevB.38.12807
+
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+import numpy as np
+
+
+def pack(*arrays):
+    """Concatenate real arrays into one 1D vector"""
+    return np.concatenate([np.ravel(arr) for arr in arrays])
+
+
+def unpack(vec, *templates):
+    """Split a vector made by :func:`pack` into arrays shaped as
+    `templates`"""
+    out = []
+    start = 0
+    for temp in templates:
+        out.append(vec[start:start + np.size(temp)].reshape(np.shape(temp)))
+        start += np.size(temp)
+    return out
+
+
+class LinearMixer(object):
+    r"""Linear mixing :math:`x_{in} + \alpha(x_{out} - x_{in})`
+
+    Parameters
+    ----------
+    mix : real :math:`\in [0, 1]`
+        Fraction of the new solution :math:`\alpha`
+    """
+
+    def __init__(self, mix=1.):
+        self.mix = mix
+
+    def reset(self):
+        """Forget the iteration history"""
+        pass
+
+    def __call__(self, x_in, x_out):
+        """Next input of the iteration"""
+        return self.mix * x_out + (1 - self.mix) * x_in
+
+
+class AndersonMixer(LinearMixer):
+    r"""Anderson/DIIS mixing
+
+    The next input minimizes the linear estimate of the residual within
+    the span of the last `history` iterations
+
+    .. math:: x_{next} = x_{in} + \alpha f - (\Delta X + \alpha\Delta F)
+        \gamma \quad \gamma = \mathrm{argmin}|f - \Delta F\gamma|
+
+    where the columns of :math:`\Delta X, \Delta F` are differences of
+    consecutive inputs and residuals.
+
+    Parameters
+    ----------
+    mix : real :math:`\in (0, 1]`
+        Linear mixing :math:`\alpha` of the residual
+    history : int
+        Iterations kept
+    fallback : real :math:`\in (0, 1]`
+        Damping used after a divergence
+    divergence : float
+        Residual growth ratio that resets the history
+    """
+
+    def __init__(self, mix=0.5, history=6, fallback=0.2, divergence=10.):
+        super(AndersonMixer, self).__init__(mix)
+        self.history = history
+        self.fallback = fallback
+        self.divergence = divergence
+        self.reset()
+
+    def reset(self):
+        self._x_in = []
+        self._res = []
+        self._best = np.inf
+
+    def _coefficients(self, d_res, res):
+        """Least squares weights of the residual differences"""
+        return np.linalg.lstsq(d_res, res, rcond=None)[0]
+
+    def __call__(self, x_in, x_out):
+        x_in = np.asarray(x_in, dtype=float)
+        res = np.asarray(x_out, dtype=float) - x_in
+        norm = np.linalg.norm(res)
+        if not np.isfinite(norm) or norm > self.divergence * self._best:
+            self.reset()
+            return x_in + self.fallback * np.nan_to_num(res)
+        self._best = min(self._best, norm)
+
+        self._x_in.append(x_in)
+        self._res.append(res)
+        if len(self._x_in) > self.history + 1:
+            self._x_in.pop(0)
+            self._res.pop(0)
+        if len(self._x_in) < 2:
+            return x_in + self.mix * res
+
+        d_x = np.diff(self._x_in, axis=0).T
+        d_res = np.diff(self._res, axis=0).T
+        gamma = self._coefficients(d_res, res)
+        x_next = x_in + self.mix * res - (d_x + self.mix * d_res).dot(gamma)
+        if not np.all(np.isfinite(x_next)):
+            self.reset()
+            return x_in + self.fallback * res
+        return x_next
+
+
+class BroydenMixer(AndersonMixer):
+    r"""Modified Broyden mixing
+
+    Same update as :class:`AndersonMixer` with the residual differences
+    normalized and the linear problem regularized by :math:`w_0^2`
+
+    .. math:: \gamma = (w_0^2 + \Delta F^T\Delta F)^{-1}\Delta F^T f
+
+    which keeps the step well defined when the history becomes linearly
+    dependent.
+
+    Parameters
+    ----------
+    w_0 : float
+        Regularization weight, the remaining as in :class:`AndersonMixer`
+    """
+
+    def __init__(self, mix=0.5, history=8, fallback=0.2, divergence=10.,
+                 w_0=0.01):
+        self.w_0 = w_0
+        super(BroydenMixer, self).__init__(mix, history, fallback,
+                                           divergence)
+
+    def _coefficients(self, d_res, res):
+        scale = np.linalg.norm(d_res, axis=0)
+        scale[scale == 0] = 1.
+        d_res = d_res / scale
+        a_mat = d_res.T.dot(d_res) + self.w_0**2 * np.eye(len(scale))
+        return np.linalg.solve(a_mat, d_res.T.dot(res)) / scale
+
+
+MIXERS = {'linear': LinearMixer,
+          'anderson': AndersonMixer,
+          'broyden': BroydenMixer}
+
+
+def get_mixer(mixer=None, mix=1.):
+    """Mixer instance from its name, a mixer or None
+
+    Parameters
+    ----------
+    mixer : None, str or mixer
+        None gives linear mixing with `mix`. Names are the keys of
+        :data:`MIXERS`, instances are reset and returned.
+    mix : float
+        Linear mixing when `mixer` is None
+    """
+    if mixer is None:
+        return LinearMixer(mix)
+    if isinstance(mixer, str):
+        return MIXERS[mixer]()
+    mixer.reset()
+    return mixer
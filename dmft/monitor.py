@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+r"""
+Loop instrumentation
+====================
+
+The DMFT loops accept an `observer` that is called after every iteration
+with a record dictionary holding
+
+loop
+    Iteration number, starting at 1
+residual
+    Largest change of the Green functions in the iteration
+converged
+    Whether the convergence criteria is met
+times
+    Wall time in seconds of each stage of the iteration, e.g.
+    ``self_consistency``, ``solver``, ``transforms``. Nested stages, as
+    the transforms inside the solver, are also counted by their parent
+
+plus the parameters of the loop, like `u_int`, `tp` or `beta`.
+
+An observer is any callable or a list of them. The sinks in this module
+store the records in memory, CSV or HDF5 files or send them to a logger
+
+>>> import dmft.common as gf
+>>> import dmft.ipt_imag as ipt
+>>> tau, w_n = gf.tau_wn_setup(dict(BETA=50., N_MATSUBARA=128))
+>>> history = MemorySink()
+>>> g_iw, s_iw = ipt.dmft_loop(2., 0.5, gf.greenF(w_n), w_n, tau,
+...                            observer=history)
+>>> len(history.column('residual')) == history.records[-1]['loop']
+True
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+from contextlib import contextmanager
+import csv
+import logging
+import time
+
+import h5py
+import numpy as np
+
+
+class StageTimer(object):
+    """Accumulate the wall time of the named stages of an iteration"""
+
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Context in which the time is attributed to `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.) + \
+                time.perf_counter() - start
+
+    def reset(self):
+        """Start a new iteration, returning the times of the last one"""
+        times, self.times = self.times, {}
+        return times
+
+
+@contextmanager
+def _no_timing():
+    yield
+
+
+def stage(timer, name):
+    """Time `name` with `timer` if given, do nothing otherwise"""
+    if timer is None:
+        return _no_timing()
+    return timer.stage(name)
+
+
+def notify(observer, **record):
+    """Send a record to the observer, a callable, a list of them or
+    None"""
+    if observer is None:
+        return
+    if callable(observer):
+        observer(record)
+        return
+    for obs in observer:
+        obs(record)
+
+
+def flatten(record):
+    """Record with the stage times as ``time_<stage>`` entries"""
+    flat = {key: val for key, val in record.items() if key != 'times'}
+    for name, val in record.get('times', {}).items():
+        flat['time_' + name] = val
+    return flat
+
+
+class MemorySink(object):
+    """Keep all records in a list"""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def column(self, key):
+        """Array of one entry, stage times as ``time_<stage>``, over all
+        records"""
+        return np.array([flatten(rec).get(key, np.nan)
+                         for rec in self.records])
+
+
+def _csv_value(val):
+    val = np.ravel(val)
+    return val[0] if val.size == 1 else ' '.join(str(v) for v in val)
+
+
+class CSVSink(object):
+    """Append the flattened records to a CSV file
+
+    The columns are fixed by the first record written.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.fields = None
+
+    def __call__(self, record):
+        flat = flatten(record)
+        with open(self.fname, 'a') as out:
+            if self.fields is None:
+                self.fields = sorted(flat)
+                csv.writer(out).writerow(self.fields)
+            csv.writer(out).writerow([_csv_value(flat.get(key, ''))
+                                      for key in self.fields])
+
+
+class HDF5Sink(object):
+    """Append the flattened records to resizable datasets of an HDF5
+    group, one per entry
+
+    Parameters
+    ----------
+    fname : str
+        HDF5 file
+    group : str
+        Group holding the datasets
+    """
+
+    def __init__(self, fname, group='monitor'):
+        self.fname = fname
+        self.group = group
+
+    def __call__(self, record):
+        with h5py.File(self.fname, 'a') as store:
+            grp = store.require_group(self.group)
+            for key, val in flatten(record).items():
+                val = np.atleast_1d(np.asarray(val, dtype=float))
+                if key not in grp:
+                    grp.create_dataset(key, (0,) + val.shape, dtype=float,
+                                       maxshape=(None,) + val.shape)
+                dset = grp[key]
+                dset.resize(len(dset) + 1, axis=0)
+                dset[-1] = val
+
+
+class LoggerSink(object):
+    """Write every record to a logger
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        By default the ``dmft`` logger
+    level : int
+        Logging level of the messages
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('dmft')
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, ' '.join(
+            '{}={}'.format(key, val) for key, val in
+            sorted(flatten(record).items())))
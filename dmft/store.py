@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+r"""
+Solution store
+==============
+
+Converged solutions kept on disk and addressed by their content: the
+solver and its parameters, like :math:`U, t_\perp, \beta, t`, the amount
+of Matsubara frequencies or the convergence criteria. The parameters are
+canonicalized, so that ``beta=100`` and ``beta=100.0000000000001`` share
+the entry, and hashed into the file name.
+
+Every entry is an ``.npz`` file holding the arrays of the solution and
+its parameters. Files are written to a temporary name and renamed into
+place, readers never see a partial entry and many joblib workers can
+share a store. Reading an entry refreshes its modification time, when
+the store outgrows its size limit the least recently used entries are
+removed. Each instance keeps a running total of the size, measured once
+and increased by its own writes, and only looks at the whole directory
+when the total goes over the limit.
+
+>>> import tempfile
+>>> store = SolutionStore(tempfile.mkdtemp())
+>>> store.put('ipt', dict(giw=np.ones(3)), u_int=2., beta=100.)
+>>> store.get('ipt', u_int=2.0000000000001, beta=100)['giw']
+array([1., 1., 1.])
+>>> store.nearest('ipt', ('u_int',), u_int=2.1, beta=100.)[1]['u_int']
+2.0
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+
+def canonical(value, digits=12):
+    """Value rounded to `digits` significant digits, for hashing"""
+    if isinstance(value, (bool, str)) or value is None:
+        return value
+    if isinstance(value, (int, float, np.number)):
+        return float('{:.{}g}'.format(float(value), digits))
+    return str(value)
+
+
+def solver_name(solver, digits=12):
+    """Name of a solver given as a string, a function or a
+    :func:`functools.partial` of them
+
+    Other callables have no name that is the same across processes and
+    raise TypeError.
+    """
+    if isinstance(solver, str):
+        return solver
+    if isinstance(solver, functools.partial):
+        args = [canonical(arg, digits) for arg in solver.args]
+        keywords = {key: canonical(val, digits)
+                    for key, val in solver.keywords.items()}
+        return '{}({})'.format(solver_name(solver.func, digits),
+                               json.dumps([args, keywords], sort_keys=True))
+    try:
+        return '{}.{}'.format(solver.__module__, solver.__name__)
+    except AttributeError:
+        raise TypeError('Solver {!r} has no name to tell store entries '
+                        'apart, wrap it in a function'.format(solver))
+
+
+class SolutionStore(object):
+    """Directory of converged solutions addressed by their parameters
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store, created if needed
+    max_bytes : int or None
+        Size limit of the store. Unlimited if None
+    digits : int
+        Significant digits of the parameters that tell entries apart
+    """
+
+    def __init__(self, path, max_bytes=2**30, digits=12):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.digits = digits
+        self._index = {}
+        self._size = None
+        os.makedirs(path, exist_ok=True)
+
+    def params(self, solver, **params):
+        """Canonical parameters of an entry, including the solver"""
+        params = {key: canonical(val, self.digits)
+                  for key, val in params.items()}
+        params['solver'] = solver_name(solver, self.digits)
+        return params
+
+    def key(self, solver, **params):
+        """Hash of the canonical parameters"""
+        text = json.dumps(self.params(solver, **params), sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _read(self, fname):
+        with np.load(fname) as data:
+            arrays = {name: data[name] for name in data.files
+                      if name != '_params'}
+        os.utime(fname, None)
+        return arrays
+
+    def get(self, solver, **params):
+        """Arrays of the entry, None if it is not stored"""
+        try:
+            return self._read(self._file(self.key(solver, **params)))
+        except (IOError, OSError):
+            return None
+
+    def put(self, solver, arrays, **params):
+        """Store the arrays, a dict of them, under the parameters
+
+        Raises
+        ------
+        ValueError
+            If the entry alone is larger than the size limit
+        """
+        key = self.key(solver, **params)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                np.savez(out, _params=json.dumps(
+                    self.params(solver, **params)), **arrays)
+            size = os.path.getsize(tmp)
+            if self.max_bytes is not None and size > self.max_bytes:
+                raise ValueError('Entry of {} bytes exceeds the store limit'
+                                 ' of {} bytes'.format(size, self.max_bytes))
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        if self.max_bytes is None:
+            return
+        if self._size is None:
+            self._size = sum(stat[1] for stat in self._stats())
+        else:
+            self._size += size
+        if self._size > self.max_bytes:
+            self.evict(keep=key)
+
+    def entries(self):
+        """Parameters of all stored entries by file name
+
+        Only the files new since the last call are opened, entries
+        written by other processes are also found.
+        """
+        files = {fname for fname in os.listdir(self.path)
+                 if fname.endswith('.npz')}
+        for fname in set(self._index) - files:
+            del self._index[fname]
+        for fname in files - set(self._index):
+            try:
+                with np.load(os.path.join(self.path, fname)) as data:
+                    self._index[fname] = json.loads(str(data['_params']))
+            except (IOError, OSError, KeyError, ValueError):
+                continue
+        return self._index
+
+    def nearest(self, solver, near=('u_int', 'tp', 'beta'), **params):
+        """Stored solution closest to the parameters, e.g. to seed a solver
+
+        Candidates come from the same solver and match exactly the
+        canonical values of the given parameters not listed in `near`.
+        Among them the closest in euclidean distance over the `near`
+        parameters is returned.
+
+        Returns
+        -------
+        tuple of arrays and parameters of the entry, None if there is no
+        candidate
+        """
+        target = self.params(solver, **params)
+        best, dist = None, np.inf
+        for fname, entry in self.entries().items():
+            if any(entry.get(key) != val for key, val in target.items()
+                   if key not in near):
+                continue
+            try:
+                new = np.sqrt(sum((entry[key] - target[key])**2
+                                  for key in near if key in target))
+            except (KeyError, TypeError):
+                continue
+            if new < dist:
+                best, dist = fname, new
+        if best is None:
+            return None
+        try:
+            return (self._read(os.path.join(self.path, best)),
+                    self._index[best])
+        except (IOError, OSError):
+            return None
+
+    def _stats(self):
+        """Modification time, size and name of the stored files"""
+        stats = []
+        for fname in os.listdir(self.path):
+            if fname.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.path, fname))
+                except OSError:
+                    continue
+                stats.append((stat.st_mtime, stat.st_size, fname))
+        return stats
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries beyond the size limit
+
+        Parameters
+        ----------
+        keep : str or None
+            Key of an entry that is never removed, e.g. the one just
+            written
+        """
+        if self.max_bytes is None:
+            return
+        stats = self._stats()
+        size = sum(stat[1] for stat in stats)
+        for _, fsize, fname in sorted(stats):
+            if size <= self.max_bytes:
+                break
+            if keep is not None and fname == keep + '.npz':
+                continue
+            try:
+                os.remove(os.path.join(self.path, fname))
+            except OSError:
+                pass
+            size -= fsize
+        self._size = size
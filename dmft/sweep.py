@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+r"""
+Continuation sweeps
+===================
+
+Walk a path in :math:`(U, t_\perp, \beta)` space solving the dimer DMFT
+problem at every point. Each point is seeded by the polynomial
+extrapolation of the last converged solutions along the path
+
+.. math:: G_{seed} = \sum_{k=0}^{p} L_k(s) G_k
+
+where :math:`L_k` are the Lagrange polynomials on the path lengths
+:math:`s_k` of the previous points. Order :math:`p=0` is the usual
+*seed with the previous solution*, a linear or quadratic predictor
+starts closer to the fixed point and saves iterations.
+
+A change of temperature changes the frequency grid, there the previous
+solutions are resampled onto the new grid before the extrapolation.
+
+Sweeping the same path forward from a metal and backward from an
+insulator, as :func:`hysteresis` does, follows both branches of the
+coexistence region.
+
+Large scans that only need to tell metals from insulators can use
+:func:`screen`. It sweeps in single precision with a loose tolerance and
+solves again in double precision only the points whose classification
+is uncertain, close to the threshold or next to a change of phase along
+the path.
+
+The ends of the coexistence region, the interaction :math:`U_{c1}` where
+the insulator disappears and :math:`U_{c2}` where the metal does, are
+found by :func:`spinodal` bisecting on the existence of each branch and
+by :func:`coexistence` for many temperatures in parallel.
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+from math import ceil, log
+from joblib import Parallel, delayed
+import numpy as np
+
+import dmft.common as gf
+import dmft.dimer as dimer
+
+
+def default_grid(beta):
+    """Imaginary time and Matsubara frequency grid used for `beta`"""
+    return gf.tau_wn_setup(
+        dict(BETA=beta, N_MATSUBARA=max(2**ceil(log(6 * beta) / log(2)), 256)))
+
+
+def metal_seed(w_n, tp, t=0.5):
+    """Non interacting dimer Green functions"""
+    return dimer.gf_met(w_n, 0., tp, t, 0.)
+
+
+def insulator_seed(w_n, tp, t=0.5):
+    r"""Green functions of a wide Mott gap
+
+    The atomic limit :math:`G(i\omega_n)=1/(i\omega_n-\Delta^2/i\omega_n)`
+    with a gap :math:`2\Delta=4`. As :math:`1/i\omega_n=-i/\omega_n` it
+    reads :math:`1/(i\omega_n + 4i/\omega_n)` and keeps
+    :math:`\Im m G(i\omega_n)<0`. The form :math:`1/(i\omega_n-4i/\omega_n)`
+    of some older scripts is not causal below :math:`\omega_n=2`.
+    """
+    return 1 / (1j * w_n + 4j / w_n), np.zeros_like(w_n) + 0j
+
+
+SEEDS = {'metal': metal_seed, 'insulator': insulator_seed}
+
+
+def sweep_path(u_int, tp, beta):
+    """Points of the path as rows of (U, tp, beta)
+
+    The arguments are broadcast against each other, so scalars stay
+    constant along the path.
+    """
+    return np.array(np.broadcast_arrays(u_int, tp, beta), dtype=float).T
+
+
+def path_length(path):
+    r"""Cumulative distance along the path in :math:`(U, t_\perp, T)`"""
+    coords = np.column_stack((path[:, :2], 1 / path[:, 2]))
+    steps = np.linalg.norm(np.diff(coords, axis=0), axis=1)
+    return np.concatenate(([0.], np.cumsum(steps)))
+
+
+def extrapolation_weights(nodes, target):
+    """Lagrange weights to evaluate at `target` the polynomial through
+    values at `nodes`"""
+    nodes = np.asarray(nodes, dtype=float)
+    weights = np.ones(len(nodes))
+    for i, node in enumerate(nodes):
+        for j, other in enumerate(nodes):
+            if i != j:
+                weights[i] *= (target - other) / (node - other)
+    return weights
+
+
+def predict(history, nodes, target):
+    """Extrapolate the solutions in `history` to the path position
+    `target`
+
+    Parameters
+    ----------
+    history : list of tuples of ndarrays
+        Previous solutions, each a tuple like (giw_d, giw_o)
+    nodes : list of float
+        Path positions of the previous solutions
+    target : float
+        Path position of the next point
+    """
+    weights = extrapolation_weights(nodes, target)
+    return tuple(sum(w * sol[i] for w, sol in zip(weights, history))
+                 for i in range(len(history[0])))
+
+
+def store_params(solver_kw):
+    """Keyword arguments of a solver that enter the key of a stored
+    solution, those with scalar values"""
+    return {key: val for key, val in solver_kw.items()
+            if isinstance(val, (str, int, float))}
+
+
+def sweep(path, seed='metal', order=1, conv=1e-5, grid=default_grid,
+          solver=dimer.ipt_dmft_loop, store=None, **solver_kw):
+    r"""Solve all points of a path, warm starting each of them
+
+    Parameters
+    ----------
+    path : real ndarray (n_points, 3)
+        Rows of (U, tp, beta), see :func:`sweep_path`
+    seed : str or callable
+        Initial guess for the first point, 'metal', 'insulator' or a
+        function ``seed(w_n, tp)`` returning (giw_d, giw_o)
+    order : int
+        Degree of the extrapolation predictor, 0 reuses the previous
+        solution
+    conv : float
+        Convergence criteria of each point
+    grid : callable
+        ``grid(beta)`` returns (tau, w_n)
+    solver : callable
+        DMFT loop with the signature and returns of
+        :func:`dmft.dimer.ipt_dmft_loop`, e.g.
+        :func:`dmft.dimer.ipt_dmft_newton` for paths approaching the
+        end of a coexistence region
+    store : :class:`dmft.store.SolutionStore`, optional
+        Points found in the store are not solved, new ones are stored.
+        Entries are told apart by the solver, the point, the grid size,
+        `conv`, the name of `seed` and the scalar `solver_kw`. Without
+        previous solutions the first point is seeded by the closest one
+        stored in (U, tp).
+    solver_kw :
+        Extra keyword arguments for the solver, like `mixer` or `t`
+
+    Returns
+    -------
+    solutions : list of tuples (giw_d, giw_o, w_n)
+    loops : int ndarray
+        Iterations needed by each point, 0 for those read from the store
+    """
+    path = np.atleast_2d(path)
+    branch = seed if isinstance(seed, str) else 'custom'
+    seed = SEEDS.get(seed, seed)
+    positions = path_length(path)
+    solutions, loops = [], []
+    history, nodes = [], []
+    beta_old = None
+
+    for (u_int, tp, beta), pos in zip(path, positions):
+        if beta != beta_old:
+            tau, w_new = grid(beta)
+            history = [tuple(gf.sparse_matsubara_interp(g, w_n, w_new)
+                             for g in sol) for sol in history]
+            w_n, beta_old = w_new, beta
+
+        params = dict(store_params(solver_kw), u_int=u_int, tp=tp,
+                      beta=beta, n_matsubara=len(w_n), conv=conv,
+                      branch=branch)
+        stored = store.get(solver, **params) if store is not None else None
+        if stored is not None:
+            giw_d, giw_o, n_loops = stored['giw_d'], stored['giw_o'], 0
+        else:
+            neighbor = None
+            if not history and store is not None:
+                neighbor = store.nearest(solver, ('u_int', 'tp'), **params)
+            if history:
+                giw_d, giw_o = predict(history, nodes, pos)
+            elif neighbor is not None:
+                giw_d, giw_o = neighbor[0]['giw_d'], neighbor[0]['giw_o']
+            else:
+                giw_d, giw_o = seed(w_n, tp)
+
+            giw_d, giw_o, n_loops = solver(
+                beta, u_int, tp, np.array(giw_d, dtype=complex),
+                np.array(giw_o, dtype=complex), tau, w_n, conv, **solver_kw)
+            if store is not None:
+                store.put(solver, dict(giw_d=giw_d, giw_o=giw_o), **params)
+        solutions.append((giw_d, giw_o, w_n))
+        loops.append(n_loops)
+
+        if nodes and nodes[-1] == pos:
+            history.pop()
+            nodes.pop()
+        history = (history + [(giw_d, giw_o)])[-(order + 1):]
+        nodes = (nodes + [pos])[-(order + 1):]
+
+    return solutions, np.array(loops)
+
+
+def hysteresis(path, order=1, conv=1e-5, grid=default_grid,
+               solver=dimer.ipt_dmft_loop, **solver_kw):
+    """Sweep the path forward from a metal and backward from an
+    insulator
+
+    Parameters are as in :func:`sweep`
+
+    Returns
+    -------
+    tuple of the metallic and the insulating :func:`sweep` results, both
+    in the order of `path`
+    """
+    path = np.atleast_2d(path)
+    metal = sweep(path, 'metal', order, conv, grid, solver, **solver_kw)
+    sols, loops = sweep(path[::-1], 'insulator', order, conv, grid, solver,
+                        **solver_kw)
+    return metal, (sols[::-1], loops[::-1])
+
+
+# Default fermi_level_dos separating metals from insulators
+DOS_THRESHOLD = 0.5
+
+
+def fermi_level_dos(giw_d, w_n):
+    r"""Spectral weight at the Fermi level :math:`-\Im m G_{AA}(0)`,
+    extrapolated from the first Matsubara frequencies"""
+    return -gf.fit_gf(w_n[:3], giw_d.imag[:3])(0.)
+
+
+def screen(path, threshold=DOS_THRESHOLD, margin=0.25, seed='metal',
+           order=1, screen_conv=1e-4, conv=1e-5, grid=default_grid,
+           solver=dimer.ipt_dmft_loop, **solver_kw):
+    r"""Classify the points of a path as metallic or insulating, solving
+    in double precision only the uncertain ones
+
+    The whole path is first swept in single precision to `screen_conv`.
+    A point is refined, solved again from its screening solution to
+    `conv` in double precision, when :func:`fermi_level_dos` is within
+    `margin` of `threshold` or when its neighbor along the path falls in
+    the other phase.
+
+    Parameters
+    ----------
+    path : real ndarray (n_points, 3)
+        Rows of (U, tp, beta), see :func:`sweep_path`
+    threshold : float
+        :math:`-\Im m G_{AA}(0)` separating metals from insulators
+    margin : float
+        Distance to the threshold below which the classification is
+        ambiguous
+    screen_conv : float
+        Convergence criteria of the single precision sweep, it must stay
+        above the precision resolution of about 1e-6
+    solver : callable
+        DMFT loop as in :func:`sweep` accepting a `precision` keyword
+    seed, order, conv, grid, solver_kw :
+        As in :func:`sweep`
+
+    Returns
+    -------
+    solutions : list of tuples (giw_d, giw_o, w_n)
+    dos : real ndarray
+        :math:`-\Im m G_{AA}(0)` of each point, the point is metallic
+        above `threshold`
+    refined : bool ndarray
+        Points solved in double precision
+    loops : int ndarray
+        Iterations of each point, screening and refinement
+    """
+    path = np.atleast_2d(path)
+    solutions, loops = sweep(path, seed, order, screen_conv, grid, solver,
+                             precision='single', **solver_kw)
+    dos = np.array([fermi_level_dos(giw_d, w_n)
+                    for giw_d, _, w_n in solutions])
+
+    metal = dos > threshold
+    boundary = metal[1:] != metal[:-1]
+    refined = np.abs(dos - threshold) < margin
+    refined[1:] |= boundary
+    refined[:-1] |= boundary
+
+    for i in np.flatnonzero(refined):
+        u_int, tp, beta = path[i]
+        giw_d, giw_o, w_n = solutions[i]
+        tau = grid(beta)[0]
+        giw_d, giw_o, n_loops = solver(
+            beta, u_int, tp, giw_d.astype(complex), giw_o.astype(complex),
+            tau, w_n, conv, **solver_kw)
+        solutions[i] = (giw_d, giw_o, w_n)
+        dos[i] = fermi_level_dos(giw_d, w_n)
+        loops[i] += n_loops
+
+    return solutions, dos, refined, loops
+
+
+BRANCHES = {'metal': 'Uc2', 'insulator': 'Uc1'}
+
+
+def branch_exists(branch, giw_d, w_n, threshold=DOS_THRESHOLD):
+    """Whether the solution belongs to the metallic or insulating branch,
+    by its :func:`fermi_level_dos` on either side of `threshold`"""
+    metal = fermi_level_dos(giw_d, w_n) > threshold
+    return metal if branch == 'metal' else not metal
+
+
+def spinodal(branch, tp, beta, u_range, tol=1e-3, threshold=DOS_THRESHOLD,
+             conv=1e-6, grid=default_grid, solver=dimer.ipt_dmft_newton,
+             **solver_kw):
+    r"""Interaction where a branch of solutions ends, :math:`U_{c2}` of the
+    metal or :math:`U_{c1}` of the insulator
+
+    Bisection on the existence of the branch within `u_range`. Every
+    point is seeded with the solution of the closest interaction where
+    the branch was found, so the solver follows the branch up to its
+    end. Each step halves the bracket, about :math:`\log_2(\Delta U/tol)`
+    solves are needed instead of the :math:`\Delta U/tol` of a grid.
+
+    Parameters
+    ----------
+    branch : 'metal' or 'insulator'
+    tp : float
+        Dimer hybridization
+    beta : float
+        Inverse temperature
+    u_range : tuple of float
+        (U_min, U_max) bracket. The metal must exist at U_min and the
+        insulator at U_max
+    tol : float
+        Width of the final bracket
+    threshold : float
+        :math:`-\Im m G_{AA}(0)` separating metals from insulators, see
+        :func:`branch_exists`
+    conv, grid, solver, solver_kw :
+        As in :func:`sweep`. By default the Newton-Krylov solver copes
+        with the critical slowing down at the end of the branch
+
+    Returns
+    -------
+    u_c : float
+        Center of the final bracket, nan when the branch does not end
+        within `u_range`
+    solves : int
+        Amount of solver calls
+    """
+    tau, w_n = grid(beta)
+    u_in, u_out = u_range if branch == 'metal' else u_range[::-1]
+    giw_d, giw_o = SEEDS[branch](w_n, tp)
+    solves = 0
+
+    for u_int in [u_in, u_out]:
+        g_d, g_o, _ = solver(beta, u_int, tp, np.array(giw_d, dtype=complex),
+                             np.array(giw_o, dtype=complex), tau, w_n, conv,
+                             **solver_kw)
+        solves += 1
+        if branch_exists(branch, g_d, w_n, threshold) != (u_int == u_in):
+            return np.nan, solves
+        if u_int == u_in:
+            giw_d, giw_o = g_d, g_o
+
+    while abs(u_out - u_in) > tol:
+        u_int = (u_in + u_out) / 2
+        g_d, g_o, _ = solver(beta, u_int, tp, giw_d.copy(), giw_o.copy(),
+                             tau, w_n, conv, **solver_kw)
+        solves += 1
+        if branch_exists(branch, g_d, w_n, threshold):
+            u_in, giw_d, giw_o = u_int, g_d, g_o
+        else:
+            u_out = u_int
+
+    return (u_in + u_out) / 2, solves
+
+
+def coexistence(tp, beta, u_range, tol=1e-3, n_jobs=1, **spinodal_kw):
+    r"""Ends of the coexistence region for many temperatures
+
+    Every spinodal is an independent :func:`spinodal` search, they run in
+    parallel. Above the critical temperature both collapse onto the
+    crossover line, where :math:`-\Im m G_{AA}(0)` crosses the threshold.
+
+    Parameters
+    ----------
+    tp : float
+        Dimer hybridization
+    beta : float or 1D ndarray
+        Inverse temperatures
+    u_range, tol, spinodal_kw :
+        As in :func:`spinodal`
+    n_jobs : int
+        Processes as in :class:`joblib.Parallel`
+
+    Returns
+    -------
+    uc1, uc2 : real ndarrays
+        Ends of the insulating and metallic branches at each temperature
+    """
+    beta = np.atleast_1d(beta)
+    found = Parallel(n_jobs=n_jobs)(
+        delayed(spinodal)(branch, tp, b, u_range, tol, **spinodal_kw)
+        for b in beta for branch in ('insulator', 'metal'))
+    u_c = np.array([u for u, _ in found]).reshape(len(beta), 2)
+    return u_c[:, 0], u_c[:, 1]
@@ -18,6 +18,7 @@ from mpi4py import MPI
 import dmft.common as gf
 import dmft.hirschfye as hf
 import dmft.dimer as dimer
+import dmft.monitor as monitor
 import dmft.plot.hf_dimer as pd
 comm = MPI.COMM_WORLD
 
@@ -74,6 +75,12 @@ def dmft_loop_pm(simulation, U, g_iw_start=None):
                          L=setup['SITES'] * setup['n_tau_mc'],
                          polar=setup['spin_polarization'])
 
+    # Iteration records for rank 0
+    observer = None
+    if comm.rank == 0:
+        observer = monitor.CSVSink(os.path.join(save_dir, 'monitor.csv'))
+    timer = monitor.StageTimer()
+
     for iter_count in range(last_loop, last_loop + setup['Niter']):
         work_dir = os.path.join(save_dir, 'it{:03}'.format(iter_count))
         setup['work_dir'] = work_dir
@@ -89,8 +96,11 @@ def dmft_loop_pm(simulation, U, g_iw_start=None):
             print('On loop', iter_count, 'beta', setup['BETA'],
                   'U', U, 'tp', tp)
 
-        giw_up = gf.gt_fouriertrans(gtu, tau, w_n, pd.gf_tail(gtu, U, mu, tp))
-        giw_dw = gf.gt_fouriertrans(gtd, tau, w_n, pd.gf_tail(gtd, U, mu, tp))
+        with timer.stage('transforms'):
+            giw_up = gf.gt_fouriertrans(gtu, tau, w_n,
+                                        pd.gf_tail(gtu, U, mu, tp))
+            giw_dw = gf.gt_fouriertrans(gtd, tau, w_n,
+                                        pd.gf_tail(gtd, U, mu, tp))
 
         if not setup['AFM']:  # Paramagnetic cleaning
             giw_up[0, 0].real = 0
@@ -100,17 +110,25 @@ def dmft_loop_pm(simulation, U, g_iw_start=None):
             giw_dw = giw_up
 
         # Bethe lattice bath
-        g0iw_up = dimer.mat_2_inv(gmix - 0.25 * giw_up)
-        g0iw_dw = dimer.mat_2_inv(gmix - 0.25 * giw_dw)
+        with timer.stage('self_consistency'):
+            g0iw_up = dimer.mat_2_inv(gmix - 0.25 * giw_up)
+            g0iw_dw = dimer.mat_2_inv(gmix - 0.25 * giw_dw)
 
-        g0tau_up = gf.gw_invfouriertrans(
-            g0iw_up, tau, w_n, pd.gf_tail(g0tau0, 0., mu, tp))
-        g0tau_dw = gf.gw_invfouriertrans(
-            g0iw_dw, tau, w_n, pd.gf_tail(g0tau0, 0., mu, tp))
+        with timer.stage('transforms'):
+            g0tau_up = gf.gw_invfouriertrans(
+                g0iw_up, tau, w_n, pd.gf_tail(g0tau0, 0., mu, tp))
+            g0tau_dw = gf.gw_invfouriertrans(
+                g0iw_dw, tau, w_n, pd.gf_tail(g0tau0, 0., mu, tp))
 
         # Impurity solver
-
-        gtu, gtd = hf.imp_solver([g0tau_dw, g0tau_up], V_field, intm, setup)
+        gtu_old = gtu
+        with timer.stage('solver'):
+            gtu, gtd = hf.imp_solver([g0tau_dw, g0tau_up], V_field, intm,
+                                     setup)
+        monitor.notify(observer, loop=iter_count,
+                       residual=np.abs(gtu - gtu_old).max(),
+                       times=timer.reset(), beta=setup['BETA'], u_int=U,
+                       tp=tp)
 
         # Save output
         if comm.rank == 0:
@@ -10,7 +10,7 @@ To study the stability of the solutions in the coexistence region
 
 from __future__ import division, absolute_import, print_function
 from dmft.common import greenF, tau_wn_setup
-from dmft.ipt_imag import dmft_loop, n_half, ekin, epot, ekin_tau
+from dmft.ipt_imag import dmft_loop, n_half, ekin_batch, epot_batch
 from math import log
 from mpl_toolkits.axes_grid1.inset_locator import mark_inset
 from mpl_toolkits.axes_grid1.inset_locator import zoomed_inset_axes
@@ -45,10 +45,9 @@ def energy(beta, u_range, g_s_results):
     g_iwfree = greenF(w_n)
     mu = fsolve(n_half, 0., beta)[0]
     e_mean = quad(dos.bethe_fermi_ene, -1., 1., args=(1., mu, 0.5, beta))[0]
-    kin = np.asarray([ekin(g_iw, s_iw, beta, w_n, e_mean, g_iwfree)
-                      for g_iw, s_iw in g_s_iw_log])
-    pot = np.asarray([epot(g_iw, s_iw, u, beta, w_n)
-                      for (g_iw, s_iw), u in zip(g_s_iw_log, u_range)])
+    g_iw, s_iw = np.array(g_s_iw_log).transpose(1, 0, 2)
+    kin = ekin_batch(g_iw, s_iw, beta, w_n, e_mean, g_iwfree)
+    pot = epot_batch(g_iw, s_iw, u_range, beta, w_n)
 
     return kin, pot
 
@@ -17,6 +17,7 @@ import numpy as np
 import matplotlib.pylab as plt
 from dmft.ipt_imag import dmft_loop
 from dmft.common import greenF, tau_wn_setup, fit_gf
+from dmft.sweep import coexistence
 
 
 def hysteresis(beta, u_range):
@@ -80,10 +81,15 @@ UC1 = np.array([2.57, 2.57, 2.57, 2.57, 2.55, 2.55,
                 2.55, 2.52, 2.52, 2.49, 2.49, 2.49]) + .02
 UC2 = np.array([3.39, 3.33, 3.24, 3.18, 3.06, 2.97,
                 2.88, 2.78, 2.7, 2.6, 2.54, 2.52])
+# Spinodals computed for a few temperatures, the single band is the
+# dimer without hybridization
+TEMP_C = TEMP[[0, 4, 8]]
+UC1_C, UC2_C = coexistence(0., 1 / TEMP_C, (2.2, 3.6))
 
 plt.plot(crossing, TEMP[:len(crossing)], lw=2)
 plt.plot(UC1, TEMP[:len(crossing)], lw=2)
 plt.plot(UC2, TEMP[:len(crossing)], lw=2)
+plt.plot(UC1_C, TEMP_C, 'o', UC2_C, TEMP_C, 'o')
 plt.xlabel(r'$U/D$')
 plt.ylabel(r'$F$ + $T/D$')
 plt.title('Functional cost to transition to metal')
@@ -115,3 +121,4 @@ plt.title(
 plt.plot(crossing, TEMP[:len(crossing)], lw=2)
 plt.plot(UC1, TEMP[:len(crossing)], lw=2)
 plt.plot(UC2, TEMP[:len(crossing)], lw=2)
+plt.plot(UC1_C, TEMP_C, 'o', UC2_C, TEMP_C, 'o')
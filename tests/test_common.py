@@ -26,6 +26,109 @@ def test_fourier_trasforms(chempot, beta=50., n_matsubara=128):
         assert np.allclose(gwr, g_iomega)
 
 
+def test_fourier_plan_cached():
+    """Plans are shared between calls on the same grid"""
+    plan = gf.fourier_plan(20., 128, 64)
+    assert plan is gf.fourier_plan(20., 128, 64)
+    assert plan is not gf.fourier_plan(20., 128, 64, 4)
+
+
+def test_euler_tail():
+    """The general tail basis matches the tabulated one"""
+    tau, w_n = gf.tau_wn_setup(dict(BETA=20., N_MATSUBARA=32))
+    basis = gf.euler_tail(3, 20., tau)
+    for i in range(3):
+        coef = np.eye(3)[i]
+        assert np.allclose(gf.freq_tail_fourier(coef, 20., tau, w_n)[1],
+                           basis[i])
+
+
+def test_fourier_plan_batch():
+    """Stacked blocks with own tails transform in one call into buffers"""
+    tau, w_n = gf.tau_wn_setup(dict(BETA=50., N_MATSUBARA=128))
+    plan = gf.fourier_plan(50., len(tau), len(w_n))
+    mu = np.array([0., 0.5, -0.8]).reshape(3, 1)
+    giw = gf.greenF(w_n, mu=mu)
+    tail = [1., -mu, 0.25 + mu**2]
+
+    g_tau = np.empty((3, len(tau)))
+    g_iw = np.empty((3, len(w_n)), dtype=np.complex128)
+    assert plan.gw_invfouriertrans(giw, tail, g_tau) is g_tau
+    assert plan.gt_fouriertrans(g_tau, tail, g_iw) is g_iw
+    assert np.allclose(giw, g_iw)
+
+    for i in range(3):
+        tail_i = [1., -mu[i, 0], 0.25 + mu[i, 0]**2]
+        assert np.allclose(gf.gw_invfouriertrans(giw[i], tau, w_n, tail_i),
+                           g_tau[i])
+
+
+@pytest.mark.parametrize("n_tau", [256, 257, 100])
+def test_hermitian_invfourier(n_tau, beta=40.):
+    """The real valued inverse transform matches the complex one, or
+    falls back to it on unsuited grids"""
+    w_n = gf.matsubara_freq(beta, 128)
+    tau = np.arange(n_tau) * beta / n_tau
+    giw = gf.greenF(w_n, mu=0.3) + gf.greenF(w_n, mu=-0.7)
+    tail = [2., 0.4, 1.1]
+    g_tau = gf.gw_invfouriertrans(giw, tau, w_n, tail)
+    assert np.allclose(g_tau, gf.gw_invfouriertrans(giw, tau, w_n, tail,
+                                                    hermitian=True))
+
+
+def test_single_precision_fourier(beta=100.):
+    """Single precision transforms keep their type and the accuracy of
+    float32 thanks to the bounded tails"""
+    tau, w_n = gf.tau_wn_setup(dict(BETA=beta, N_MATSUBARA=512))
+    giw = gf.greenF(w_n, mu=np.array([[0.], [0.4]]))
+    tail = [1., np.array([[0.], [-0.4]]), np.array([[0.25], [0.41]])]
+    g_tau = gf.gw_invfouriertrans(giw, tau, w_n, tail, hermitian=True)
+    g_single = gf.gw_invfouriertrans(giw.astype(np.complex64), tau, w_n,
+                                     tail, hermitian=True)
+    assert g_single.dtype == np.float32
+    assert np.abs(g_single - g_tau).max() < 1e-5
+
+    g_iw = gf.gt_fouriertrans(g_single, tau, w_n, tail)
+    assert g_iw.dtype == np.complex64
+    assert np.allclose(g_iw, gf.gt_fouriertrans(g_tau, tau, w_n, tail),
+                       atol=1e-5)
+
+
+def test_complex_gtau_fourier(beta=50.):
+    """Complex imaginary time functions are transformed in full"""
+    tau, w_n = gf.tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    g_tau = gf.gw_invfouriertrans(gf.greenF(w_n), tau, w_n) + \
+        0.3j * np.sin(np.pi * tau / beta)
+    freq_tail, time_tail = gf.freq_tail_fourier((1., 0., 0.), beta, tau, w_n)
+    ref = beta * np.fft.ifft((g_tau - time_tail) *
+                             np.exp(1j * np.pi * tau / beta))[:len(w_n)] + \
+        freq_tail
+    assert np.allclose(gf.gt_fouriertrans(g_tau, tau, w_n), ref)
+
+
+def test_spline_fourier(beta=50.):
+    """The spline quadrature is accurate on a time grid much coarser than
+    the frequency grid"""
+    w_n = gf.matsubara_freq(beta, 512)
+    giw = gf.greenF(w_n, mu=np.array([[0.], [0.4]]))
+    tail = [1., np.array([[0.], [-0.4]]), np.array([[0.25], [0.41]])]
+    tau = np.arange(128) * beta / 128
+    g_tau = gf.gw_invfouriertrans(giw, tau, w_n, tail)
+    g_spline = gf.gt_fouriertrans(g_tau, tau, w_n, tail, spline=True)
+    assert g_spline.shape == giw.shape
+    assert np.abs(g_spline - giw).max() < 1e-4
+
+
+def test_tail_extend(beta=100.):
+    """The fitted tail continues functions to higher frequencies"""
+    w_n = gf.matsubara_freq(beta, 256)
+    w_fine = gf.matsubara_freq(beta, 1024)
+    giw = gf.greenF(w_fine, mu=np.array([[0.], [0.3]]))
+    extended = gf.tail_extend(giw[:, :256], w_n, w_fine)
+    assert np.array_equal(extended[:, :256], giw[:, :256])
+    assert np.abs(extended - giw).max() < 1e-5
+
+
 def test_fit_gf():
     """Test the interpolation of Green function in Bethe Lattice"""
     w_n = gf.matsubara_freq(100, 3)
@@ -45,6 +148,37 @@ def test_pade():
     assert np.allclose(gw_ref, gw_cont, 1e-3)
 
 
+@pytest.mark.parametrize("precision", ['double', 'long', 25])
+def test_pade_batch(precision):
+    """Pade continues stacked functions at once in all precisions"""
+    if not isinstance(precision, str):
+        pytest.importorskip('mpmath')
+    w_n = gf.matsubara_freq(100., 60)
+    mu = np.array([0., 0.3]).reshape(2, 1)
+    giw = gf.greenF(w_n, mu=mu)
+    omega = np.linspace(-0.5, 0.5, 50)
+    gw_ref = gf.greenF(-1j * omega + 1e-5, mu=mu)
+    gw_cont = gf.pade_continuation(giw, w_n, omega, precision=precision)
+    assert gw_cont.shape == (2, 50)
+    assert np.allclose(gw_ref, gw_cont, 1e-3)
+
+
+def test_pade_ensemble():
+    """Ensemble of Pade continuations on noisy data is causal and close to
+    the semi-circle"""
+    w_n = gf.matsubara_freq(100., 150)
+    rng = np.random.RandomState(2)
+    giw = gf.greenF(w_n) + 1e-6 * rng.randn(len(w_n))
+    omega = np.linspace(-0.7, 0.7, 100)
+    gw_ref = gf.greenF(-1j * omega + 1e-5)
+    g_mean, g_std, accepted = gf.pade_ensemble(giw, w_n, omega, 24,
+                                               n_jobs=2, seed=3)
+    assert 0 < accepted <= 24
+    assert g_std.shape == omega.shape
+    assert np.all(g_mean.imag <= 0)
+    assert np.allclose(gw_ref, g_mean, atol=0.05)
+
+
 @pytest.mark.parametrize("halfbandwidth", [0.5, 1., 2.])
 def test_hilbert_trans_func(halfbandwidth):
     """Test Hilbert transforms of semi-circle"""
@@ -61,6 +195,22 @@ def test_hilbert_trans_func(halfbandwidth):
         w,  halfbandwidth / 2), - ss.imag / np.pi, atol=1e-4)
 
 
+def test_hilbert_trans_batch():
+    """Compiled Bethe kernels broadcast over bandwidths and fill buffers"""
+    w = np.linspace(-3, 3, 2**9) + 1e-3j
+    D = np.array([0.5, 1., 2.]).reshape(3, 1)
+    out = np.empty((3, len(w)), dtype=np.complex128)
+    assert gf.semi_circle_hiltrans(w, D, out=out) is out
+    for i in range(3):
+        assert np.allclose(out[i], gf.semi_circle_hiltrans(w, D[i, 0]))
+
+    w_n = gf.matsubara_freq(50.)
+    sigma = -1j * np.array([0.1, 0.5]).reshape(2, 1) / w_n
+    out = np.empty((2, len(w_n)), dtype=np.complex128)
+    gf.greenF(w_n, sigma, out=out)
+    assert np.allclose(out[1], gf.greenF(w_n, sigma[1]))
+
+
 @pytest.mark.parametrize("halfbandwidth", [0.5, 1., 2.])
 def test_hilbert_trans_integral(halfbandwidth):
     """Test hilbert transform of semi-circle to direct integral"""
@@ -100,3 +250,35 @@ def test_tail_fit_semicirc():
     moment = np.array((-1, 0, 0.25))
     print(fit_moments - moment)
     assert np.allclose(moment, fit_moments, atol=7e-3)
+
+
+def test_tail_moments_batch():
+    """Batched and weighted tail fits recover the moments of each function"""
+    wn = gf.matsubara_freq(50, 80)[40:]
+    moments = np.array([[1., 0.3, 0.5], [0.5, -0.2, 2.], [2., 0., -1.]])
+    giw = gf.tail(1j * wn, moments.T.reshape(3, 3, 1), [1, 2, 3])
+    assert np.allclose(gf.tail_moments(wn, giw), moments)
+
+    noise = np.array([1e-6, 1e-2, 1e-6]).reshape(3, 1)
+    spoiled = giw + noise * np.random.randn(3, len(wn)) * (1 + 1j)
+    sigma = np.ones_like(wn)
+    sigma[::2] = 1e4
+    spoiled[:, ::2] += 0.1
+    fit = gf.tail_moments(wn, spoiled, sigma=sigma * noise)
+    assert np.allclose(fit[[0, 2]], moments[[0, 2]], atol=1e-3)
+
+
+def test_sparse_matsubara():
+    """Sparse grids keep the first frequencies, weights count the dense
+    grid and interpolation recovers it"""
+    beta, n_total = 100., 2048
+    index, w_n, weights = gf.sparse_matsubara(beta, 100, n_total, 40)
+    w_dense = gf.matsubara_freq(beta, n_total)
+    assert np.allclose(w_n, w_dense[index])
+    assert np.allclose(w_n[:100], w_dense[:100])
+    assert weights.sum() == n_total
+    assert np.allclose((weights / w_n**4).sum(), (1 / w_dense**4).sum())
+
+    giw = gf.greenF(w_n, mu=0.2)
+    assert np.allclose(gf.sparse_matsubara_interp(giw, w_n, w_dense),
+                       gf.greenF(w_dense, mu=0.2), atol=1e-8)
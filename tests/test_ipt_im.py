@@ -6,10 +6,14 @@ Created on Tue Nov 25 12:44:23 2014
 """
 
 from __future__ import division, absolute_import, print_function
+import warnings
 import numpy as np
 from dmft import ipt_imag
 from dmft.common import greenF, tau_wn_setup
+import dmft.common as gf
 import dmft.dimer as dimer
+import dmft.mixing as mixing
+import dmft.sweep as sweep
 import slaveparticles.quantum.operators as op
 import pytest
 
@@ -64,6 +68,53 @@ def test_selfconsistency(tp):
     assert np.allclose(giwo, g0iwo)
 
 
+def test_energy_sparse_grid(beta=200., tp=0.3):
+    """Energies on a sparse frequency grid match the dense sums"""
+    w_n = gf.matsubara_freq(beta, 4096)
+    giwd, giwo = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+    _, ws_n, weights = gf.sparse_matsubara(beta, 256, 4096, 64)
+    gswd, gswo = dimer.gf_met(ws_n, 0., tp, 0.5, 0.)
+
+    e_kin = dimer.ekin(giwd, giwo, w_n, tp, beta)
+    assert abs(e_kin - dimer.ekin(gswd, gswo, ws_n, tp, beta,
+                                  weights=weights)) < 1e-5
+    assert abs(dimer.epot(giwd, w_n, beta, tp**2 + 0.25, e_kin, 0.) -
+               dimer.epot(gswd, ws_n, beta, tp**2 + 0.25, e_kin, 0.,
+                          weights)) < 1e-5
+
+
+def test_energy_batch():
+    """Batched energies on padded rows of different temperature, U and
+    tp match the scalar functions"""
+    beta = np.array([20., 50., 80.])
+    tp = np.array([0.2, 0.3, 0.5])
+    u_int = np.array([1.5, 2.5, 3.])
+    n_freq = (4 * beta).astype(int)
+    w_n = gf.matsubara_freq(beta[:, None], n_freq.max())
+    giwd, giwo = dimer.gf_met(w_n, 0., tp[:, None], 0.5, 0.)
+    sigma = u_int[:, None]**2 / 4 / (1j * w_n + 2j)
+    g_iw = gf.greenF(w_n, sigma)
+    g_free = gf.greenF(w_n)
+
+    e_kin = dimer.ekin_batch(giwd, giwo, w_n, tp, beta, n_freq=n_freq)
+    e_pot = dimer.epot_batch(giwd, w_n, beta, tp**2 + 0.25, e_kin, u_int,
+                             n_freq)
+    i_kin = ipt_imag.ekin_batch(g_iw, sigma, beta, w_n, -0.3,
+                                g_free, n_freq)
+    i_pot = ipt_imag.epot_batch(g_iw, sigma, u_int, beta, w_n, n_freq)
+    for i, n in enumerate(n_freq):
+        args = w_n[i, :n], tp[i], beta[i]
+        ref = dimer.ekin(giwd[i, :n], giwo[i, :n], *args)
+        assert np.allclose(e_kin[i], ref)
+        assert np.allclose(e_pot[i], dimer.epot(
+            giwd[i, :n], w_n[i, :n], beta[i], tp[i]**2 + .25, ref, u_int[i]))
+        assert np.allclose(i_kin[i], ipt_imag.ekin(
+            g_iw[i, :n], sigma[i, :n], beta[i], w_n[i, :n], -0.3,
+            g_free[i, :n]))
+        assert np.allclose(i_pot[i], ipt_imag.epot(
+            g_iw[i, :n], sigma[i, :n], u_int[i], beta[i], w_n[i, :n]))
+
+
 @pytest.mark.parametrize("u_int, result", ipt_ref_res)
 def test_ipt_pm_g(u_int, result, beta=50., n_matsubara=64):
     """Test the solution of the single band impurity problem"""
@@ -87,6 +138,201 @@ def test_ipt_dimer_pm_g(u_int, result, beta=50.):
     assert np.allclose(result, giw_d, atol=3e-3)
 
 
+@pytest.mark.parametrize("mixer", ['anderson', 'broyden'])
+def test_ipt_dimer_mixer(mixer, beta=100., tp=0.3, u_int=2.5):
+    """Accelerated loops reach the same metallic solution in fewer steps"""
+    tau, w_n = tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    giw_d, giw_o = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+    ref_d, ref_o, ref_loops = dimer.ipt_dmft_loop(
+        beta, u_int, tp, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-7)
+    acc_d, acc_o, loops = dimer.ipt_dmft_loop(
+        beta, u_int, tp, giw_d, giw_o, tau, w_n, 1e-7, mixer=mixer)
+
+    assert loops < ref_loops / 2
+    assert np.allclose(ref_d, acc_d, atol=1e-5)
+    assert np.allclose(ref_o, acc_o, atol=1e-5)
+
+
+def test_ipt_dimer_batch(beta=50.):
+    """The batched loop reproduces each point of the sequential one"""
+    tau, w_n = tau_wn_setup(dict(BETA=beta, N_MATSUBARA=128))
+    u_int = np.array([0.5, 2., 2.5, 3.5])
+    tp = np.array([0., 0.3, 0.5, 0.8])
+    giw_d, giw_o = dimer.gf_met(w_n, 0., 0., 0.5, 0.)
+    b_d, b_o, b_loops = dimer.ipt_dmft_loop_batch(
+        beta, u_int, tp, giw_d, giw_o, tau, w_n, 1e-5)
+
+    for i, (u, t) in enumerate(zip(u_int, tp)):
+        g_d, g_o, loops = dimer.ipt_dmft_loop(
+            beta, u, t, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-5)
+        assert loops == b_loops[i]
+        assert np.allclose(g_d, b_d[i])
+        assert np.allclose(g_o, b_o[i])
+
+
+def test_sweep_hysteresis(beta=100., tp=0.3):
+    """Predictor seeds keep both branches of the coexistence region and
+    save iterations"""
+    path = sweep.sweep_path(np.arange(2.3, 2.9, 0.05), tp, beta)
+
+    def grid(beta):
+        return tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    (met, met_loops), (ins, ins_loops) = sweep.hysteresis(
+        path, order=1, conv=1e-6, grid=grid)
+    (ref, ref_loops), _ = sweep.hysteresis(path, order=0, conv=1e-6,
+                                           grid=grid)
+
+    assert met_loops.sum() < ref_loops.sum()
+    for (g_d, _, _), (r_d, _, _) in zip(met, ref):
+        assert np.allclose(g_d, r_d, atol=1e-4)
+    assert met[-1][0][0].imag < -1
+    assert ins[0][0][0].imag > -0.5
+
+
+def test_insulator_seed(beta=100.):
+    """The insulating seed is the causal atomic limit with a gap of 4"""
+    w_n = gf.matsubara_freq(beta, 256)
+    giw_d, giw_o = sweep.insulator_seed(w_n, 0.3)
+    assert np.all(giw_d.imag < 0)
+    assert np.allclose(giw_d, 1 / (1j * w_n - 4 / (1j * w_n)))
+    assert np.allclose(giw_o, 0)
+
+
+def test_ipt_dimer_newton(beta=100., tp=0.3):
+    """Newton-Krylov converges close to Uc2 in a fraction of the map
+    evaluations of the plain loop"""
+    tau, w_n = tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    giw_d, giw_o = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+    giw_d, giw_o, _ = dimer.ipt_dmft_loop(beta, 3.31, tp, giw_d, giw_o, tau,
+                                          w_n, 1e-12)
+    ref_d, ref_o, ref_loops = dimer.ipt_dmft_loop(
+        beta, 3.3149, tp, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-10)
+    g_d, g_o, loops = dimer.ipt_dmft_newton(
+        beta, 3.3149, tp, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-10)
+
+    assert loops < ref_loops / 4
+    assert np.allclose(g_d, ref_d, atol=1e-5)
+    assert np.allclose(g_o, ref_o, atol=1e-5)
+
+
+def test_ipt_dimer_newton_loop_kw(beta=100., tp=0.3):
+    """Loop keywords reach the warmup and the loop, krylov options the
+    root finder"""
+    tau, w_n = tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    giw_d, giw_o = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+    giw_d, giw_o, _ = dimer.ipt_dmft_loop(beta, 3.31, tp, giw_d, giw_o, tau,
+                                          w_n, 1e-12)
+
+    def stages(**kwargs):
+        records = []
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            g_d, g_o, loops = dimer.ipt_dmft_newton(
+                beta, 3.3149, tp, giw_d.copy(), giw_o.copy(), tau, w_n,
+                1e-10, observer=records.append, **kwargs)
+        return [r.get('stage') for r in records], g_d, g_o, loops
+
+    steps, _, _, _ = stages(krylov_options=dict(maxiter=1))
+    assert 0 < steps.count('newton') < 10
+
+    steps, g_d, g_o, loops = stages(mixer='anderson', precision='double')
+    ref_d, ref_o, _ = dimer.ipt_dmft_loop(
+        beta, 3.3149, tp, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-10,
+        mixer='anderson')
+    assert 'newton' not in steps
+    assert loops < 50
+    assert np.allclose(g_d, ref_d, atol=1e-5)
+    assert np.allclose(g_o, ref_o, atol=1e-5)
+
+
+def test_spinodal(beta=100., tp=0.3):
+    """Bisection finds the ends of both branches with a few warm started
+    solves"""
+    def grid(beta):
+        return tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    uc2, solves = sweep.spinodal('metal', tp, beta, (2.4, 3.6), 1e-3,
+                                 grid=grid)
+    assert abs(uc2 - 3.3149) < 1e-3
+    assert solves < 15
+    uc1, _ = sweep.spinodal('insulator', tp, beta, (2., 2.4), 1e-3,
+                            grid=grid)
+    assert 2.15 < uc1 < 2.16
+    assert np.isnan(sweep.spinodal('insulator', tp, beta, (2.4, 3.6),
+                                   grid=grid)[0])
+
+
+def test_ipt_dimer_multigrid(beta=100., tp=0.3):
+    """Coarse grids seed the fine one without changing the solution and
+    the automatic grid reaches the requested cutoff convergence"""
+    tau, w_n = tau_wn_setup(dict(BETA=beta, N_MATSUBARA=1024))
+    for u_int in [2., 3.5]:
+        giw_d, giw_o = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+        ref_d, ref_o, _ = dimer.ipt_dmft_loop(
+            beta, u_int, tp, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-10)
+        g_d, g_o, _ = dimer.ipt_dmft_multigrid(beta, u_int, tp, giw_d, giw_o,
+                                               tau, w_n, 1e-10)
+        assert np.allclose(g_d, ref_d, atol=1e-7)
+        assert np.allclose(g_o, ref_o, atol=1e-7)
+
+        g_d, g_o, tau_a, w_a, _ = dimer.ipt_dmft_auto_grid(beta, u_int, tp,
+                                                           tol=1e-5)
+        n_freq = min(len(w_a), len(w_n))
+        assert len(tau_a) == 2 * len(w_a)
+        assert np.allclose(g_d[:n_freq], ref_d[:n_freq], atol=2e-5)
+
+
+def test_screen(beta=100., tp=0.3):
+    """Single precision screening classifies as the double precision
+    sweep and the branch test, and refines the points around the
+    transition"""
+    path = sweep.sweep_path(np.arange(2.5, 3.5, 0.1), tp, beta)
+
+    def grid(beta):
+        return tau_wn_setup(dict(BETA=beta, N_MATSUBARA=256))
+    sols, _ = sweep.sweep(path, conv=1e-5, grid=grid)
+    ref = np.array([sweep.fermi_level_dos(g_d, w_n) for g_d, _, w_n in sols])
+    screened, dos, refined, _ = sweep.screen(path, grid=grid)
+
+    metal = sweep.DOS_THRESHOLD
+    assert np.array_equal(dos > metal, ref > metal)
+    assert [sweep.branch_exists('metal', g_d, w_n)
+            for g_d, _, w_n in screened] == list(dos > metal)
+    assert np.allclose(dos, ref, atol=1e-3)
+    assert 0 < refined.sum() < len(path)
+    for (g_d, _, _), fine in zip(screened, refined):
+        assert g_d.dtype == (np.complex128 if fine else np.complex64)
+
+
+@pytest.mark.parametrize("n_matsubara, n_tau",
+                         [(128, 256), (129, 258), (128, 257), (128, 200)])
+def test_ipt_workspace(n_matsubara, n_tau, beta=50., tp=0.3):
+    """The in place iteration matches the allocating loop, also on grids
+    unsuited for the real transforms"""
+    w_n = gf.matsubara_freq(beta, n_matsubara)
+    tau = np.arange(n_tau) * beta / n_tau
+    work = dimer.IPTWorkspace(tau, w_n)
+    assert work.hermitian == (n_tau % 2 == 0 and 2 * n_matsubara <= n_tau)
+    for u_int in [1.5, 3.]:
+        giw_d, giw_o = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+        ref_d, ref_o, ref_loops = dimer.ipt_dmft_loop(
+            beta, u_int, tp, giw_d.copy(), giw_o.copy(), tau, w_n, 1e-6)
+        g_d, g_o, loops = work.solve(beta, u_int, tp, giw_d, giw_o, tau, w_n,
+                                     1e-6)
+        assert loops == ref_loops
+        assert np.allclose(g_d, ref_d)
+        assert np.allclose(g_o, ref_o)
+
+
+def test_mixer_divergence_fallback():
+    """A diverging residual resets the history to a damped step"""
+    mixer = mixing.AndersonMixer(fallback=0.1)
+    x_in = np.zeros(3)
+    mixer(x_in, np.ones(3))
+    x_next = mixer(x_in, np.full(3, 100.))
+    assert np.allclose(x_next, 10.)
+    assert not mixer._x_in
+
+
 def test_sorted_basis():
     basis = dimer.sorted_basis()
     for i in range(4):
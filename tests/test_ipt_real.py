@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+r"""
+Tests of the real frequency IPT solvers
+"""
+# Author: Óscar Nájera
+
+from __future__ import division, absolute_import, print_function
+import numpy as np
+import scipy.signal as signal
+import pytest
+import dmft.common as gf
+import dmft.ipt_real as ipt
+
+
+def sigma_fftconvolve(a_w, nf, u_int):
+    """Second order diagram by successive convolutions"""
+    a_p = a_w * nf
+    a_m = a_w * nf[::-1]
+    app = signal.fftconvolve(a_p[::-1], a_m, mode='same')
+    amm = signal.fftconvolve(a_m[::-1], a_p, mode='same')
+    return -np.pi * u_int**2 * (signal.fftconvolve(a_p, amm, mode='same') +
+                                signal.fftconvolve(a_m, app, mode='same'))
+
+
+@pytest.mark.parametrize("n_w", [2**11, 2**11 + 1])
+def test_spectral_convolution(n_w, beta=50.):
+    """Fourier space products reproduce the successive convolutions of
+    spectral functions contained in the grid"""
+    w = np.linspace(-8, 8, n_w)
+    nf = gf.fermi_dist(w, beta)
+    a_w = np.array([np.exp(-(w - .5)**2) / np.sqrt(np.pi),
+                    w * np.exp(-w**2)])
+
+    isi = ipt.sigma(a_w, nf, 2.)
+    scale = np.abs(isi).max()
+    for a_c, isi_c in zip(a_w, isi):
+        assert np.allclose(isi_c, sigma_fftconvolve(a_c, nf, 2.),
+                           atol=1e-12 * scale)
+
+    a_p = a_w[0] * nf
+    app = signal.fftconvolve(a_p, a_p, mode='same')
+    appp = signal.fftconvolve(a_p, app, mode='same')
+    assert np.allclose(ipt.ph_hf_sigma(a_w[0], nf, 2.),
+                       -4 * np.pi * (appp + appp[::-1]), atol=1e-12 * scale)
+    assert ipt.convolution_plan(n_w) is ipt.convolution_plan(n_w)
+
+
+@pytest.mark.parametrize("exact", [False, True])
+def test_kramers_kronig(exact):
+    """Real part of a Lorentzian from its imaginary part"""
+    w = np.linspace(-40, 40, 2**11)
+    sigma = 1 / (w + 1j) + 0.5 / (w - 2 + 0.5j)
+    kk = ipt.KramersKronig(w, exact)
+    out = np.empty((2, len(w)))
+    assert kk(np.array([sigma.imag, 2 * sigma.imag]), out=out) is out
+    assert np.allclose(out[1], 2 * out[0])
+    assert np.allclose(out[0][512:-512], sigma.real[512:-512], atol=2e-3)
+    if not exact:
+        hilbert = signal.hilbert(sigma.imag, len(w) * 4)[:len(w)].imag
+        assert np.allclose(out[0], -hilbert)
+
+
+def test_kramers_kronig_exact_kernel():
+    """Non-equispaced grids use the exact kernel"""
+    w = np.sinh(np.linspace(-4, 4, 801)) * 40 / np.sinh(4)
+    sigma = 1 / (w + 1j)
+    kk = ipt.kramers_kronig_plan(w)
+    assert kk.exact
+    assert np.allclose(kk(sigma.imag)[200:-200], sigma.real[200:-200],
+                       atol=1e-4)
+
+
+def test_sinh_grid():
+    w = ipt.sinh_grid(6., 401, 2e-3)
+    assert np.allclose(w, -w[::-1])
+    assert np.isclose(w[-1], 6.)
+    assert np.isclose(w[201] - w[200], 2e-3, rtol=1e-3)
+    assert np.all(np.diff(w, 2)[200:] > 0)
+
+
+def test_grid_convolution(beta=50.):
+    """Self-energy on a sinh grid matches the one of the equispaced grid
+    with FFTs shorter than it"""
+    w_u = np.linspace(-6, 6, 6001)
+    w = ipt.sinh_grid(6., 401, 2e-3)
+    spectral = np.exp(-(w_u - .5)**2) / np.sqrt(np.pi)
+    isi_u = ipt.sigma(spectral, gf.fermi_dist(w_u, beta), 2.) * \
+        (w_u[1] - w_u[0])**2
+    convolution = ipt.grid_convolution(w)
+    isi = convolution.sigma(
+        np.exp(-(w - .5)**2) / np.sqrt(np.pi), gf.fermi_dist(w, beta), 2.)
+    assert np.allclose(isi, np.interp(w, w_u, isi_u), atol=1e-3)
+    assert convolution.fft_fine + convolution.fft_coarse < len(w_u)
+
+    spectral = np.exp(-w_u**2) / np.sqrt(np.pi)
+    isi_u = ipt.ph_hf_sigma(spectral, gf.fermi_dist(w_u, beta), 2.) * \
+        (w_u[1] - w_u[0])**2
+    isi = convolution.ph_hf_sigma(np.exp(-w**2) / np.sqrt(np.pi),
+                                  gf.fermi_dist(w, beta), 2.)
+    assert np.allclose(isi, np.interp(w, w_u, isi_u), atol=1e-3)
+
+
+def test_dimer_dmft_sinh_grid(beta=100., u_int=2.2, tp=0.3):
+    """Metallic dimer on a sinh grid and on an equispaced grid"""
+    solutions = []
+    for w, d_w in [(np.linspace(-6, 6, 2**12 + 1), 12 / 2**12),
+                   (ipt.sinh_grid(6., 401, 2e-3), None)]:
+        seed = gf.semi_circle_hiltrans(w + 1e-2j)
+        (gss, _), _ = ipt.dimer_dmft(u_int, tp, gf.fermi_dist(w, beta), w,
+                                     d_w, seed, seed, conv=1e-6)
+        solutions.append((w, gss))
+    (w_u, gss_u), (w, gss) = solutions
+    assert np.allclose(gss.imag, np.interp(w, w_u, gss_u.imag), atol=1e-2)
+
+
+def test_dimer_dmft_batch(u_int=2.2, tp=0.3):
+    """Every temperature of the batch is the solution of dimer_dmft"""
+    w = np.linspace(-6, 6, 2**11)
+    d_w = w[1] - w[0]
+    betas = np.array([20., 50., 100.])
+    nfp = gf.fermi_dist(w, betas[:, None])
+    seed = gf.semi_circle_hiltrans(w + 5e-3j)
+    (gss, gsa), (ss, _), loops = ipt.dimer_dmft_batch(u_int, tp, nfp, w, d_w,
+                                                      seed, seed)
+    assert gss.shape == nfp.shape
+    for row, nf in enumerate(nfp):
+        (gss_r, gsa_r), (ss_r, _) = ipt.dimer_dmft(u_int, tp, nf, w, d_w,
+                                                   seed, seed)
+        assert np.allclose(gss[row], gss_r)
+        assert np.allclose(gsa[row], gsa_r)
+        assert np.allclose(ss[row], ss_r)
+    assert np.all(loops > 1)
+
+
+@pytest.mark.parametrize("d_w", [12 / 2**11, None])
+def test_dimer_dmft_workers(d_w, beta=50., u_int=2.2, tp=0.3):
+    """Threaded FFTs give the same solution"""
+    w = np.linspace(-6, 6, 2**11 + 1) if d_w else ipt.sinh_grid(6., 401, 2e-3)
+    nfp = gf.fermi_dist(w, beta)
+    seed = gf.semi_circle_hiltrans(w + 5e-3j)
+    (gss, gsa), _ = ipt.dimer_dmft(u_int, tp, nfp, w, d_w, seed, seed)
+    (gss_t, gsa_t), _ = ipt.dimer_dmft(u_int, tp, nfp, w, d_w, seed, seed,
+                                       workers=2)
+    assert np.allclose(gss, gss_t)
+    assert np.allclose(gsa, gsa_t)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+r"""
+Tests for the Legendre representation of Green functions
+"""
+
+from __future__ import division, absolute_import, print_function
+import numpy as np
+import pytest
+import dmft.common as gf
+from dmft.legendre import LegendreGf
+
+
+@pytest.mark.parametrize("chempot", [0, 0.3])
+def test_legendre_round_trip(chempot, beta=50.):
+    """Both projections reproduce the Green function in both domains"""
+    tau, w_n = gf.tau_wn_setup(dict(BETA=beta, N_MATSUBARA=1024))
+    mu = np.array([chempot, -0.5]).reshape(2, 1)
+    giw = gf.greenF(w_n, mu=mu)
+    g_tau = gf.gw_invfouriertrans(giw, tau, w_n, [1., -mu, 0.25 + mu**2])
+
+    from_iw = LegendreGf.from_iw(giw, w_n, beta, 70)
+    assert np.allclose(from_iw.tau(tau), g_tau, atol=1e-5)
+
+    from_tau = LegendreGf.from_tau(g_tau, tau, beta, 70)
+    assert np.allclose(from_tau.iw(w_n), giw, atol=1e-5)
+    assert np.allclose(from_tau.coef, from_iw.coef, atol=1e-4)
+
+
+def test_legendre_save(tmpdir):
+    """Only the coefficients go to disk"""
+    w_n = gf.matsubara_freq(50., 512)
+    g_l = LegendreGf.from_iw(gf.greenF(w_n), w_n, 50., 60)
+    fname = str(tmpdir.join('gl.npz'))
+    g_l.save(fname)
+    loaded = LegendreGf.load(fname)
+    assert loaded.beta == 50.
+    assert np.allclose(loaded.iw(w_n[:10]), g_l.iw(w_n[:10]))
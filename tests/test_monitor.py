@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+r"""
+Tests for the loop instrumentation
+"""
+
+from __future__ import division, absolute_import, print_function
+import csv
+import h5py
+import numpy as np
+import dmft.common as gf
+import dmft.dimer as dimer
+import dmft.monitor as monitor
+
+
+def test_dimer_loop_records(tmpdir, beta=50., tp=0.3):
+    """The loop reports every iteration to all sinks"""
+    tau, w_n = gf.tau_wn_setup(dict(BETA=beta, N_MATSUBARA=128))
+    giw_d, giw_o = dimer.gf_met(w_n, 0., tp, 0.5, 0.)
+    memory = monitor.MemorySink()
+    csv_file = str(tmpdir.join('monitor.csv'))
+    h5_file = str(tmpdir.join('monitor.h5'))
+    _, _, loops = dimer.ipt_dmft_loop(
+        beta, 2., tp, giw_d, giw_o, tau, w_n, 1e-6,
+        observer=[memory, monitor.CSVSink(csv_file),
+                  monitor.HDF5Sink(h5_file, 'U2')])
+
+    assert np.array_equal(memory.column('loop'), np.arange(1, loops + 1))
+    assert memory.records[-1]['converged']
+    assert not memory.records[0]['converged']
+    residual = memory.column('residual')
+    assert residual[-1] < residual[0]
+    assert np.all(memory.column('time_solver') >=
+                  memory.column('time_transforms'))
+
+    with open(csv_file) as data:
+        rows = list(csv.DictReader(data))
+    assert len(rows) == loops
+    assert np.allclose([float(row['residual']) for row in rows], residual)
+    with h5py.File(h5_file, 'r') as store:
+        assert np.allclose(store['U2/residual'][:, 0], residual)
+
+
+def test_stage_timer():
+    """Nested and repeated stages accumulate"""
+    timer = monitor.StageTimer()
+    for _ in range(2):
+        with timer.stage('solver'):
+            with monitor.stage(timer, 'transforms'):
+                pass
+    with monitor.stage(None, 'ignored'):
+        pass
+    times = timer.reset()
+    assert sorted(times) == ['solver', 'transforms']
+    assert times['solver'] >= times['transforms']
+    assert timer.times == {}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+r"""
+Tests for the solution store
+"""
+
+from __future__ import division, absolute_import, print_function
+import functools
+import os
+import numpy as np
+import pytest
+from joblib import Parallel, delayed
+import dmft.common as gf
+import dmft.dimer as dimer
+import dmft.mixing as mixing
+import dmft.sweep as sweep
+from dmft.store import SolutionStore
+
+
+def _put(path, u_int):
+    SolutionStore(path).put('ipt', dict(giw=np.full(4, u_int)),
+                            u_int=u_int, beta=10.)
+
+
+def test_store_entries(tmpdir):
+    """Entries are found by canonical parameters, also when written by
+    parallel workers creating the store, and the nearest one by the
+    chosen parameters"""
+    path = os.path.join(str(tmpdir), 'store')
+    Parallel(n_jobs=2)(delayed(_put)(path, u_int) for u_int in range(6))
+    store = SolutionStore(path)
+
+    assert len(store.entries()) == 6
+    assert not [name for name in os.listdir(path) if name.endswith('.tmp')]
+    assert np.all(store.get('ipt', u_int=3 + 1e-14, beta=10)['giw'] == 3)
+    assert store.get('ipt', u_int=3, beta=20.) is None
+    arrays, params = store.nearest('ipt', ('u_int',), u_int=3.4, beta=10.)
+    assert params['u_int'] == 3. and np.all(arrays['giw'] == 3)
+    assert store.nearest('ipt', ('u_int',), u_int=3.4, beta=20.) is None
+
+
+def test_store_eviction(tmpdir):
+    """The least recently used entries leave a full store"""
+    store = SolutionStore(str(tmpdir), max_bytes=None)
+    for u_int in range(4):
+        store.put('ipt', dict(giw=np.zeros(1000)), u_int=u_int)
+        os.utime(os.path.join(str(tmpdir), store.key('ipt', u_int=u_int) +
+                              '.npz'), (u_int, u_int))
+    store.get('ipt', u_int=0)
+
+    store.max_bytes = 2.5 * os.path.getsize(
+        os.path.join(str(tmpdir), store.key('ipt', u_int=0) + '.npz'))
+    store.evict()
+    assert [store.get('ipt', u_int=u) is not None for u in range(4)] == \
+        [True, False, False, True]
+
+
+def test_store_keeps_new_entry(tmpdir):
+    """A full store evicts older entries, never the one just written, and
+    refuses entries larger than its limit"""
+    path = str(tmpdir)
+    store = SolutionStore(path, max_bytes=None)
+    store.put('ipt', dict(giw=np.zeros(1000)), u_int=0)
+    entry = os.path.getsize(os.path.join(path, store.key('ipt', u_int=0) +
+                                         '.npz'))
+
+    store = SolutionStore(path, max_bytes=1.5 * entry)
+    os.utime(os.path.join(path, store.key('ipt', u_int=0) + '.npz'), (0, 0))
+    store.put('ipt', dict(giw=np.ones(1000)), u_int=1)
+    assert store.get('ipt', u_int=0) is None
+    assert np.all(store.get('ipt', u_int=1)['giw'] == 1)
+
+    with pytest.raises(ValueError):
+        store.put('ipt', dict(giw=np.zeros(4000)), u_int=2)
+    assert store.get('ipt', u_int=2) is None
+    assert store.get('ipt', u_int=1) is not None
+    assert not [name for name in os.listdir(path) if name.endswith('.tmp')]
+
+
+def test_store_solver_names(tmpdir):
+    """Partial solvers are told apart by their arguments, solvers without
+    a name are refused"""
+    store = SolutionStore(str(tmpdir))
+    ipt_10 = functools.partial(dimer.ipt_dmft_loop, t=.5, conv=1e-10)
+    ipt_12 = functools.partial(dimer.ipt_dmft_loop, t=.5, conv=1e-12)
+    store.put(ipt_10, dict(giw=np.ones(2)), u_int=2.)
+
+    assert store.get(functools.partial(dimer.ipt_dmft_loop, conv=1e-10,
+                                       t=0.5), u_int=2.) is not None
+    assert store.get(ipt_12, u_int=2.) is None
+    with pytest.raises(TypeError):
+        store.put(mixing.LinearMixer(), dict(giw=np.ones(2)))
+
+
+def test_sweep_store(tmpdir, beta=50., tp=0.3):
+    """A stored sweep is read instead of solved"""
+    def grid(beta):
+        return gf.tau_wn_setup(dict(BETA=beta, N_MATSUBARA=128))
+    store = SolutionStore(str(tmpdir))
+    path = sweep.sweep_path(np.arange(2., 3., 0.2), tp, beta)
+    first, loops = sweep.sweep(path, grid=grid, store=store)
+    again, cached = sweep.sweep(path, grid=grid, store=store)
+
+    assert loops.all() and not cached.any()
+    for (g_d, g_o, _), (c_d, c_o, _) in zip(first, again):
+        assert np.array_equal(g_d, c_d) and np.array_equal(g_o, c_o)
+    assert sweep.sweep(path, 'insulator', grid=grid, store=store)[1].all()